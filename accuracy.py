@@ -0,0 +1,78 @@
+"""Accuracy of CAPTCHA providers judged by the outcome pages of the flows
+
+The flow knows for sure whether the taps of a round are right: FunCaptcha
+shows the wrong result page, reCAPTCHA asks to select all matching images
+again or expires. Every round with a known outcome is recorded here, and the
+flows choose the resolver of the provider with the best recent accuracy::
+
+    resolver = ACCURACY.choose([DeathByCaptchaUI(), TwoCaptchaAPI()])
+"""
+import logging
+import threading
+
+from collections import defaultdict, deque
+
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_provider_name(resolver):
+    return getattr(resolver, 'provider', type(resolver).__name__)
+
+
+class ProviderAccuracy:
+    """Recent outcomes of rounds per provider
+
+    :param window: the number of recent rounds to judge the accuracy
+    :param min_rounds: the accuracy is unknown until so many rounds, and the
+        provider is preferred to be tried
+    """
+
+    def __init__(self, window=50, min_rounds=5):
+        self.window = window
+        self.min_rounds = min_rounds
+        self.lock = threading.Lock()
+        self.outcomes = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, provider, correct):
+        """Record the outcome of a round solved by the provider"""
+        with self.lock:
+            self.outcomes[provider].append(bool(correct))
+        METRICS.incr('rounds', provider=provider,
+                outcome='correct' if correct else 'wrong')
+        LOGGER.debug(f'Accuracy of {provider}: {self.accuracy(provider)}')
+
+    def accuracy(self, provider):
+        """Get the rate of correct rounds, or None if too few rounds"""
+        with self.lock:
+            outcomes = self.outcomes.get(provider)
+            if not outcomes or len(outcomes) < self.min_rounds:
+                return None
+            return sum(outcomes) / len(outcomes)
+
+    def choose(self, resolvers):
+        """Choose the resolver whose provider has the best accuracy
+
+        The providers with unknown accuracy come first, and the earlier one
+        wins the tie.
+        """
+        def score(resolver):
+            accuracy = self.accuracy(get_provider_name(resolver))
+            return 1.0 if accuracy is None else accuracy
+
+        return max(resolvers, key=score)
+
+    def snapshot(self):
+        with self.lock:
+            return {provider: {'rounds': len(outcomes),
+                'correct': sum(outcomes)}
+                for provider, outcomes in self.outcomes.items()}
+
+    def reset(self):
+        with self.lock:
+            self.outcomes.clear()
+
+
+ACCURACY = ProviderAccuracy()
@@ -0,0 +1,70 @@
+"""Benchmark of the capture of the captcha image by every frame source
+
+The screenshot source captures the element of the fake driver by a command
+with the simulated round trip latency, while the MJPEG source crops it from
+the frames of a local MJPEG server which serves the sample images::
+
+    python -m benchmark.capture --captures 50 --latency 0.15 --scale 0.5
+
+It reports the median and p95 latency of every capture.
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+from pathlib import Path
+
+from benchmark.fake_driver import SAMPLE_IMAGES, FakeDriver
+from benchmark.fake_mjpeg import FakeMjpegServer
+from frame_source import MjpegFrameSource, ScreenshotFrameSource
+
+
+ELEMENT_BOX = (40, 400, 1040, 1700)
+
+
+def measure(source, element, work_dir, captures):
+    times = []
+    for i in range(captures):
+        start = time.perf_counter()
+        source.save_element(element, str(work_dir / f'{i}.png'))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--captures', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.15,
+            help='seconds of the round trip of every driver command')
+    parser.add_argument('--scale', type=float, default=1,
+            help='scale of the captured images to the screen')
+    parser.add_argument('--fps', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    screen_size = (1080, 1920)
+    driver = FakeDriver({'game': {'form': {'box': ELEMENT_BOX}}}, 'game',
+            screen_size=screen_size, latency=args.latency)
+    element = driver.find_element(value='form')
+    server = FakeMjpegServer(SAMPLE_IMAGES, args.fps, screen_size,
+            args.scale).start()
+    sources = {
+        'screenshot': ScreenshotFrameSource(args.scale),
+        'mjpeg': MjpegFrameSource(server.url, args.scale).start(),
+    }
+    work_dir = Path(tempfile.mkdtemp(prefix='captcha_capture_'))
+    try:
+        for name, source in sources.items():
+            median, p95 = measure(source, element, work_dir, args.captures)
+            print(f'{name:<12} p50={median * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms')
+    finally:
+        for source in sources.values():
+            source.close()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
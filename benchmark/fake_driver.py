@@ -0,0 +1,198 @@
+"""Fake Appium driver which serves screenshots from the sample images
+
+The driver is a small state machine: every page is a dict of the locators
+present in it, clicking an element can move to another page, and taps
+(TouchAction) are recorded and can finish the game after some rounds.
+"""
+import itertools
+import logging
+import time
+
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+
+LOGGER = logging.getLogger(__name__)
+
+SAMPLE_IMAGE_DIR = Path(__file__).parent.parent / 'dbc_api_python3'
+SAMPLE_IMAGES = [SAMPLE_IMAGE_DIR / name
+        for name in ('test.jpg', 'test2.jpg', '2x4.png')]
+
+
+class FakeElement:
+
+    def __init__(self, driver, name, box, text='', click_to=None):
+        """
+        :param box: (left, upper, right, lower) on the screen
+        :param click_to: the page to go after clicking it
+        """
+        self.driver = driver
+        self.name = name
+        self.box = box
+        self.text = text
+        self.click_to = click_to
+
+    @property
+    def location(self):
+        return {'x': self.box[0], 'y': self.box[1]}
+
+    @property
+    def size(self):
+        return {'width': self.box[2] - self.box[0],
+                'height': self.box[3] - self.box[1]}
+
+    @property
+    def rect(self):
+        return {**self.location, **self.size}
+
+    def click(self):
+        self.driver.record('click', self.name)
+        if self.click_to:
+            self.driver.go(self.click_to)
+
+    def screenshot(self, filename):
+        self.driver.record('screenshot', self.name)
+        self.driver.screen().crop(self.box).save(filename)
+        return True
+
+    def get_attribute(self, name):
+        if name == 'bounds':
+            return '[{},{}][{},{}]'.format(*self.box)
+        return None
+
+    def find_elements(self, by=By.XPATH, value=None):
+        return []
+
+    def find_elements_by_xpath(self, xpath):
+        return self.find_elements(By.XPATH, xpath)
+
+
+class FakeDriver:
+    """Fake driver with scripted pages
+
+    :param pages: {page name: {locator: FakeElement keyword arguments}}
+    :param rounds: the number of taps to finish the game, then go to the
+        page done_page
+    :param latency: seconds of every driver command, to simulate the
+        round trip to the Appium server
+    """
+
+    def __init__(self, pages, start_page, rounds=0, done_page=None,
+            images=SAMPLE_IMAGES, screen_size=(1080, 1920), latency=0.0):
+        self.pages = {page: {locator: FakeElement(self, locator, **spec)
+            for locator, spec in elements.items()}
+            for page, elements in pages.items()}
+        self.page = start_page
+        self.rounds = rounds
+        self.done_page = done_page
+        self.images = itertools.cycle(images)
+        self.screen_size = screen_size
+        self.latency = latency
+        # the pages are keyed by XPath, so the Targets are looked up by it
+        self.capabilities = {'automationName': 'fake'}
+        self.commands = []
+        self._screen = None
+        self.next_screen()
+
+    def record(self, command, target=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.commands.append((command, target))
+
+    def go(self, page):
+        LOGGER.debug(f'Fake driver goes to page: {page}')
+        self.page = page
+
+    def next_screen(self):
+        """Show the next sample image on the screen"""
+        with Image.open(next(self.images)) as img:
+            self._screen = img.convert('RGB').resize(self.screen_size)
+
+    def screen(self):
+        return self._screen
+
+    def find_element(self, by=By.ID, value=None):
+        self.record('find_element', value)
+        element = self.pages[self.page].get(value)
+        if element is None:
+            raise NoSuchElementException(f'No element: {value}')
+        return element
+
+    def find_elements(self, by=By.ID, value=None):
+        self.record('find_elements', value)
+        element = self.pages[self.page].get(value)
+        return [element] if element else []
+
+    def find_element_by_xpath(self, xpath):
+        return self.find_element(By.XPATH, xpath)
+
+    def find_elements_by_xpath(self, xpath):
+        return self.find_elements(By.XPATH, xpath)
+
+    def execute(self, command, params=None):
+        """Receive TouchAction.perform()"""
+        self.record('touch_action', params)
+        actions = (params or {}).get('actions', [])
+        if any(action.get('action') == 'tap' for action in actions):
+            self.rounds -= 1
+            self.next_screen()
+            if self.rounds <= 0 and self.done_page:
+                self.go(self.done_page)
+        return {'value': None}
+
+    def get_screenshot_as_png(self):
+        self.record('screenshot')
+        buffer = BytesIO()
+        self._screen.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def build_funcaptcha_driver(ui_class, rounds=3, **kwargs):
+    """Fake driver for FuncaptchaAndroidUI: start page, game, then done"""
+    game_box = (90, 500, 990, 1400)
+    pages = {
+        'start': {
+            ui_class.verify_heading_xpath: {'box': (90, 300, 990, 400)},
+            ui_class.verify_first_page_frame_xpath: {'box': (40, 200, 1040, 1700)},
+            ui_class.verify_button_xpath: {'box': (390, 1500, 690, 1600),
+                'click_to': 'game'},
+        },
+        'game': {
+            ui_class.captcha_form_xpath: {'box': (40, 200, 1040, 1700)},
+            ui_class.captcha_img_form_xpath: {'box': game_box},
+            ui_class.captcha_img_form_game_header_xpath: {'box': (90, 400, 990, 500)},
+        },
+        'done': {},
+    }
+    return FakeDriver(pages, 'start', rounds=rounds, done_page='done', **kwargs)
+
+
+def build_recaptcha_driver(ui_class, **kwargs):
+    """Fake driver for RecaptchaAndroidUI: checkbox, one static round, verified"""
+    form_box = (40, 400, 1040, 1700)
+    pages = {
+        'start': {
+            ui_class.not_robot_checkbox_xpath: {'box': (90, 300, 190, 400),
+                'click_to': 'challenge'},
+            ui_class.verify_first_page_frame_xpath: {'box': (40, 200, 1040, 500)},
+        },
+        'challenge': {
+            ui_class.captcha_form_xpath: {'box': form_box},
+            ui_class.captcha_instruction_xpath: {'box': (40, 400, 1040, 600),
+                'text': 'Select all images with cars'},
+            ui_class.captcha_img_xpath: {'box': (40, 600, 1040, 1500)},
+            ui_class.verify_button_xpath: {'box': (790, 1550, 1010, 1650),
+                'click_to': 'verified'},
+        },
+        'verified': {
+            ui_class.not_robot_checkbox_xpath: {'box': (90, 300, 190, 400),
+                'text': "You are verified I'm not a robot"},
+            ui_class.continue_button_xpath: {'box': (390, 1500, 690, 1600),
+                'click_to': 'done'},
+        },
+        'done': {},
+    }
+    return FakeDriver(pages, 'start', **kwargs)
@@ -0,0 +1,97 @@
+"""Local stand-in of the MJPEG screenshot server of UiAutomator2
+
+It serves the image files as frames of a multipart MJPEG stream at a fixed
+frame rate, cycling through them::
+
+    server = FakeMjpegServer(SAMPLE_IMAGES, fps=10, screen_size=(1080, 1920))
+    server.start()
+    source = MjpegFrameSource(server.url).start()
+    ...
+    server.stop()
+"""
+import itertools
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from utils import Image
+
+
+LOGGER = logging.getLogger(__name__)
+
+BOUNDARY = 'BoundaryString'
+
+
+def load_frames(image_files, screen_size=None, scale=1, quality=75):
+    """Encode the image files as JPEG frames of the (scaled) screen size"""
+    frames = []
+    for image_file in image_files:
+        with Image.open(image_file) as img:
+            img = img.convert('RGB')
+            size = screen_size or img.size
+            img = img.resize((int(size[0] * scale), int(size[1] * scale)))
+            buffer = BytesIO()
+            img.save(buffer, format='JPEG', quality=quality)
+            frames.append(buffer.getvalue())
+    return frames
+
+
+class _MjpegHandler(BaseHTTPRequestHandler):
+
+    frames = None
+    fps = 10
+    stopped = None
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type',
+                f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+        self.end_headers()
+        try:
+            for frame in itertools.cycle(self.frames):
+                if self.stopped.is_set():
+                    break
+                self.wfile.write(f'--{BOUNDARY}\r\nContent-type: image/jpg\r\n'
+                        f'Content-Length: {len(frame)}\r\n\r\n'.encode())
+                self.wfile.write(frame + b'\r\n')
+                self.wfile.flush()
+                time.sleep(1 / self.fps)
+        except (BrokenPipeError, ConnectionResetError):
+            LOGGER.debug('MJPEG client disconnected')
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+
+class FakeMjpegServer:
+    """Serve the image files as an MJPEG stream on localhost
+
+    :param scale: scale of the frames to the screen, i.e. mjpegScalingFactor
+    """
+
+    def __init__(self, image_files, fps=10, screen_size=None, scale=1,
+            host='127.0.0.1', port=0):
+        self.host = host
+        self.stopped = threading.Event()
+        handler = type('MjpegHandler', (_MjpegHandler,), {
+            'frames': load_frames(image_files, screen_size, scale),
+            'fps': fps, 'stopped': self.stopped})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.server.server_port}/'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        LOGGER.info(f'Fake MJPEG server: {self.url}')
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,236 @@
+"""Local stand-in of the DBC CAPTCHA server
+
+It speaks the DBC HTTP API (``/api/user``, ``/api/captcha``,
+``/api/captcha/<id>``, ``/api/captcha/<id>/report``) and the socket JSON
+protocol (``login``, ``user``, ``upload``, ``captcha``, ``report``), and
+solves every uploaded CAPTCHA after a random time from a log-normal
+distribution.
+
+Usage::
+
+    server = FakeSolverServer(solve_time_median=2, error_rate=0.05)
+    server.start()
+    server.patch_dbc_client()   # let deathbycaptcha talk to this server
+    ...
+    server.stop()
+"""
+import itertools
+import json
+import logging
+import math
+import random
+import re
+import socketserver
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LOGGER = logging.getLogger(__name__)
+
+TERMINATOR = b'\r\n'
+
+
+class FakeSolver:
+    """The CAPTCHA store and answering logic shared by HTTP and socket APIs"""
+
+    def __init__(self, solve_time_median=2.0, solve_time_sigma=0.5,
+            error_rate=0.0, blank_rate=0.0, rate=0.139, balance=1000.0,
+            coordinates='[[30.5, 40.5]]', indexes='[1]'):
+        """
+        :param solve_time_median: median of solve time in seconds
+        :param solve_time_sigma: sigma of log-normal distribution of solve time
+        :param error_rate: rate of uploads rejected due to service overload
+        :param blank_rate: rate of CAPTCHAs solved with blank text
+        :param coordinates: answer of coordinates API (type=2)
+        :param indexes: answer of image group API (type=3)
+        """
+        self.solve_time_median = solve_time_median
+        self.solve_time_sigma = solve_time_sigma
+        self.error_rate = error_rate
+        self.blank_rate = blank_rate
+        self.rate = rate
+        self.balance = balance
+        self.coordinates = coordinates
+        self.indexes = indexes
+
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.captchas = {}  # cid -> (ready time, text)
+        self.stats = {'requests': 0, 'uploads': 0, 'polls': 0, 'reports': 0,
+                'rejected': 0, 'upload_bytes': 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def get_user(self):
+        return {'user': 1, 'rate': self.rate, 'balance': self.balance,
+                'is_banned': False}
+
+    def upload(self, captcha_type, size):
+        """Store a CAPTCHA, return its details or None if overloaded"""
+        self.count('upload_bytes', size)
+        if random.random() < self.error_rate:
+            self.count('rejected')
+            return None
+
+        if random.random() < self.blank_rate:
+            text = ''
+        elif str(captcha_type) == '3':
+            text = self.indexes
+        else:
+            text = self.coordinates
+        solve_time = random.lognormvariate(
+                math.log(self.solve_time_median), self.solve_time_sigma)
+        with self.lock:
+            cid = next(self.ids)
+            self.captchas[cid] = (time.time() + solve_time, text)
+            self.stats['uploads'] += 1
+            self.balance -= self.rate
+        return {'captcha': cid, 'text': '', 'is_correct': True}
+
+    def get_captcha(self, cid):
+        self.count('polls')
+        with self.lock:
+            if cid not in self.captchas:
+                return {'captcha': 0}
+            ready_time, text = self.captchas[cid]
+        if time.time() < ready_time:
+            text = ''
+        # blank text after solving is marked as incorrect, like DBC does
+        return {'captcha': cid, 'text': text,
+                'is_correct': bool(text) or time.time() < ready_time}
+
+    def report(self, cid):
+        self.count('reports')
+        return {'captcha': cid, 'is_correct': False}
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+
+    solver = None
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.solver.count('requests')
+        match = re.fullmatch(r'/api/captcha/(\d+)', self.path)
+        if match:
+            self._reply(200, self.solver.get_captcha(int(match.group(1))))
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        self.solver.count('requests')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.rstrip('/')
+        if path == '/api/user':
+            self._reply(200, self.solver.get_user())
+        elif path == '/api/captcha':
+            match = re.search(rb'name="type"\r\n\r\n(\d+)', body) or re.search(
+                    rb'(?:^|&)type=(\d+)', body)
+            captcha = self.solver.upload(
+                    match.group(1).decode() if match else '0', len(body))
+            if captcha is None:
+                self._reply(503)
+            else:
+                self._reply(200, captcha)
+        elif re.fullmatch(r'/api/captcha/\d+/report', path):
+            self._reply(200, self.solver.report(int(path.split('/')[3])))
+        else:
+            self._reply(404)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+
+    solver = None
+
+    def handle(self):
+        logged_in = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            self.solver.count('requests')
+            request = json.loads(line.rstrip(TERMINATOR))
+            cmd = request.get('cmd')
+            if cmd == 'login':
+                logged_in = True
+                response = self.solver.get_user()
+            elif not logged_in:
+                response = {'error': 'not-logged-in'}
+            elif cmd == 'user':
+                response = self.solver.get_user()
+            elif cmd == 'upload':
+                response = self.solver.upload(request.get('type', 0),
+                        len(request.get('captcha', '')))
+                if response is None:
+                    response = {'error': 'service-overload'}
+            elif cmd == 'captcha':
+                response = self.solver.get_captcha(int(request['captcha']))
+            elif cmd == 'report':
+                response = self.solver.report(int(request['captcha']))
+            else:
+                response = {'error': 'unknown-command'}
+            self.wfile.write(json.dumps(response).encode() + TERMINATOR)
+
+
+class FakeSolverServer:
+    """Run the HTTP and socket APIs of a FakeSolver on localhost"""
+
+    def __init__(self, host='127.0.0.1', http_port=0, socket_port=0, **kwargs):
+        self.host = host
+        self.solver = FakeSolver(**kwargs)
+
+        http_handler = type('HttpHandler', (_HttpHandler,), {'solver': self.solver})
+        socket_handler = type('SocketHandler', (_SocketHandler,),
+                {'solver': self.solver})
+        self.http_server = ThreadingHTTPServer((host, http_port), http_handler)
+        self.socket_server = socketserver.ThreadingTCPServer(
+                (host, socket_port), socket_handler)
+        self.socket_server.daemon_threads = True
+
+    @property
+    def http_base_url(self):
+        return f'http://{self.host}:{self.http_server.server_port}/api'
+
+    @property
+    def socket_port(self):
+        return self.socket_server.server_address[1]
+
+    def start(self):
+        for server in (self.http_server, self.socket_server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        LOGGER.info(f'Fake solver server: {self.http_base_url}, '
+                f'socket port: {self.socket_port}')
+        return self
+
+    def stop(self):
+        for server in (self.http_server, self.socket_server):
+            server.shutdown()
+            server.server_close()
+
+    def patch_dbc_client(self, poll_interval_scale=1.0):
+        """Point the DBC API clients to this server
+
+        :param poll_interval_scale: scale the polling intervals of decode()
+        """
+        from dbc_api_python3 import deathbycaptcha
+
+        deathbycaptcha.HTTP_BASE_URL = self.http_base_url
+        deathbycaptcha.SOCKET_HOST = self.host
+        deathbycaptcha.SOCKET_PORTS = [self.socket_port]
+        deathbycaptcha.POLLS_INTERVAL = [intvl * poll_interval_scale
+                for intvl in deathbycaptcha.POLLS_INTERVAL]
+        deathbycaptcha.DFLT_POLL_INTERVAL *= poll_interval_scale
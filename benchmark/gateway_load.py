@@ -0,0 +1,100 @@
+"""Load the resolver gateway with many clients on localhost
+
+The gateway resolves by a warmed up pool of DBC clients against the fake
+solver server, and every worker resolves the sample images through its own
+GatewayResolver, over HTTP or a Unix socket::
+
+    python -m benchmark.gateway_load --solves 50 --concurrency 8 --unix-socket
+
+With --same-image, all workers send the same image, as many devices getting
+the same challenge at once, which is coalesced and cached by the gateway.
+"""
+import argparse
+import shutil
+import tempfile
+
+from pathlib import Path
+
+from benchmark.fake_driver import SAMPLE_IMAGES
+from benchmark.fake_server import FakeSolverServer
+from benchmark.run import collect_report, print_report, run_parallel
+from gateway import Gateway, GatewayResolver, GatewayServer
+from metrics import METRICS
+
+
+def bench_gateway(server, gateway_server, work_dir, solves, concurrency,
+        same_image, timeout):
+    """Resolve the sample images through the gateway, return the report"""
+    images = [SAMPLE_IMAGES[0]] if same_image else SAMPLE_IMAGES
+
+    def solve(i):
+        # the gateway may reduce the image, so send a copy of it
+        img_file = work_dir / f'{i}_{images[i % len(images)].name}'
+        shutil.copyfile(images[i % len(images)], img_file)
+        if gateway_server.unix_socket:
+            resolver = GatewayResolver(unix_socket=gateway_server.unix_socket,
+                    timeout=timeout)
+        else:
+            resolver = GatewayResolver(gateway_server.url, timeout=timeout)
+        try:
+            with METRICS.span('solve'):
+                return resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                        str(img_file), retry_times=0, timeout=timeout)
+        finally:
+            resolver.close()
+
+    METRICS.reset()
+    requests_before = server.solver.stats['requests']
+    elapsed, successes = run_parallel(solve, solves, concurrency)
+    transport = 'unix' if gateway_server.unix_socket else 'http'
+    return collect_report(f'gateway({transport})', server, solves, elapsed,
+            successes, requests_before)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--solves', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--client-type', default='socket',
+            choices=('http', 'socket'))
+    parser.add_argument('--unix-socket', action='store_true',
+            help='serve the gateway on a Unix socket instead of HTTP')
+    parser.add_argument('--same-image', action='store_true',
+            help='send the same image from all workers')
+    parser.add_argument('--cache-ttl', type=int, default=60)
+    parser.add_argument('--solve-time', type=float, default=1.0,
+            help='median solve time (seconds) of the fake server')
+    parser.add_argument('--poll-scale', type=float, default=1.0,
+            help='scale the polling intervals of the DBC clients')
+    parser.add_argument('--timeout', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    from verify import DeathByCaptchaUI
+
+    server = FakeSolverServer(solve_time_median=args.solve_time).start()
+    server.patch_dbc_client(poll_interval_scale=args.poll_scale)
+    METRICS.enable(keep_samples=True)
+    work_dir = Path(tempfile.mkdtemp(prefix='captcha_gateway_load_'))
+    resolver = DeathByCaptchaUI('benchmark', 'benchmark', timeout=args.timeout,
+            client_type=args.client_type, pool_size=args.pool_size)
+    resolver.warm_up()
+    gateway_server = GatewayServer(
+            Gateway(resolver, work_dir / 'gateway', args.cache_ttl), port=0,
+            unix_socket=str(work_dir / 'gateway.sock') if args.unix_socket
+            else None).start()
+    try:
+        report = bench_gateway(server, gateway_server, work_dir, args.solves,
+                args.concurrency, args.same_image, args.timeout)
+    finally:
+        METRICS.disable()
+        gateway_server.stop()
+        resolver.close()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
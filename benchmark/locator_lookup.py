@@ -0,0 +1,136 @@
+"""Benchmark of the element lookup by every locator strategy
+
+The fake driver holds a hierarchy of Android views like a WebView captcha
+page. As UiAutomator2 does, an XPath lookup dumps the whole hierarchy to
+XML and evaluates the XPath on it, while ID, accessibility id and
+UiAutomator selector lookups walk the live hierarchy and stop at the first
+match::
+
+    python -m benchmark.locator_lookup --nodes 3000 --repeat 50
+
+It reports the median latency of every compiled locator of the targets.
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+import xml.etree.ElementTree as ET
+
+from locators import By, LocatorSet, Target
+
+
+SELECTOR_METHOD_PATTERN = re.compile(r'\.(\w+)\(("(?:[^"\\]|\\.)*"|\d+)\)')
+SELECTOR_ATTRIBUTES = {'resourceId': 'resource-id', 'className': 'class',
+        'description': 'content-desc', 'index': 'index'}
+
+TARGETS = [
+    Target('verify button', resource_id='home_children_button',
+        class_name='android.widget.Button'),
+    Target('captcha form', resource_id='rc-imageselect',
+        class_name='android.view.View'),
+    Target('reload button', description='Get a new challenge'),
+    Target('dialog button', resource_id='android:id/button1'),
+]
+
+
+def build_hierarchy(nodes, max_children=6, seed=1):
+    """Build a random hierarchy of views with the targets at deep leaves"""
+    rnd = random.Random(seed)
+    root = ET.Element('hierarchy', {'index': '0', 'class': 'hierarchy'})
+    webview = ET.SubElement(root, 'android.webkit.WebView',
+            {'index': '0', 'class': 'android.webkit.WebView'})
+    parents = [webview]
+    for i in range(nodes):
+        parent = rnd.choice(parents[-50:])
+        tag = rnd.choice(('android.view.View',) * 5 + ('android.widget.Image',
+            'android.widget.TextView'))
+        node = ET.SubElement(parent, tag, {'index': str(len(parent)),
+            'class': tag, 'resource-id': '', 'content-desc': ''})
+        if len(parent) >= max_children:
+            parents.remove(parent)
+        parents.append(node)
+
+    for target in TARGETS:
+        leaf = rnd.choice(parents[-len(parents) // 4:])
+        tag = target.class_name or 'android.widget.Button'
+        ET.SubElement(leaf, tag, {'index': str(len(leaf)), 'class': tag,
+            'resource-id': target.resource_id or '',
+            'content-desc': target.description or ''})
+    return root
+
+
+def parse_selector(selector):
+    """Parse the UiAutomator selector into the attributes of every level"""
+    levels = []
+    for part in selector.split('.childSelector('):
+        attributes = {}
+        for method, value in SELECTOR_METHOD_PATTERN.findall(part):
+            if value.startswith('"'):
+                value = re.sub(r'\\(.)', r'\1', value[1:-1])
+            attributes[SELECTOR_ATTRIBUTES[method]] = value
+        levels.append(attributes)
+    return levels
+
+
+def iter_matches(node, attributes):
+    for element in node.iter():
+        if all(element.get(name) == value for name, value in attributes.items()):
+            yield element
+
+
+class FakeHierarchyDriver:
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self.capabilities = {'automationName': 'UiAutomator2'}
+
+    def find_elements(self, by=By.ID, value=None):
+        if self.latency:
+            time.sleep(self.latency)
+        if by == By.XPATH:
+            dumped = ET.fromstring(ET.tostring(self.root))
+            return dumped.findall('.' + value if value.startswith('/') else value)
+        if by == By.ID:
+            return list(iter_matches(self.root, {'resource-id': value}))[:1]
+        if by == By.ACCESSIBILITY_ID:
+            return list(iter_matches(self.root, {'content-desc': value}))[:1]
+        if by == By.ANDROID_UIAUTOMATOR:
+            nodes = [self.root]
+            for attributes in parse_selector(value):
+                nodes = [match for node in nodes
+                        for match in iter_matches(node, attributes)
+                        if match is not node][:1]
+            return nodes
+        raise ValueError(f'Unsupported locator strategy: {by}')
+
+
+def measure(driver, by, value, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        found = driver.find_elements(by=by, value=value)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), bool(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0,
+            help='seconds of the round trip of every lookup')
+    args = parser.parse_args(argv)
+
+    driver = FakeHierarchyDriver(build_hierarchy(args.nodes), args.latency)
+    for target in TARGETS:
+        print(f'== {target.name}')
+        for by, value in LocatorSet(target.name, target).locators:
+            latency, found = measure(driver, by, value, args.repeat)
+            print(f'   {by:<22} {latency * 1000:8.3f}ms'
+                    f" {'found' if found else 'NOT FOUND'}  {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Replay the recorded solvings of a run manifest against the fake server
+
+The captured images of the manifest are pushed through the preprocessing
+(restrict_image_size) and the resolver stack without any device::
+
+    python -m benchmark.replay manifest --client-type socket --repeat 3
+
+so the same recordings give reproducible performance baselines. The images
+of the reCAPTCHA tiles are replayed as whole images.
+"""
+import argparse
+import logging
+import shutil
+import tempfile
+
+from collections import Counter
+from pathlib import Path
+
+from benchmark.fake_server import FakeSolverServer
+from benchmark.run import collect_report, print_report, run_parallel
+from manifest import read_manifest
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def load_solves(manifest_dir):
+    """Get the recorded solvings which have images"""
+    return [record for record in read_manifest(manifest_dir, 'solve')
+            if record.get('image')]
+
+
+def summarize_outcomes(manifest_dir):
+    """Count the recorded results of solvings and outcomes of rounds"""
+    results = Counter(str(record.get('result'))
+            for record in read_manifest(manifest_dir, 'solve'))
+    outcomes = Counter('correct' if record['correct'] else 'wrong'
+            for record in read_manifest(manifest_dir, 'outcome'))
+    return results, outcomes
+
+
+def replay(manifest_dir, server, work_dir, repeat=1, concurrency=1,
+        client_type='http', timeout=30):
+    """Resolve every recorded image again, return the report"""
+    from verify import DeathByCaptchaUI
+
+    blob_dir = Path(manifest_dir) / 'blobs'
+    solves = load_solves(manifest_dir) * repeat
+    if not solves:
+        raise ValueError(f'No recorded images in the manifest: {manifest_dir}')
+
+    def solve(i):
+        record = solves[i]
+        # the preprocessing writes the reduced image next to it
+        img_file = work_dir / f'{i}_{record["image"]}'
+        shutil.copyfile(blob_dir / record['image'], img_file)
+        resolver = DeathByCaptchaUI('benchmark', 'benchmark', timeout=timeout,
+                client_type=client_type)
+        resolver.coalesce_uploads = False
+        try:
+            with METRICS.span('solve'):
+                return resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                        str(img_file),
+                        reduce_factor=record.get('reduce_factor', 1),
+                        reduce_step=record.get('reduce_step', 0.125),
+                        retry_times=0, timeout=timeout)
+        finally:
+            resolver.close()
+
+    METRICS.reset()
+    requests_before = server.solver.stats['requests']
+    elapsed, successes = run_parallel(solve, len(solves), concurrency)
+    return collect_report(f'replay({client_type})', server, len(solves),
+            elapsed, successes, requests_before)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', help='directory of the run manifest')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--client-type', default='http',
+            choices=('http', 'socket'))
+    parser.add_argument('--solve-time', type=float, default=1.0,
+            help='median solve time (seconds) of the fake server')
+    parser.add_argument('--poll-scale', type=float, default=1.0,
+            help='scale the polling intervals of the DBC clients')
+    parser.add_argument('--timeout', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    results, outcomes = summarize_outcomes(args.manifest)
+    print(f'== Recorded: solvings {dict(results)}, rounds {dict(outcomes)}')
+
+    server = FakeSolverServer(solve_time_median=args.solve_time).start()
+    server.patch_dbc_client(poll_interval_scale=args.poll_scale)
+    METRICS.enable(keep_samples=True)
+    work_dir = Path(tempfile.mkdtemp(prefix='captcha_replay_'))
+    try:
+        report = replay(args.manifest, server, work_dir, args.repeat,
+                args.concurrency, args.client_type, args.timeout)
+    finally:
+        METRICS.disable()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Offline benchmark of the DBC clients and the solving flows
+
+Everything runs on localhost against the fake solver server and the fake
+Appium driver, so no real service, account or device is needed::
+
+    python -m benchmark.run --solves 50 --concurrency 8 --solve-time 2
+
+It reports throughput, p50/p95/p99 of every stage, requests per solve, and
+encode time per sample image.
+"""
+import argparse
+import base64
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmark.fake_driver import SAMPLE_IMAGES
+from benchmark.fake_driver import build_funcaptcha_driver, build_recaptcha_driver
+from benchmark.fake_server import FakeSolverServer
+from dbc_api_python3 import deathbycaptcha
+from metrics import METRICS
+from utils import Image, restrict_image_size
+
+
+LOGGER = logging.getLogger(__name__)
+
+PERCENTS = (50, 95, 99)
+
+# the sample images are under the size limits, so an enlarged one is
+# encoded too, which has to be reduced
+OVERSIZED_SCALE = 2
+
+
+def run_parallel(func, solves, concurrency):
+    """Call func(i) for every solve, return (elapsed seconds, successes)"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(func, range(solves)))
+    return time.perf_counter() - start, sum(1 for result in results if result)
+
+
+def collect_report(name, server, solves, elapsed, successes, requests_before):
+    """Build the report of one benchmark from METRICS and the server stats"""
+    snapshot = METRICS.snapshot()
+    stages = {}
+    for stage, record in sorted(snapshot['durations'].items()):
+        stages[stage] = {'count': record['count'],
+                **{f'p{percent}': METRICS.percentile(stage, percent)
+                    for percent in PERCENTS}}
+    return {
+        'name': name,
+        'solves': solves,
+        'successes': successes,
+        'elapsed': elapsed,
+        'throughput': solves / elapsed if elapsed else None,
+        'requests_per_solve': (server.solver.stats['requests'] -
+            requests_before) / solves,
+        'stages': stages,
+        'counters': snapshot['counters'],
+    }
+
+
+def bench_client(client_class, server, image_file, solves, concurrency,
+        timeout):
+    """Benchmark decode() of a DBC client, one client per worker thread"""
+    local = threading.local()
+
+    def solve(i):
+        if not hasattr(local, 'client'):
+            local.client = client_class('benchmark', 'benchmark')
+            local.client.metrics = METRICS
+        with METRICS.span('solve'):
+            try:
+                return local.client.decode(str(image_file), type=2,
+                        timeout=timeout)
+            except Exception as e:
+                LOGGER.debug(f'Failed to solve: {e}')
+
+    METRICS.reset()
+    requests_before = server.solver.stats['requests']
+    elapsed, successes = run_parallel(solve, solves, concurrency)
+    return collect_report(client_class.__name__, server, solves, elapsed,
+            successes, requests_before)
+
+
+def bench_flow(ui_class, build_driver, server, work_dir, solves, concurrency,
+        client_type, timeout, driver_latency):
+    """Benchmark resolve_all_with_coordinates_api with the fake driver"""
+    from verify import DeathByCaptchaUI
+
+    def solve(i):
+        driver = build_driver(ui_class, latency=driver_latency)
+        resolver = DeathByCaptchaUI('benchmark', 'benchmark', timeout=timeout,
+                client_type=client_type)
+        # every flow uploads, instead of sharing the same sample uploads
+        resolver.coalesce_uploads = False
+        ui = ui_class(driver, resolver=resolver, wait_timeout=0.2)
+        ui.captcha_image_path = work_dir
+        with METRICS.span('solve'):
+            return ui.resolve_all_with_coordinates_api(tap_interval=0,
+                    timeout=timeout)
+
+    METRICS.reset()
+    requests_before = server.solver.stats['requests']
+    elapsed, successes = run_parallel(solve, solves, concurrency)
+    return collect_report(f'{ui_class.__name__}({client_type})', server,
+            solves, elapsed, successes, requests_before)
+
+
+def make_oversized_image(work_dir, scale=OVERSIZED_SCALE):
+    """Save the first sample image enlarged as PNG, return the file"""
+    image_file = work_dir / f'oversized_x{scale}.png'
+    with Image.open(SAMPLE_IMAGES[0]) as img:
+        img.resize((img.width * scale, img.height * scale)).save(image_file)
+    return image_file
+
+
+def bench_encoding(work_dir, restrict_size):
+    """Measure reducing and base64 encoding time of every sample image"""
+    report = {}
+    for image in SAMPLE_IMAGES + [make_oversized_image(work_dir)]:
+        image_file = work_dir / f'encode_{image.name}'
+        shutil.copy(image, image_file)
+
+        start = time.perf_counter()
+        reduced_img_file, reduce_factor = restrict_image_size(str(image_file),
+                1, 0.125, restrict_size)
+        reduce_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(reduced_img_file, 'rb') as f:
+            base64.b64encode(f.read())
+        encode_time = time.perf_counter() - start
+
+        report[image.name] = {'reduce_time': reduce_time,
+                'base64_time': encode_time, 'reduce_factor': reduce_factor}
+    return report
+
+
+def print_report(report):
+    print(f"== {report['name']}: {report['successes']}/{report['solves']} solved"
+            f" in {report['elapsed']:.2f}s, {report['throughput']:.2f} solves/s,"
+            f" {report['requests_per_solve']:.1f} requests/solve")
+    for stage, record in report['stages'].items():
+        percentiles = ' '.join(f'p{percent}={record[f"p{percent}"] * 1000:.1f}ms'
+                for percent in PERCENTS)
+        print(f"   {stage:<20} n={record['count']:<6} {percentiles}")
+    for counter, value in sorted(report['counters'].items()):
+        print(f'   {counter:<20} {value:g}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--solves', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--solve-time', type=float, default=1.0,
+            help='median solve time (seconds) of the fake server')
+    parser.add_argument('--solve-time-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--poll-scale', type=float, default=1.0,
+            help='scale the polling intervals of the DBC clients')
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--driver-latency', type=float, default=0.0,
+            help='seconds of every fake driver command')
+    parser.add_argument('--flows', action='store_true',
+            help='also benchmark the resolve_all_with_coordinates_api flows')
+    parser.add_argument('--json', help='write the reports to the JSON file')
+    args = parser.parse_args(argv)
+
+    server = FakeSolverServer(solve_time_median=args.solve_time,
+            solve_time_sigma=args.solve_time_sigma,
+            error_rate=args.error_rate).start()
+    server.patch_dbc_client(poll_interval_scale=args.poll_scale)
+    METRICS.enable(keep_samples=True)
+
+    reports = []
+    work_dir = Path(tempfile.mkdtemp(prefix='captcha_bench_'))
+    try:
+        for client_class in (deathbycaptcha.HttpClient,
+                deathbycaptcha.SocketClient):
+            reports.append(bench_client(client_class, server, SAMPLE_IMAGES[0],
+                args.solves, args.concurrency, args.timeout))
+
+        if args.flows:
+            from verify import FuncaptchaAndroidUI, RecaptchaAndroidUI
+
+            for client_type in ('http', 'socket'):
+                reports.append(bench_flow(FuncaptchaAndroidUI,
+                    build_funcaptcha_driver, server, work_dir, args.solves,
+                    args.concurrency, client_type, args.timeout,
+                    args.driver_latency))
+                reports.append(bench_flow(RecaptchaAndroidUI,
+                    build_recaptcha_driver, server, work_dir, args.solves,
+                    args.concurrency, client_type, args.timeout,
+                    args.driver_latency))
+
+        encoding = bench_encoding(work_dir, 1024 * 180)
+    finally:
+        METRICS.disable()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for report in reports:
+        print_report(report)
+    print('== Encoding per image')
+    for name, record in encoding.items():
+        print(f"   {name:<20} reduce={record['reduce_time'] * 1000:.1f}ms"
+                f" base64={record['base64_time'] * 1000:.1f}ms"
+                f" reduce_factor={record['reduce_factor']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'reports': reports, 'encoding': encoding}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
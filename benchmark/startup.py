@@ -0,0 +1,91 @@
+"""Startup benchmark: the time to import the modules in fresh interpreters
+
+    python -m benchmark.startup --runs 10 verify
+
+It reports the min and median import time of every module, and which heavy
+modules are imported eagerly by it, which should be imported lazily on
+first use instead. Use --importtime to show the slowest imports reported by
+"python -X importtime".
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from pathlib import Path
+
+
+PROJECT_DIR = Path(__file__).parent.parent
+
+# modules which should only be imported on first use
+HEAVY_MODULES = (
+    'twocaptcha',
+    'requests',
+    'PIL.Image',
+    'dbc_api_python3.deathbycaptcha',
+    'appium.webdriver',
+    'selenium.webdriver',
+    'selenium.webdriver.support.ui',
+)
+
+IMPORT_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed,
+    'eager': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure_import(module, python=sys.executable):
+    """Import the module in a fresh interpreter, return its measurement"""
+    code = IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([python, '-c', code], cwd=PROJECT_DIR,
+            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def slowest_imports(module, top=15, python=sys.executable):
+    """Get the slowest imports by cumulative microseconds"""
+    stderr = subprocess.run([python, '-X', 'importtime', '-c',
+        f'import {module}'], cwd=PROJECT_DIR, capture_output=True,
+        text=True, check=True).stderr
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        records.append((int(cumulative_us), name.rstrip()))
+    return sorted(records, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=['verify'])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true',
+            help='show the slowest imports of every module')
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        try:
+            results = [measure_import(module) for i in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f'== {module}: failed to import\n{e.stderr}')
+            continue
+
+        times = [result['elapsed'] * 1000 for result in results]
+        print(f'== {module}: min={min(times):.1f}ms'
+                f' median={statistics.median(times):.1f}ms'
+                f' runs={args.runs}')
+        print(f"   eagerly imported: {', '.join(results[0]['eager']) or 'none'}")
+
+        if args.importtime:
+            for cumulative_us, name in slowest_imports(module):
+                print(f'   {cumulative_us / 1000:8.1f}ms {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Budget of time, money and uploads for one CAPTCHA solving session
+
+Usage::
+
+    budget = SessionBudget.from_resolver(resolver, max_seconds=120,
+            max_uploads=20, max_cents=3)
+    funcaptcha = FuncaptchaAndroidUI(driver, resolver, budget=budget)
+    funcaptcha.resolve_all_with_coordinates_api()
+
+Every stage consults the budget, and the session is abandoned as soon as it
+cannot succeed within it, so the device is freed for other work.
+"""
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SessionBudget:
+    """Wall-clock deadline, max spend and max uploads of a session
+
+    :param max_seconds: seconds from now to the deadline
+    :param max_uploads: max number of uploaded captcha images
+    :param max_cents: max spend in US cents
+    :param rate: cost of one solved captcha in US cents, e.g. DBC "rate"
+    :param min_round_seconds: abandon the session if less time than this
+        is left, since one more round cannot finish in time
+    """
+
+    def __init__(self, max_seconds=None, max_uploads=None, max_cents=None,
+            rate=None, min_round_seconds=0):
+        self.started = time.monotonic()
+        self.deadline = self.started + max_seconds if max_seconds else None
+        self.max_uploads = max_uploads
+        self.max_cents = max_cents
+        self.rate = rate
+        self.min_round_seconds = min_round_seconds
+
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.spent = 0.0
+
+    @classmethod
+    def from_resolver(cls, resolver, **kwargs):
+        """Create the budget with the rate got from the resolver"""
+        if 'rate' not in kwargs and hasattr(resolver, 'get_rate'):
+            try:
+                kwargs['rate'] = resolver.get_rate()
+            except Exception as e:
+                LOGGER.warning(f'Cannot get the rate of the resolver: {e}')
+        return cls(**kwargs)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining_time(self):
+        """Seconds left to the deadline, or None if no deadline"""
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
+
+    def exhausted_reason(self):
+        """Return why no more upload can be afforded, or None"""
+        remaining = self.remaining_time()
+        if remaining is not None and remaining <= self.min_round_seconds:
+            return f'{remaining:.1f}s left to the deadline'
+        with self.lock:
+            if self.max_uploads is not None and self.uploads >= self.max_uploads:
+                return f'{self.uploads} uploads reach the max'
+            if (self.max_cents is not None and
+                    self.spent + (self.rate or 0) > self.max_cents):
+                return f'{self.spent} cents spent, max {self.max_cents}'
+        return None
+
+    def cap_timeout(self, timeout):
+        """Cap the timeout of a request to the time left"""
+        remaining = self.remaining_time()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return max(1, int(remaining))
+        return max(1, min(timeout, int(remaining)))
+
+    def record_upload(self, solved=True, cost=None):
+        """Record an upload, and its cost if it is solved (charged)"""
+        with self.lock:
+            self.uploads += 1
+            if solved:
+                self.spent += cost if cost is not None else (self.rate or 0)
+
+    def __repr__(self):
+        return (f'SessionBudget(elapsed={self.elapsed():.1f}s,'
+                f' uploads={self.uploads}, spent={self.spent})')
@@ -50,8 +50,10 @@ report(cid)
 upload(captcha)
     Uploads a CAPTCHA.  The only argument `captcha` can be either file-like
     object (any object with `read` method defined, actually, so StringIO
-    will do), or CAPTCHA image file name.  On successul upload you'll get
-    the CAPTCHA details dict (see get_captcha() method).
+    will do), bytes, bytearray, memoryview, or CAPTCHA image file name.
+    The image is streamed chunk by chunk instead of being copied in memory.
+    On successul upload you'll get the CAPTCHA details dict (see
+    get_captcha() method).
 
     NOTE: AT THIS POINT THE UPLOADED CAPTCHA IS NOT SOLVED YET!  You have
     to poll for its status periodically using get_captcha() or get_text()
@@ -69,14 +71,16 @@ Visit http://www.deathbycaptcha.com/user/api for updates.
 """
 
 import base64
+import contextlib
 import errno
-import imghdr
+import os
 import random
-import select
+import selectors
 import socket
 import sys
 import threading
 import time
+import uuid
 import requests
 try:
     from json import read as json_decode, write as json_encode
@@ -106,25 +110,205 @@ HTTP_RESPONSE_TYPE = 'application/json'
 SOCKET_HOST = 'api.dbcapi.me'
 SOCKET_PORTS = list(range(8123, 8131))
 
+# Socket API overall timeout of sending a request and receiving its response,
+# and the size of the receiving buffer
+SOCKET_IO_TIMEOUT = 30
+SOCKET_RECV_SIZE = 64 * 1024
 
-def _load_image(captcha):
-    if hasattr(captcha, 'read'):
-        img = captcha.read()
-    else:
-        img = ''
-        try:
-            captcha_file = open(captcha, 'rb')
-        except Exception:
-            raise
+# Seconds to cache the resolved address of the socket API host
+HOST_CACHE_TTL = 300
+
+_host_cache = {}
+_host_cache_lock = threading.Lock()
+
+
+def _resolve_host(host):
+    """Resolve the host name, caching the address for HOST_CACHE_TTL."""
+    now = time.monotonic()
+    with _host_cache_lock:
+        cached = _host_cache.get(host)
+    if cached and cached[1] > now:
+        return cached[0]
+    address = socket.gethostbyname(host)
+    with _host_cache_lock:
+        _host_cache[host] = (address, now + HOST_CACHE_TTL)
+    return address
+
+
+def _forget_host(host):
+    with _host_cache_lock:
+        _host_cache.pop(host, None)
+
+
+# Image type signatures, checked against the first bytes of a CAPTCHA
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+# Read/encode CAPTCHA images in chunks of this size (multiple of 3, so that
+# base64 chunks can be concatenated)
+IMAGE_CHUNK_SIZE = 3 * 16 * 1024
+
+
+def _sniff_image_type(header):
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class _ImageSource(object):
+
+    """CAPTCHA image read chunk by chunk instead of all at once.
+
+    Accepts file names, file-like objects, bytes, bytearray and memoryview.
+    Only the first bytes are read to check the image type.
+
+    """
+
+    def __init__(self, captcha):
+        self.view = None
+        self.file = None
+        self.own_file = False
+        if isinstance(captcha, (bytes, bytearray, memoryview)):
+            self.view = memoryview(captcha).cast('B')
+            self.size = len(self.view)
+            header = bytes(self.view[:32])
+        else:
+            if hasattr(captcha, 'read'):
+                self.file = captcha
+            else:
+                self.file = open(captcha, 'rb')
+                self.own_file = True
+            try:
+                self.start = self.file.tell()
+                self.file.seek(0, os.SEEK_END)
+                self.size = self.file.tell() - self.start
+                self.file.seek(self.start)
+            except (AttributeError, OSError):
+                # not seekable, have to read it all
+                self.view = memoryview(self.file.read()).cast('B')
+                self.size = len(self.view)
+                self.close()
+                self.file = None
+            if self.file is None:
+                header = bytes(self.view[:32])
+            else:
+                header = self.file.read(32)
+                self.file.seek(self.start)
+        if not self.size:
+            self.close()
+            raise ValueError('CAPTCHA image is empty')
+        self.image_type = _sniff_image_type(header)
+        if self.image_type is None:
+            self.close()
+            raise TypeError('Unknown CAPTCHA image type')
+
+    @property
+    def b64_size(self):
+        return (self.size + 2) // 3 * 4
+
+    def chunks(self, chunk_size=IMAGE_CHUNK_SIZE):
+        """Yield the image from the beginning, chunk by chunk."""
+        if self.file is None:
+            for i in range(0, self.size, chunk_size):
+                yield self.view[i:i + chunk_size]
         else:
-            img = captcha_file.read()
-            captcha_file.close()
-    if not len(img):
-        raise ValueError('CAPTCHA image is empty')
-    elif imghdr.what(None, img) is None:
-        raise TypeError('Unknown CAPTCHA image type')
-    else:
-        return img
+            self.file.seek(self.start)
+            while True:
+                chunk = self.file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def b64_chunks(self, chunk_size=IMAGE_CHUNK_SIZE):
+        """Yield the base64-encoded image chunk by chunk."""
+        for chunk in self.chunks(chunk_size):
+            yield base64.b64encode(chunk)
+
+    def close(self):
+        if self.own_file and self.file:
+            self.file.close()
+
+
+def _load_image(captcha):
+    source = _ImageSource(captcha)
+    try:
+        return b''.join(bytes(chunk) for chunk in source.chunks())
+    finally:
+        source.close()
+
+
+class _MultipartBody(object):
+
+    """File-like multipart/form-data body which streams image sources.
+
+    Its length is known beforehand, so it is sent with Content-Length
+    without building the whole body in memory.
+
+    """
+
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        for name, value in fields.items():
+            self.parts.append(self._part_header(name) +
+                              str(value).encode('utf-8') + b'\r\n')
+        for name, source in files.items():
+            self.parts.append(self._part_header(
+                name, filename=name, content_type='image/' + source.image_type))
+            self.parts.append(source)
+            self.parts.append(b'\r\n')
+        self.parts.append(('--%s--\r\n' % self.boundary).encode('ascii'))
+        self.length = sum(len(part) if isinstance(part, bytes) else part.size
+                          for part in self.parts)
+        self._chunks = self._iter_chunks()
+        self._buffer = b''
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def _part_header(self, name, filename=None, content_type=None):
+        header = '--%s\r\nContent-Disposition: form-data; name="%s"' % (
+            self.boundary, name)
+        if filename:
+            header += '; filename="%s"' % filename
+        if content_type:
+            header += '\r\nContent-Type: %s' % content_type
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def _iter_chunks(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                for chunk in part.chunks():
+                    yield bytes(chunk)
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer + b''.join(self._chunks)
+            self._buffer = b''
+            return data
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 class AccessDeniedException(Exception):
@@ -135,6 +319,10 @@ class Client(object):
 
     """Death by Captcha API Client."""
 
+    # Optional metrics recorder: any object with span(stage) returning a
+    # context manager, and incr(counter, value) methods.
+    metrics = None
+
     def __init__(self, username=None, password=None, authtoken=None):
         #  self.is_verbose = True
         self.is_verbose = False
@@ -156,6 +344,15 @@ class Client(object):
             print('%d %s %s' % (time.time(), cmd, msg.rstrip()))
         return self
 
+    def _span(self, stage):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.span(stage)
+
+    def _incr(self, counter, value=1):
+        if self.metrics is not None:
+            self.metrics.incr(counter, value)
+
     def close(self):
         pass
 
@@ -185,8 +382,8 @@ class Client(object):
     def upload(self, captcha):
         """Upload a CAPTCHA.
 
-        Accepts file names and file-like objects.  Returns CAPTCHA details
-        dict on success.
+        Accepts file names, file-like objects, bytes and memoryview.  Returns
+        CAPTCHA details dict on success.
 
         """
         raise NotImplementedError()
@@ -208,13 +405,18 @@ class Client(object):
                 timeout = DEFAULT_TIMEOUT
 
         deadline = time.time() + (max(0, timeout) or DEFAULT_TIMEOUT)
-        uploaded_captcha = self.upload(captcha, **kwargs)
+        with self._span('upload'):
+            uploaded_captcha = self.upload(captcha, **kwargs)
         if uploaded_captcha:
             intvl_idx = 0  # POLL_INTERVAL index
-            while deadline > time.time() and not uploaded_captcha.get('text'):
-                intvl, intvl_idx = self._get_poll_interval(intvl_idx)
-                time.sleep(intvl)
-                uploaded_captcha = self.get_captcha(uploaded_captcha['captcha'])
+            with self._span('poll'):
+                while (deadline > time.time() and
+                        not uploaded_captcha.get('text')):
+                    intvl, intvl_idx = self._get_poll_interval(intvl_idx)
+                    time.sleep(intvl)
+                    uploaded_captcha = self.get_captcha(
+                        uploaded_captcha['captcha'])
+                    self._incr('polls')
             if (uploaded_captcha.get('text') and
                     uploaded_captcha.get('is_correct')):
                 return uploaded_captcha
@@ -233,10 +435,19 @@ class Client(object):
 
 class HttpClient(Client):
 
-    """Death by Captcha HTTP API client."""
+    """Death by Captcha HTTP API client.
+
+    Keeps the HTTP connections alive in a session, so DNS lookup and TCP
+    connect are paid only once.
+
+    """
 
     def __init__(self, *args):
         Client.__init__(self, *args)
+        self.session = requests.Session()
+
+    def close(self):
+        self.session.close()
 
     def _call(self, cmd, payload=None, headers=None, files=None):
         if headers is None:
@@ -246,13 +457,18 @@ class HttpClient(Client):
         headers['Accept'] = HTTP_RESPONSE_TYPE
         headers['User-Agent'] = API_VERSION
         self._log('SEND', '%s %d %s' % (cmd, len(payload), payload))
-        if payload:
-            response = requests.post(HTTP_BASE_URL + '/' + cmd.strip('/'),
+        if files:
+            body = _MultipartBody(payload, files)
+            headers['Content-Type'] = body.content_type
+            response = self.session.post(HTTP_BASE_URL + '/' + cmd.strip('/'),
+                                     data=body,
+                                     headers=headers)
+        elif payload:
+            response = self.session.post(HTTP_BASE_URL + '/' + cmd.strip('/'),
                                      data=payload,
-                                     files=files,
                                      headers=headers)
         else:
-            response = requests.get(
+            response = self.session.get(
                 HTTP_BASE_URL + '/' + cmd.strip('/'), headers=headers)
         status = response.status_code
         if 403 == status:
@@ -284,15 +500,20 @@ class HttpClient(Client):
                               self.get_auth()).get('is_correct')
 
     def upload(self, captcha=None, **kwargs):
-        banner = kwargs.get('banner', '')
+        banner = kwargs.pop('banner', '')
         data = self.get_auth()
         data.update(kwargs)
-        files ={}
-        if captcha:
-            files = {"captchafile": _load_image(captcha)}
-        if banner:
-            files.update({"banner": _load_image(banner)})
-        response = self._call('captcha', payload=data, files=files) or {}
+        files = {}
+        try:
+            if captcha:
+                files["captchafile"] = _ImageSource(captcha)
+            if banner:
+                files["banner"] = _ImageSource(banner)
+            self._incr('upload_bytes', sum(f.size for f in files.values()))
+            response = self._call('captcha', payload=data, files=files) or {}
+        finally:
+            for source in files.values():
+                source.close()
         if response.get('captcha'):
             return response
 
@@ -307,6 +528,10 @@ class SocketClient(Client):
         Client.__init__(self, *args)
         self.socket_lock = threading.Lock()
         self.socket = None
+        self.io_timeout = SOCKET_IO_TIMEOUT
+        self._recv_chunk = memoryview(bytearray(SOCKET_RECV_SIZE))
+        self._recv_buffer = bytearray()
+        self._recv_scanned = 0
 
     def close(self):
         if self.socket:
@@ -318,11 +543,13 @@ class SocketClient(Client):
             finally:
                 self.socket.close()
                 self.socket = None
+                self._recv_buffer = bytearray()
+                self._recv_scanned = 0
 
     def connect(self):
         if not self.socket:
             self._log('CONN')
-            host = (socket.gethostbyname(SOCKET_HOST),
+            host = (_resolve_host(SOCKET_HOST),
                     random.choice(SOCKET_PORTS))
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(0)
@@ -332,55 +559,98 @@ class SocketClient(Client):
                 if (err.errno not in
                         (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)):
                     self.close()
+                    _forget_host(SOCKET_HOST)
                     raise err
         return self.socket
 
     def __del__(self):
         self.close()
 
-    def _sendrecv(self, sock, buf):
-        self._log('SEND', buf)
-        fds = [sock]
-        buf = bytes(buf, 'utf-8') + self.TERMINATOR
-        response = bytes()
-        intvl_idx = 0
-        while True:
-            intvl, intvl_idx = self._get_poll_interval(intvl_idx)
-            rds, wrs, exs = select.select((not buf and fds) or [],
-                                          (buf and fds) or [],
-                                          fds,
-                                          intvl)
-            if exs:
-                raise IOError('select() failed')
-            try:
-                if wrs:
-                    while buf:
-                        buf = buf[wrs[0].send(buf):]
-                elif rds:
-                    while True:
-                        s = rds[0].recv(256)
-                        if not s:
-                            raise IOError('recv(): connection lost')
-                        else:
-                            response += s
-            except socket.error as err:
-                if (err.errno not in
-                        (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)):
-                    raise err
-            if response.endswith(self.TERMINATOR):
-                self._log('RECV', response)
-                return str(response.rstrip(self.TERMINATOR), 'utf-8')
-        raise IOError('send/recv timed out')
+    def _iter_request(self, parts):
+        """Yield the request bytes, base64-encoding image sources lazily."""
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                for chunk in part.b64_chunks():
+                    yield chunk
+        yield self.TERMINATOR
+
+    def _pop_frame(self):
+        """Return the first complete response from the buffer, or None."""
+        end = self._recv_buffer.find(self.TERMINATOR, self._recv_scanned)
+        if end < 0:
+            # the terminator may be split between two reads
+            self._recv_scanned = max(0, len(self._recv_buffer) - 1)
+            return None
+        frame = bytes(self._recv_buffer[:end])
+        del self._recv_buffer[:end + len(self.TERMINATOR)]
+        self._recv_scanned = 0
+        return frame
+
+    def _wait(self, selector, deadline):
+        """Wait until the socket is ready, or raise IOError on timeout."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not selector.select(remaining):
+            raise IOError('send/recv timed out')
+
+    def _sendrecv(self, sock, parts):
+        self._log('SEND', str(parts[0], 'utf-8'))
+        deadline = time.monotonic() + self.io_timeout
+        chunks = self._iter_request(parts)
+        buf = memoryview(next(chunks))
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_WRITE)
+            while buf:
+                self._wait(selector, deadline)
+                try:
+                    buf = buf[sock.send(buf):]
+                except (BlockingIOError, InterruptedError):
+                    continue
+                if not buf:
+                    buf = memoryview(next(chunks, b''))
+
+            selector.modify(sock, selectors.EVENT_READ)
+            while True:
+                frame = self._pop_frame()
+                if frame is not None:
+                    self._log('RECV', str(frame, 'utf-8'))
+                    return str(frame, 'utf-8')
+                self._wait(selector, deadline)
+                try:
+                    size = sock.recv_into(self._recv_chunk)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                if not size:
+                    raise IOError('recv(): connection lost')
+                self._recv_buffer += self._recv_chunk[:size]
+
+    def _call(self, cmd, data=None, sources=None):
+        """Send the API request and return the response.
+
+        `sources` maps field names to image sources, which are streamed as
+        base64 strings into the JSON request instead of being encoded in
+        memory beforehand.
 
-    def _call(self, cmd, data=None):
+        """
         if data is None:
             data = {}
         data['cmd'] = cmd
         data['version'] = API_VERSION
-        request = json_encode(data)
+        request = [json_encode(data).encode('utf-8')]
+        if sources:
+            # insert the streamed fields before the closing brace
+            request[0] = request[0][:-1]
+            for name, source in sources.items():
+                request.append(b', "' + name.encode('ascii') + b'": "')
+                request.append(source)
+                request.append(b'"')
+            request.append(b'}')
 
         response = None
         for i in range(2):
+            if i:
+                self._incr('socket_retries')
             if not self.socket and cmd != 'login':
                 self._call('login', self.get_auth())
             self.socket_lock.acquire()
@@ -436,16 +706,20 @@ class SocketClient(Client):
         return self._call('captcha', {'captcha': cid}) or {'captcha': 0}
 
     def upload(self, captcha=None, **kwargs):
-        data = {}
-        if captcha:
-            data['captcha'] = str(base64.b64encode(_load_image(captcha)), 'ascii')
-        if kwargs:
-            banner = kwargs.get('banner', '')
+        banner = kwargs.pop('banner', '')
+        data = dict(kwargs)
+        sources = {}
+        try:
+            if captcha:
+                sources['captcha'] = _ImageSource(captcha)
             if banner:
-                kwargs['banner'] = str(base64.b64encode(
-                    _load_image(banner)), 'ascii')
-            data.update(kwargs)
-        response = self._call('upload', data)
+                sources['banner'] = _ImageSource(banner)
+            self._incr('upload_bytes',
+                       sum(source.b64_size for source in sources.values()))
+            response = self._call('upload', data, sources)
+        finally:
+            for source in sources.values():
+                source.close()
         if response.get('captcha'):
             uploaded_captcha = dict(
                 (k, response.get(k))
@@ -0,0 +1,109 @@
+"""Cache of the element handles of one session
+
+Every round uses the same stable containers, e.g. the captcha form, so their
+handles are found once and kept with their rects, which are read by one
+command instead of a command for every access of location and size. A
+cached element is found again only when it is stale, or after a navigation
+event (e.g. clicking a button which changes the page) invalidates the cache.
+The rects are read again after the taps and at the start of a round, since
+the page may be scrolled or laid out again without the handles being stale.
+"""
+import logging
+import threading
+
+from selenium.common.exceptions import StaleElementReferenceException
+
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CachedElement:
+    """Element whose rect is read once, other attributes are delegated"""
+
+    def __init__(self, element):
+        self.element = element
+        self._rect = None
+
+    @property
+    def rect(self):
+        if self._rect is None:
+            self._rect = self.element.rect
+        return self._rect
+
+    def forget_rect(self):
+        self._rect = None
+
+    @property
+    def location(self):
+        return {'x': self.rect['x'], 'y': self.rect['y']}
+
+    @property
+    def size(self):
+        return {'width': self.rect['width'], 'height': self.rect['height']}
+
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+
+
+def cache_element(element):
+    if element is None or isinstance(element, CachedElement):
+        return element
+    return CachedElement(element)
+
+
+class ElementCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, find):
+        """Get the cached value of the key, or get it by find() and cache it
+
+        The value is an element, or a tuple of elements.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+        if value is not None:
+            METRICS.incr('element_cache_hits')
+            return value
+
+        METRICS.incr('element_cache_misses')
+        value = find()
+        if isinstance(value, tuple):
+            value = tuple(cache_element(element) for element in value)
+        else:
+            value = cache_element(value)
+        if value is not None:
+            with self.lock:
+                self.entries[key] = value
+        return value
+
+    def call(self, key, find, func):
+        """Call func(element), finding the element again once if it is stale"""
+        try:
+            return func(self.get(key, find))
+        except StaleElementReferenceException:
+            LOGGER.debug(f'Cached element is stale: {key}')
+            METRICS.incr('element_cache_stale')
+            self.invalidate(key)
+            return func(self.get(key, find))
+
+    def forget_rects(self):
+        """Read the rects of the cached elements again on next access"""
+        with self.lock:
+            values = list(self.entries.values())
+        for value in values:
+            for element in (value if isinstance(value, tuple) else (value,)):
+                if isinstance(element, CachedElement):
+                    element.forget_rect()
+
+    def invalidate(self, key=None):
+        """Forget the element of the key, or all elements"""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
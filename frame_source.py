@@ -0,0 +1,217 @@
+"""Sources of the captured images of the captcha elements
+
+ScreenshotFrameSource captures an element by a screenshot command, which is
+a blocking round trip returning a base64 PNG. MjpegFrameSource reads the
+MJPEG screenshot stream of UiAutomator2 in background, keeps the latest
+frames in a ring buffer, and crops the elements from the freshest frame
+without any command::
+
+    CaptchaAndroidBaseUI.frame_source_type = 'mjpeg'
+
+or::
+
+    source = MjpegFrameSource('http://127.0.0.1:7810', scale=0.5).start()
+    ui = FuncaptchaAndroidUI(driver, frame_source=source)
+
+The stream must send the Content-Length header of every frame, as the MJPEG
+server of UiAutomator2 does.
+"""
+import logging
+import threading
+import time
+
+from collections import deque
+from io import BytesIO
+
+from metrics import METRICS
+from utils import Image, scale_img
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MJPEG_PORT = 7810
+
+
+def iter_mjpeg_frames(stream):
+    """Yield the JPEG frames of a multipart MJPEG stream"""
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.lower().startswith(b'content-length:'):
+            continue
+        length = int(line.split(b':', 1)[1])
+        while stream.readline().strip():    # the rest of the headers
+            pass
+        frame = stream.read(length)
+        if len(frame) < length:
+            return
+        yield frame
+
+
+def has_mjpeg_server(driver):
+    """Check if the driver serves the MJPEG screenshot stream, i.e. UiAutomator2"""
+    capabilities = getattr(driver, 'capabilities', None) or {}
+    return bool(capabilities.get('mjpegScreenshotUrl') or
+            capabilities.get('mjpegServerPort') or
+            str(capabilities.get('automationName')).lower() == 'uiautomator2')
+
+
+class ScreenshotFrameSource:
+    """Capture every element by a screenshot command
+
+    The screenshots are at the full resolution of the device, so a scale
+    other than 1 costs a resize on the host.
+
+    :param scale: scale of the saved images to the screen
+    :param quality: quality of the saved images if they are JPEG
+    """
+
+    def __init__(self, scale=1, quality=None):
+        self.scale = scale
+        self.quality = quality
+
+    def save_element(self, element, img_file):
+        """Save the image of the element into the file, return if it's saved"""
+        with METRICS.span('screenshot'):
+            saved = element.screenshot(img_file)
+        if saved and self.scale != 1:
+            scale_img(img_file, self.scale, self.quality)
+        return saved
+
+    def close(self):
+        pass
+
+
+class MjpegFrameSource:
+    """Crop the elements from the frames of an MJPEG screenshot stream
+
+    :param url: URL of the MJPEG stream of the whole screen
+    :param scale: scale of the saved images to the screen, which should be
+        mjpegScalingFactor of the frames
+    :param screen_width: width of the screen, to get the real scale of the
+        frames from their width, in case it differs from the settings
+    :param buffer_size: the number of the latest frames to keep
+    :param max_frame_age: seconds a frame is fresh enough to be cropped
+    :param frame_timeout: seconds to wait for a fresh frame, after which the
+        element is captured by a screenshot command instead
+    """
+
+    def __init__(self, url, scale=1, quality=None, screen_width=None,
+            buffer_size=4, max_frame_age=0.5, frame_timeout=2,
+            reconnect_interval=1):
+        self.url = url
+        self.scale = scale
+        self.quality = quality
+        self.screen_width = screen_width
+        self.max_frame_age = max_frame_age
+        self.frame_timeout = frame_timeout
+        self.reconnect_interval = reconnect_interval
+        self.frames = deque(maxlen=buffer_size)     # (received time, JPEG)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.streaming = False
+        self.thread = None
+        self.fallback = ScreenshotFrameSource(scale, quality)
+
+    @classmethod
+    def from_driver(cls, driver, scale=1, quality=None, **kwargs):
+        """Create it from the MJPEG capabilities of the Appium session"""
+        capabilities = getattr(driver, 'capabilities', None) or {}
+        url = capabilities.get('mjpegScreenshotUrl') or (
+                'http://127.0.0.1:{}'.format(
+                    capabilities.get('mjpegServerPort') or DEFAULT_MJPEG_PORT))
+        if 'screen_width' not in kwargs:
+            try:
+                kwargs['screen_width'] = driver.get_window_size()['width']
+            except Exception as e:
+                LOGGER.warning(f'Cannot get the width of the screen: {e}')
+        return cls(url, scale, quality, **kwargs)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                    name='mjpeg-frame-source', daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        # imported here, as it slows down importing verify
+        import urllib.request
+
+        while not self.closed:
+            try:
+                with urllib.request.urlopen(self.url, timeout=10) as stream:
+                    LOGGER.debug(f'Read the MJPEG stream: {self.url}')
+                    self.streaming = True
+                    for frame in iter_mjpeg_frames(stream):
+                        with self.condition:
+                            self.frames.append((time.monotonic(), frame))
+                            self.condition.notify_all()
+                        METRICS.incr('mjpeg_frames')
+                        if self.closed:
+                            return
+            except OSError as e:
+                LOGGER.warning(f'Failed to read the MJPEG stream {self.url}: {e}')
+            self.streaming = False
+            if not self.closed:
+                time.sleep(self.reconnect_interval)
+
+    def get_frame(self, newer_than=0, timeout=None):
+        """Wait for the latest frame received after the monotonic time
+
+        :return: the JPEG bytes of the frame, or None if timeout
+        """
+        if timeout is None:
+            timeout = self.frame_timeout
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.frames or self.frames[-1][0] < newer_than:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.frames[-1][1]
+
+    def save_element(self, element, img_file):
+        """Crop the element from the freshest frame into the file"""
+        with METRICS.span('wait_frame'):
+            # don't wait for the frames while the stream is down
+            frame = self.get_frame(time.monotonic() - self.max_frame_age,
+                    None if self.streaming else 0)
+        if frame is None:
+            LOGGER.warning('No fresh MJPEG frame, capture by screenshot')
+            METRICS.incr('mjpeg_fallbacks')
+            return self.fallback.save_element(element, img_file)
+
+        rect = element.rect
+        with METRICS.span('crop_frame'), Image.open(BytesIO(frame)) as img:
+            frame_scale = self.get_frame_scale(img.width)
+            box = tuple(int(value * frame_scale) for value in (rect['x'],
+                rect['y'], rect['x'] + rect['width'],
+                rect['y'] + rect['height']))
+            img_crop = img.crop(box)
+            if frame_scale != self.scale:
+                img_crop = img_crop.resize((int(rect['width'] * self.scale),
+                    int(rect['height'] * self.scale)))
+            if self.quality and str(img_file).lower().endswith(('.jpg', '.jpeg')):
+                img_crop.save(img_file, quality=self.quality)
+            else:
+                img_crop.save(img_file)
+        return True
+
+    def get_frame_scale(self, frame_width):
+        """Get the real scale of the frame to the screen"""
+        if not self.screen_width:
+            return self.scale
+        frame_scale = frame_width / self.screen_width
+        if abs(frame_scale - self.scale) > 0.01:
+            LOGGER.debug(f'Scale of the MJPEG frames is {frame_scale:.2f},'
+                    f' not {self.scale}')
+            return frame_scale
+        return self.scale
+
+    def close(self):
+        self.closed = True
+        with self.condition:
+            self.condition.notify_all()
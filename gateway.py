@@ -0,0 +1,512 @@
+"""Resolver gateway shared by the worker processes of a device host
+
+The gateway daemon owns the provider clients (warmed up and kept alive),
+their circuit breaker and rate limiting, the coalescing of the same uploads
+in flight, and a cache of the recent results. It serves the resolver
+protocol over a small JSON API on HTTP or a Unix socket::
+
+    python -m gateway --port 8765 --pool-size 8
+    python -m gateway --unix-socket /tmp/captcha-gateway.sock
+
+The UI flows use it through the thin client GatewayResolver::
+
+    resolver = GatewayResolver('http://127.0.0.1:8765')
+    resolver = GatewayResolver(unix_socket='/tmp/captcha-gateway.sock')
+    ui = RecaptchaAndroidUI(driver, resolver=resolver)
+
+API, every body is JSON and every image is base64::
+
+    POST /coordinates   {image, reduce_factor, reduce_step, retry_times,
+                         timeout, report_blank_list, start_factor}
+    POST /image_group   {image, banner_text, grid, reduce_factor, reduce_step,
+                         retry_times, timeout, start_factor}
+    POST /report        {cid, reason}
+    GET  /info          provider, rate, circuit breaker and cache state
+"""
+import argparse
+import base64
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from metrics import METRICS
+from singleflight import get_payload_key
+from throttle import CircuitOpenError
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+
+class GatewayError(Exception):
+    pass
+
+
+class ResultCache:
+    """Results of the recent solved payloads, expired after ttl seconds"""
+
+    def __init__(self, ttl=60, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key: (expiry, result)
+
+    def get(self, key):
+        if key is None or not self.ttl:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        METRICS.incr('gateway_cache_hits')
+        return entry[1]
+
+    def put(self, key, result):
+        if key is None or not self.ttl:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict_cid(self, cid):
+        """Remove the results solved by the captcha, e.g. reported wrong"""
+        with self.lock:
+            keys = [key for key, (expiry, result) in self.entries.items()
+                    if cid in result.get('cids', ())]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Gateway:
+    """Resolve the requests by the resolver shared by all clients
+
+    :param resolver: the resolver, e.g. a warmed up DeathByCaptchaUI
+    :param work_dir: directory of the uploaded images
+    """
+
+    def __init__(self, resolver, work_dir=None, cache_ttl=60):
+        self.resolver = resolver
+        self.work_dir = Path(work_dir or tempfile.mkdtemp(
+            prefix='captcha_gateway_'))
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = ResultCache(cache_ttl)
+        self.counter = 0
+        self.lock = threading.Lock()
+        # the captchas charged to a request, the others share their uploads
+        self.charged_cids = OrderedDict()
+
+    def save_image(self, data):
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+        img_file = self.work_dir / f'{os.getpid()}_{counter:08d}.png'
+        img_file.write_bytes(data)
+        return img_file
+
+    def remove_images(self, img_file):
+        for path in self.work_dir.glob(f'{img_file.stem}*'):
+            path.unlink(missing_ok=True)
+
+    def charge(self, cids):
+        """Check if any of the captchas is not charged to another request"""
+        with self.lock:
+            new_cids = [cid for cid in cids if cid not in self.charged_cids]
+            for cid in new_cids:
+                self.charged_cids[cid] = True
+            while len(self.charged_cids) > 10000:
+                self.charged_cids.popitem(last=False)
+        return bool(new_cids)
+
+    def resolve(self, kind, request):
+        """Resolve the request of the kind "coordinates" or "image_group" """
+        data = base64.b64decode(request.pop('image'))
+        key = get_payload_key(data, kind, *sorted(request.items()))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return {**cached, 'uploaded': False, 'cached': True}
+
+        cids = []
+        img_file = self.save_image(data)
+        try:
+            with METRICS.span(f'gateway_{kind}'):
+                if kind == 'coordinates':
+                    results = self.resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                            str(img_file), cids=cids, **request)
+                    response = ({'coordinates': results[0],
+                        'reduce_factor': results[1]} if results else
+                        {'coordinates': None})
+                else:
+                    results = self.resolver.resolve_newrecaptcha_ui_with_image_group_api(
+                            str(img_file), cids=cids, **request)
+                    response = ({'indexes': results[0],
+                        'reduce_factor': results[1]} if results else
+                        {'indexes': None})
+        finally:
+            self.remove_images(img_file)
+
+        response['cids'] = cids
+        if cids:
+            self.cache.put(key, response)
+        # uploaded is charged to the budget of the client, once per captcha
+        return {**response, 'uploaded': self.charge(cids), 'cached': False}
+
+    def report(self, request):
+        # the wrong result must not be served to the other clients
+        if self.cache.evict_cid(request['cid']):
+            LOGGER.info(f'Evict the cached results of captcha {request["cid"]}')
+        self.resolver.report_failed_resolving(request['cid'],
+                reason=request.get('reason', ''))
+        return {}
+
+    def get_rate(self):
+        try:
+            return self.resolver.get_rate()
+        except Exception as e:
+            LOGGER.warning(f'Cannot get the rate of the resolver: {e}')
+
+    def info(self):
+        guard = getattr(self.resolver, 'guard', None)
+        return {
+            'provider': getattr(self.resolver, 'provider', None),
+            'rate': self.get_rate(),
+            'timeout': getattr(self.resolver, 'timeout', None),
+            'guard': guard.snapshot() if guard else None,
+            'cache_entries': len(self.cache),
+        }
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'   # keep the connections of the clients
+    gateway = None
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/info':
+            self._reply(200, self.gateway.info())
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        request = json.loads(self.rfile.read(
+            int(self.headers.get('Content-Length', 0))) or b'{}')
+        try:
+            if path in ('/coordinates', '/image_group'):
+                self._reply(200, self.gateway.resolve(path[1:], request))
+            elif path == '/report':
+                self._reply(200, self.gateway.report(request))
+            else:
+                self._reply(404)
+        except CircuitOpenError as e:
+            self._reply(503, {'error': str(e)})
+        except Exception as e:
+            LOGGER.exception(f'Failed to serve {path}: {e}')
+            self._reply(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class GatewayServer:
+    """Serve a Gateway on HTTP, or on a Unix socket if unix_socket is given"""
+
+    def __init__(self, gateway, host='127.0.0.1', port=DEFAULT_PORT,
+            unix_socket=None):
+        self.gateway = gateway
+        self.unix_socket = unix_socket
+        handler = type('GatewayHandler', (_GatewayHandler,),
+                {'gateway': gateway})
+        if unix_socket:
+            Path(unix_socket).unlink(missing_ok=True)
+            self.server = _UnixHTTPServer(unix_socket, handler)
+        else:
+            self.server = ThreadingHTTPServer((host, port), handler)
+            self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        if self.unix_socket:
+            return f'unix://{self.unix_socket}'
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        LOGGER.info(f'Resolver gateway: {self.url}')
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_socket:
+            Path(self.unix_socket).unlink(missing_ok=True)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class GatewayResolver:
+    """Thin client resolver of the gateway, used as DeathByCaptchaUI is
+
+    :param url: URL of the gateway, e.g. "http://127.0.0.1:8765"
+    :param unix_socket: path of the Unix socket of the gateway instead
+    """
+
+    # seconds of a request more than the timeout of resolving
+    request_margin = 10
+    # seconds to wait before getting the info again after a failure
+    info_retry_interval = 60
+
+    def __init__(self, url=f'http://127.0.0.1:{DEFAULT_PORT}',
+            unix_socket=None, timeout=60):
+        self.url = url
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self.local = threading.local()
+        self.info = None
+        self.info_retry_time = 0
+
+    @property
+    def provider(self):
+        return self.get_info().get('provider') or 'gateway'
+
+    @property
+    def rate(self):
+        return self.get_info().get('rate')
+
+    def get_rate(self):
+        return self.rate
+
+    def get_info(self):
+        """Get the info of the gateway, or {} until the retry after a failure"""
+        if self.info is None:
+            if time.monotonic() < self.info_retry_time:
+                return {}
+            try:
+                self.info = self.request('GET', '/info', timeout=5)
+            except (OSError, http.client.HTTPException, GatewayError) as e:
+                LOGGER.warning(f'Cannot get the info of the gateway: {e}')
+                self.info_retry_time = (time.monotonic() +
+                        self.info_retry_interval)
+                return {}
+        return self.info
+
+    def get_connection(self, timeout):
+        """Get the keep-alive connection of this thread"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            if self.unix_socket:
+                connection = _UnixHTTPConnection(self.unix_socket)
+            else:
+                parts = urlsplit(self.url)
+                connection = http.client.HTTPConnection(parts.hostname,
+                        parts.port or DEFAULT_PORT)
+            self.local.connection = connection
+        connection.timeout = timeout
+        if connection.sock:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def request(self, method, path, body=None, timeout=None):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data else {}
+        for retry in (True, False):
+            connection = self.get_connection(timeout or self.timeout)
+            try:
+                connection.request(method, path, data, headers)
+                response = connection.getresponse()
+                result = json.loads(response.read() or b'{}')
+                break
+            except Exception as e:
+                # the connection may be half used, e.g. after a timeout
+                connection.close()
+                self.local.connection = None
+                # the kept-alive connection is closed, then reconnect once
+                if not retry or not isinstance(e, (
+                        http.client.RemoteDisconnected, BrokenPipeError,
+                        ConnectionResetError)):
+                    raise
+        if response.status == 503:
+            raise CircuitOpenError(result.get('error', 'gateway is overloaded'))
+        if response.status != 200:
+            raise GatewayError(f'{response.status}: {result.get("error")}')
+        return result
+
+    def resolve(self, kind, image_file, timeout, budget=None, cids=None,
+            **kwargs):
+        if budget:
+            reason = budget.exhausted_reason()
+            if reason:
+                LOGGER.info(f'Session budget is exhausted: {reason}')
+                return None
+            timeout = budget.cap_timeout(timeout)
+        with open(image_file, 'rb') as f:
+            image = base64.b64encode(f.read()).decode()
+        try:
+            with METRICS.span('gateway_request'):
+                result = self.request('POST', f'/{kind}', dict(kwargs,
+                    image=image, timeout=timeout),
+                    timeout=timeout * (kwargs.get('retry_times', 0) + 1) +
+                    self.request_margin)
+        except CircuitOpenError as e:
+            LOGGER.warning(e)
+            return None
+        except (OSError, ValueError, http.client.HTTPException,
+                GatewayError) as e:
+            LOGGER.error(f'Failed to resolve by the gateway: {e}')
+            return None
+
+        if budget and result['uploaded']:
+            budget.record_upload(solved=bool(result['cids']), cost=self.rate)
+        # the captchas of a shared or cached result are reported by the
+        # request they are charged to
+        if cids is not None and result['uploaded']:
+            cids.extend(result['cids'])
+        return result
+
+    def resolve_newrecaptcha_ui_with_coordinates_api(self, image_file,
+            reduce_factor=1, reduce_step=0.125, retry_times=2, timeout=None,
+            report_blank_list=False, budget=None, cids=None,
+            start_factor=None):
+        """The same as DeathByCaptchaUI, resolved by the gateway
+
+        :return: (coordinates, reduce_factor) or False
+        """
+        result = self.resolve('coordinates', image_file,
+                self.timeout if timeout is None else timeout, budget, cids,
+                reduce_factor=reduce_factor, reduce_step=reduce_step,
+                retry_times=retry_times, report_blank_list=report_blank_list,
+                start_factor=start_factor)
+        if not result or result['coordinates'] is None:
+            return False
+        return (result['coordinates'], result['reduce_factor'])
+
+    def resolve_newrecaptcha_with_image_group_api(self, image_file,
+            banner_text, grid=None, timeout=None, budget=None, cids=None):
+        """The same as DeathByCaptchaUI, resolved by the gateway
+
+        :return: the list of indexes, or None
+        """
+        result = self.resolve('image_group', image_file,
+                self.timeout if timeout is None else timeout, budget, cids,
+                banner_text=banner_text, grid=grid, retry_times=0)
+        return result['indexes'] if result else None
+
+    def resolve_newrecaptcha_ui_with_image_group_api(self, image_file,
+            banner_text, grid=None, reduce_factor=1, reduce_step=0.125,
+            retry_times=2, timeout=None, budget=None, cids=None,
+            start_factor=None):
+        """The same as DeathByCaptchaUI, resolved by the gateway
+
+        :return: (indexes, reduce_factor) or False
+        """
+        result = self.resolve('image_group', image_file,
+                self.timeout if timeout is None else timeout, budget, cids,
+                banner_text=banner_text, grid=grid,
+                reduce_factor=reduce_factor, reduce_step=reduce_step,
+                retry_times=retry_times, start_factor=start_factor)
+        if not result or result['indexes'] is None:
+            return False
+        return (result['indexes'], result['reduce_factor'])
+
+    def report_failed_resolving(self, cid, reason=''):
+        try:
+            self.request('POST', '/report', {'cid': cid, 'reason': reason},
+                    timeout=10)
+        except (OSError, http.client.HTTPException, GatewayError) as e:
+            LOGGER.warning(f'Failed to report the captcha {cid}: {e}')
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket', help='serve on the Unix socket')
+    parser.add_argument('--client-type', default='socket',
+            choices=('http', 'socket'))
+    parser.add_argument('--pool-size', type=int, default=4,
+            help='the number of the warmed up provider clients')
+    parser.add_argument('--timeout', type=int, default=60)
+    parser.add_argument('--cache-ttl', type=int, default=60,
+            help='seconds to keep the results of solved images')
+    parser.add_argument('--username', default=os.environ.get('DBC_USERNAME'),
+            help='DBC username, default: $DBC_USERNAME')
+    parser.add_argument('--password', default=os.environ.get('DBC_PASSWORD'),
+            help='DBC password, default: $DBC_PASSWORD')
+    parser.add_argument('--authtoken', default=os.environ.get('DBC_AUTHTOKEN'),
+            help='DBC authtoken instead of the password,'
+            ' default: $DBC_AUTHTOKEN')
+    args = parser.parse_args(argv)
+
+    from verify import DeathByCaptchaUI
+
+    logging.basicConfig(level=logging.INFO)
+    # fall back to the credentials configured in DeathByCaptchaUI
+    credentials = {name: getattr(args, name)
+            for name in ('username', 'password', 'authtoken')
+            if getattr(args, name)}
+    resolver = DeathByCaptchaUI(timeout=args.timeout,
+            client_type=args.client_type, pool_size=args.pool_size,
+            **credentials)
+    resolver.warm_up()
+    server = GatewayServer(Gateway(resolver, cache_ttl=args.cache_ttl),
+            args.host, args.port, args.unix_socket).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        resolver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Managed store of the temporary captcha images
+
+Every round saves a screenshot of the captcha and its derivatives (e.g.
+"_crop", "_small", "_tile0"), which are named after it. The store gives the
+collision-free names, deletes the images of a round in background once it is
+released, keeps a sample of them for debugging, and caps the total size and
+age of the directory, and of the kept sample with its own caps::
+
+    store = get_image_store(CAPTCHA_IMAGE_DIR, keep_ratio=0.01)
+    img_file = store.new_path('_captcha', 'png')
+    ...
+    store.release(img_file)
+
+To keep the images in memory, use a directory on tmpfs, e.g. TMPFS_IMAGE_DIR.
+The store logs whether its directory is in memory or on disk when it is
+created, since /dev/shm is a plain directory on disk on some systems.
+"""
+import itertools
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+
+from pathlib import Path
+
+
+LOGGER = logging.getLogger(__name__)
+
+TMPFS_IMAGE_DIR = Path('/dev/shm/captcha-solver')
+MEMORY_FILE_SYSTEMS = ('tmpfs', 'ramfs')
+
+
+def get_file_system_type(directory, mounts_file='/proc/mounts'):
+    """Get the type of the file system of the directory, or None if unknown"""
+    directory = os.path.realpath(directory)
+    try:
+        with open(mounts_file) as f:
+            mounts = [line.split()[1:3] for line in f if line.strip()]
+    except OSError:
+        return None
+    best, fs_type = '', None
+    for mount_point, mount_type in mounts:
+        if (directory == mount_point or directory.startswith(
+                mount_point.rstrip('/') + '/')) and len(mount_point) > len(best):
+            best, fs_type = mount_point, mount_type
+    return fs_type
+
+
+class ImageStore:
+    """Temporary images in a directory with size and age caps
+
+    :param max_bytes: max total size of the images, the oldest are deleted
+    :param max_age: seconds to keep an image which is not released
+    :param min_age: images younger than this are never deleted by the caps,
+        since they may be in use
+    :param keep_ratio: ratio of the released rounds to keep in the "keep"
+        sub directory for debugging, e.g. 0.01
+    :param keep_max_bytes: max total size of the kept images
+    :param keep_max_age: seconds to keep the kept images
+    :param cleanup_interval: seconds between the checks of the caps
+    """
+
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, max_age=3600,
+            min_age=60, keep_ratio=0, keep_max_bytes=50 * 1024 * 1024,
+            keep_max_age=7 * 24 * 3600, cleanup_interval=60):
+        self.directory = Path(directory)
+        self.keep_directory = self.directory / 'keep'
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.keep_ratio = keep_ratio
+        self.keep_max_bytes = keep_max_bytes
+        self.keep_max_age = keep_max_age
+        self.cleanup_interval = cleanup_interval
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fs_type = get_file_system_type(self.directory)
+        self.in_memory = fs_type in MEMORY_FILE_SYSTEMS
+        LOGGER.info(f'Image store {self.directory} is'
+                f" {'in memory' if self.in_memory else 'on disk'} ({fs_type})")
+        # the prefix avoids collisions with other processes and runs
+        self.prefix = f'{os.getpid()}_{int(time.time())}'
+        self.counter = itertools.count()
+        self.counter_lock = threading.Lock()
+
+        self.deletions = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True,
+                name=f'image-store-{self.directory.name}')
+        self.worker.start()
+
+    def new_path(self, suffix='', extension='png'):
+        """Get a new collision-free path of an image"""
+        with self.counter_lock:
+            number = next(self.counter)
+        return self.directory / f'{self.prefix}_{number:06d}{suffix}.{extension}'
+
+    def get_round_files(self, img_file):
+        """Get the image and its derivatives named after it"""
+        img_file = Path(img_file)
+        stem = img_file.stem
+        return [path for path in img_file.parent.glob(f'{stem}*')
+                if path.is_file()]
+
+    def release(self, img_file):
+        """The image and its derivatives are no longer used, delete them"""
+        self.deletions.put(img_file)
+
+    def delete_round(self, img_file):
+        files = self.get_round_files(img_file)
+        if self.keep_ratio and random.random() < self.keep_ratio:
+            self.keep_directory.mkdir(exist_ok=True)
+            LOGGER.debug(f'Keep the sample images: {img_file}')
+            for path in files:
+                shutil.move(str(path), str(self.keep_directory / path.name))
+            return
+
+        for path in files:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def enforce_caps(self):
+        """Enforce the caps of the images, and of the kept ones"""
+        self.enforce_directory_caps(self.directory, self.max_bytes,
+                self.max_age)
+        if self.keep_directory.exists():
+            self.enforce_directory_caps(self.keep_directory,
+                    self.keep_max_bytes, self.keep_max_age)
+
+    def enforce_directory_caps(self, directory, max_bytes, max_age):
+        """Delete the images which are too old, then the oldest ones
+        while the total size is over max_bytes"""
+        now = time.time()
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for mtime, size, path in files)
+        deleted = 0
+        for mtime, size, path in files:
+            age = now - mtime
+            if age < self.min_age:
+                break
+            if age < max_age and total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        if deleted:
+            LOGGER.debug(f'Deleted {deleted} images over the caps of'
+                    f' {directory}')
+
+    def run(self):
+        next_cleanup = time.monotonic() + self.cleanup_interval
+        while True:
+            try:
+                img_file = self.deletions.get(timeout=max(0,
+                    next_cleanup - time.monotonic()))
+            except queue.Empty:
+                img_file = None
+
+            try:
+                if img_file is not None:
+                    self.delete_round(img_file)
+                if time.monotonic() >= next_cleanup:
+                    self.enforce_caps()
+                    next_cleanup = time.monotonic() + self.cleanup_interval
+            except Exception as e:
+                LOGGER.warning(f'Failed to clean up images: {e}')
+            finally:
+                if img_file is not None:
+                    self.deletions.task_done()
+
+    def flush(self):
+        """Wait until all released images are deleted"""
+        self.deletions.join()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_image_store(directory, **kwargs):
+    """Get the shared store of the directory, creating it with kwargs"""
+    directory = Path(directory).absolute()
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = ImageStore(directory, **kwargs)
+        return _stores[directory]
@@ -0,0 +1,262 @@
+"""Locators of the elements of the CAPTCHA pages
+
+A LocatorSet holds the alternative locators of one element, e.g. the
+different XPaths of the verify button in different versions of the page,
+and looks up all of them in one poll loop instead of waiting for them one
+by one. The alternative which wins most on a device is tried first next
+time::
+
+    verify_button_locators = LocatorSet('verify button',
+            verify_button_xpath, verify_button_xpath1)
+    element, index = verify_button_locators.find(driver, timeout=5)
+
+The elements can be declared as Targets by resource-id, class and index,
+which are compiled into the fastest strategies the driver supports (UiAutomator
+selector, ID, accessibility id), with XPath only as the fallback if the
+faster one raises, since UiAutomator2 dumps and walks the whole hierarchy for
+every XPath lookup::
+
+    verify_button = Target('verify button', resource_id='verifyButton',
+            class_name='android.widget.Button')
+"""
+import logging
+import threading
+import time
+
+from collections import Counter, defaultdict
+
+from selenium.common.exceptions import WebDriverException
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class By:
+    """Locator strategies, the same as selenium.webdriver.common.by.By and
+    appium.webdriver.common.appiumby.AppiumBy
+
+    Importing selenium.webdriver imports all of its web drivers, which is
+    slow, so the strategies are defined here.
+    """
+    ID = 'id'
+    XPATH = 'xpath'
+    NAME = 'name'
+    CLASS_NAME = 'class name'
+    CSS_SELECTOR = 'css selector'
+    ACCESSIBILITY_ID = 'accessibility id'
+    ANDROID_UIAUTOMATOR = '-android uiautomator'
+
+
+# the strategies supported by the automation engines of Appium
+ALL_STRATEGIES = (By.ACCESSIBILITY_ID, By.ID, By.ANDROID_UIAUTOMATOR, By.XPATH)
+AUTOMATION_STRATEGIES = {
+    'uiautomator2': ALL_STRATEGIES,
+    'espresso': (By.ACCESSIBILITY_ID, By.ID, By.XPATH),
+}
+
+
+def get_supported_strategies(driver):
+    """Get the strategies supported by the automation engine of the driver"""
+    capabilities = getattr(driver, 'capabilities', None) or {}
+    automation = str(capabilities.get('automationName') or
+            'uiautomator2').lower()
+    return AUTOMATION_STRATEGIES.get(automation, (By.ID, By.XPATH))
+
+
+def quote_selector_string(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class Target:
+    """An element declared by its attributes instead of a positional XPath
+
+    :param resource_id: resource-id of the element
+    :param class_name: class of the element, e.g. "android.widget.Button"
+    :param index: index of the element among its siblings, from 0
+    :param description: content-desc of the element, i.e. accessibility id
+    :param text_contains: a part of the text of the element
+    :param parent: Target of an ancestor of the element
+    :param xpath: XPath to fall back to, generated from the attributes if None
+
+    The UiAutomator child selector matches the descendants of the parent in
+    depth-first order, so declare an index under a parent only if no
+    earlier descendant has the same class and index.
+    """
+
+    def __init__(self, name, resource_id=None, class_name=None, index=None,
+            description=None, parent=None, xpath=None, text_contains=None):
+        self.name = name
+        self.resource_id = resource_id
+        self.class_name = class_name
+        self.index = index
+        self.description = description
+        self.text_contains = text_contains
+        self.parent = parent
+        self.xpath = xpath
+        self.locator_set = None
+
+    def to_uiautomator(self):
+        """Compile it into a UiAutomator selector"""
+        selector = 'new UiSelector()'
+        if self.resource_id:
+            selector += f'.resourceId({quote_selector_string(self.resource_id)})'
+        if self.class_name:
+            selector += f'.className({quote_selector_string(self.class_name)})'
+        if self.description:
+            selector += f'.description({quote_selector_string(self.description)})'
+        if self.text_contains:
+            selector += f'.textContains({quote_selector_string(self.text_contains)})'
+        if self.index is not None:
+            selector += f'.index({self.index})'
+        if self.parent:
+            return f'{self.parent.to_uiautomator()}.childSelector({selector})'
+        return selector
+
+    def to_xpath(self):
+        """Get the declared XPath, or generate it from the attributes"""
+        if self.xpath:
+            return self.xpath
+        step = self.class_name or '*'
+        if self.resource_id:
+            step += f'[@resource-id="{self.resource_id}"]'
+        if self.description:
+            step += f'[@content-desc="{self.description}"]'
+        if self.text_contains:
+            step += f'[contains(@text, "{self.text_contains}")]'
+        if self.index is not None:
+            step += f'[@index="{self.index}"]'
+        parent = self.parent.to_xpath() if self.parent else ''
+        return f'{parent}//{step}'
+
+    def compile(self, strategies=ALL_STRATEGIES):
+        """Get the locators of it, the fastest first, XPath the last"""
+        locators = []
+        only_description = self.description and not (self.resource_id or
+                self.class_name or self.parent or self.text_contains or
+                self.index is not None)
+        only_native_id = (self.resource_id and ':id/' in self.resource_id and
+                not (self.class_name or self.description or self.parent or
+                    self.text_contains or self.index is not None))
+        if By.ACCESSIBILITY_ID in strategies and only_description:
+            locators.append((By.ACCESSIBILITY_ID, self.description))
+        if By.ID in strategies and only_native_id:
+            # ID is matched exactly only with the package, e.g. "android:id/x"
+            locators.append((By.ID, self.resource_id))
+        if By.ANDROID_UIAUTOMATOR in strategies and not locators:
+            locators.append((By.ANDROID_UIAUTOMATOR, self.to_uiautomator()))
+        locators.append((By.XPATH, self.to_xpath()))
+        return locators
+
+    def find(self, driver, timeout=0, poll_interval=0.25, device=None):
+        """Look up its locators, the same as LocatorSet.find"""
+        if self.locator_set is None:
+            self.locator_set = LocatorSet(self.name, self)
+        return self.locator_set.find(driver, timeout, poll_interval, device)
+
+    def __repr__(self):
+        return f'Target({self.name!r})'
+
+
+def get_device_key(driver):
+    """Get the key of the device of the driver to learn the locators by"""
+    capabilities = getattr(driver, 'capabilities', None) or {}
+    return (capabilities.get('udid') or capabilities.get('deviceName') or
+            'default')
+
+
+class LocatorSet:
+    """Alternative locators of one element
+
+    :param locators: Targets, (by, value) tuples, or XPath strings
+    """
+
+    def __init__(self, name, *locators):
+        self.name = name
+        self.entries = locators
+        self.lock = threading.Lock()
+        self.wins = defaultdict(Counter)    # device: {index: wins}
+        self.compiled = {}  # strategies: locators of every alternative
+        self.failed = set()     # locators which raised, e.g. invalid selector
+
+    @property
+    def locators(self):
+        return self.get_locators(ALL_STRATEGIES)
+
+    def get_locators(self, strategies=ALL_STRATEGIES):
+        """Get the (by, value) locators compiled for the strategies"""
+        return [locator for locators in self.get_alternatives(strategies)
+                for locator in locators]
+
+    def get_alternatives(self, strategies=ALL_STRATEGIES):
+        """Get the locators of every alternative, the fallbacks the last"""
+        if strategies not in self.compiled:
+            alternatives = []
+            for entry in self.entries:
+                if isinstance(entry, Target):
+                    alternatives.append(entry.compile(strategies))
+                elif isinstance(entry, tuple):
+                    alternatives.append([entry])
+                else:
+                    alternatives.append([(By.XPATH, entry)])
+            self.compiled[strategies] = alternatives
+        return self.compiled[strategies]
+
+    def get_order(self, device='default', count=None):
+        """Get the indexes of the alternatives, the most winning first"""
+        if count is None:
+            count = len(self.entries)
+        with self.lock:
+            wins = self.wins.get(device, {})
+            return sorted(range(count), key=lambda index: -wins.get(index, 0))
+
+    def record_win(self, device, index):
+        with self.lock:
+            self.wins[device][index] += 1
+
+    def find_elements(self, driver, locators):
+        """Find the elements by the first locator which doesn't raise
+
+        The fallback (e.g. XPath) is not tried if the faster locator just
+        finds nothing, so a negative check stays cheap.
+        """
+        for locator in locators:
+            if locator in self.failed and locator is not locators[-1]:
+                continue
+            by, value = locator
+            try:
+                return driver.find_elements(by=by, value=value)
+            except WebDriverException as e:
+                if locator is locators[-1]:
+                    raise
+                LOGGER.warning(f'Locator of "{self.name}" failed, then'
+                        f' fall back: {by} {value}: {e}')
+                with self.lock:
+                    self.failed.add(locator)
+        return []
+
+    def find(self, driver, timeout=0, poll_interval=0.25, device=None):
+        """Poll all alternatives until one of them matches or timeout
+
+        :return: (element, index of the winning alternative), or (None, None)
+        """
+        if device is None:
+            device = get_device_key(driver)
+        alternatives = self.get_alternatives(get_supported_strategies(driver))
+        order = self.get_order(device, len(alternatives))
+        deadline = time.monotonic() + timeout
+        while True:
+            for index in order:
+                elements = self.find_elements(driver, alternatives[index])
+                if elements:
+                    self.record_win(device, index)
+                    return elements[0], index
+
+            if time.monotonic() >= deadline:
+                return None, None
+            time.sleep(poll_interval)
+
+    def __iter__(self):
+        return iter(self.locators)
+
+    def __repr__(self):
+        return f'LocatorSet({self.name!r}, {self.entries!r})'
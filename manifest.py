@@ -0,0 +1,84 @@
+"""Append-only manifest of the solved rounds, for debugging and replaying
+
+The manifest is a directory with a JSON lines file, one record per line,
+and the captured images stored by the SHA-256 of their content, so the
+same image is stored once::
+
+    manifest/
+        manifest.jsonl
+        blobs/<sha256>.png
+
+Record it by setting the manifest of the flows::
+
+    CaptchaAndroidBaseUI.manifest = RunManifest('manifest')
+
+then replay it with ``python -m benchmark.replay manifest``.
+"""
+import hashlib
+import json
+import logging
+import shutil
+import threading
+import time
+
+from pathlib import Path
+
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = 'manifest.jsonl'
+
+
+class RunManifest:
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.blob_directory = self.directory / 'blobs'
+        self.blob_directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = open(self.directory / MANIFEST_FILE_NAME, 'a')
+
+    def add_blob(self, img_file):
+        """Store the image by its content, return the reference of it"""
+        img_file = Path(img_file)
+        sha256 = hashlib.sha256(img_file.read_bytes()).hexdigest()
+        ref = f'{sha256}{img_file.suffix}'
+        blob_file = self.blob_directory / ref
+        if not blob_file.exists():
+            shutil.copyfile(img_file, blob_file)
+        return ref
+
+    def blob_path(self, ref):
+        return self.blob_directory / ref
+
+    def record(self, kind, **fields):
+        """Append a record, e.g. kind is "solve" or "outcome" """
+        line = json.dumps({'kind': kind, 'time': time.time(), **fields},
+                separators=(',', ':'), default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def record_solve(self, image=None, **fields):
+        """Record a solving, storing the image file into the blobs"""
+        if image:
+            try:
+                fields['image'] = self.add_blob(image)
+            except OSError as e:
+                LOGGER.warning(f'Failed to store the image {image}: {e}')
+        self.record('solve', **fields)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_manifest(directory, kind=None):
+    """Yield the records of the manifest, or just the ones of the kind"""
+    with open(Path(directory) / MANIFEST_FILE_NAME) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if kind is None or record['kind'] == kind:
+                yield record
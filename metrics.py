@@ -0,0 +1,231 @@
+"""Lightweight per-stage timers and counters for the solving path
+
+Usage::
+
+    from metrics import METRICS
+
+    METRICS.enable(jsonl_file='temp/metrics.jsonl')
+    METRICS.serve_prometheus(port=9108)
+
+    with METRICS.span('screenshot'):
+        element.screenshot(img_file)
+    METRICS.incr('upload_bytes', len(img))
+
+When disabled (the default), span() returns a shared no-op context manager
+and incr() returns at once, so the instrumentation costs almost nothing.
+"""
+import json
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from functools import wraps
+
+
+LOGGER = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the histogram buckets of span durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+        30, 60)
+
+
+class _NoopSpan:
+    """The span used when the metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Measure the duration of a stage, and record it on exit"""
+
+    __slots__ = ('metrics', 'stage', 'labels', 'start')
+
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start,
+                error=exc_type is not None, **self.labels)
+        return False
+
+
+class Metrics:
+    """Registry of stage durations and counters"""
+
+    def __init__(self):
+        self.enabled = False
+        self.keep_samples = False
+        self.lock = threading.Lock()
+        self.jsonl_file = None
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # stage -> [count, sum, errors, [bucket counts]]
+            self.durations = defaultdict(
+                    lambda: [0, 0.0, 0, [0] * len(DURATION_BUCKETS)])
+            self.counters = defaultdict(float)
+            # stage -> raw durations, only kept if keep_samples is True
+            self.samples = defaultdict(list)
+
+    def enable(self, jsonl_file=None, keep_samples=False):
+        """Start recording, and append every record to jsonl_file if given
+
+        If keep_samples is True, keep every duration for percentiles,
+        e.g. in the benchmark.
+        """
+        self.enabled = True
+        self.keep_samples = keep_samples
+        if jsonl_file:
+            self.jsonl_file = open(jsonl_file, 'a', buffering=1)
+        LOGGER.debug(f'Metrics enabled, JSON lines file: {jsonl_file}')
+
+    def disable(self):
+        self.enabled = False
+        if self.jsonl_file:
+            self.jsonl_file.close()
+            self.jsonl_file = None
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+
+    def span(self, stage, **labels):
+        """Return a context manager which measures the stage"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, stage, labels)
+
+    def timed(self, stage):
+        """Decorator to measure every call of the function as a stage"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, stage, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, duration, error=False, **labels):
+        """Record the duration (in seconds) of a stage"""
+        if not self.enabled:
+            return
+        with self.lock:
+            record = self.durations[stage]
+            record[0] += 1
+            record[1] += duration
+            if error:
+                record[2] += 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    record[3][i] += 1
+                    break
+            if self.keep_samples:
+                self.samples[stage].append(duration)
+        self._write({'type': 'span', 'stage': stage, 'duration': duration,
+            'error': error, **labels})
+
+    def incr(self, counter, value=1, **labels):
+        """Increase a counter, e.g. bytes uploaded, polls or retries"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[counter] += value
+        self._write({'type': 'counter', 'counter': counter, 'value': value,
+            **labels})
+
+    def _write(self, record):
+        if self.jsonl_file:
+            record['time'] = time.time()
+            line = json.dumps(record)
+            with self.lock:
+                self.jsonl_file.write(line + '\n')
+
+    def snapshot(self):
+        """Return the current durations and counters as a dict"""
+        with self.lock:
+            return {
+                'durations': {stage: {'count': r[0], 'sum': r[1],
+                    'errors': r[2]} for stage, r in self.durations.items()},
+                'counters': dict(self.counters),
+            }
+
+    def percentile(self, stage, percent):
+        """Return the percentile of the kept durations of the stage"""
+        with self.lock:
+            samples = sorted(self.samples.get(stage, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def to_prometheus(self, prefix='captcha'):
+        """Return the metrics in Prometheus text exposition format"""
+        lines = [f'# TYPE {prefix}_stage_seconds histogram']
+        with self.lock:
+            for stage, (count, total, errors, buckets) in sorted(
+                    self.durations.items()):
+                cumulative = 0
+                for bound, bucket in zip(DURATION_BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f'{prefix}_stage_seconds_bucket'
+                            f'{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket'
+                        f'{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+                lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {errors}')
+
+            lines.append(f'# TYPE {prefix}_events_total counter')
+            for counter, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_events_total{{event="{counter}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve_prometheus(self, port=9108, host='127.0.0.1'):
+        """Serve the metrics at http://host:port/metrics in background"""
+        # imported here since it is slow and rarely used
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                        'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOGGER.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        LOGGER.info(f'Serve metrics at http://{host}:{self.server.server_port}/metrics')
+        return self.server
+
+
+METRICS = Metrics()
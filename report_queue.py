@@ -0,0 +1,154 @@
+"""Background queue of the reports of wrongly solved captchas
+
+Reporting is a network call to the provider, which must not add to the
+latency of the solving flow, so the reports are put into a queue, and a
+daemon worker sends them in batches, retries the failed ones, and ignores
+the captchas which have been reported. The queues are flushed at exit.
+
+Usage::
+
+    queue = ReportQueue('deathbycaptcha', client.report)
+    queue.put(cid)
+"""
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ReportQueue:
+    """Send the reports by send(cid, **kwargs) in a background worker
+
+    :param batch_interval: seconds to gather the reports of one batch
+    :param batch_size: max reports in one batch
+    :param retry_times: times to retry a failed report, then drop it
+    :param retry_interval: seconds between the retries
+    :param max_reported: the number of the latest reported captchas to
+        remember, so that they are not reported again
+    """
+
+    def __init__(self, name, send, batch_interval=0.5, batch_size=20,
+            retry_times=3, retry_interval=2, max_reported=10000):
+        self.name = name
+        self.send = send
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.retry_times = retry_times
+        self.retry_interval = retry_interval
+        self.max_reported = max_reported
+
+        self.condition = threading.Condition()
+        self.pending = {}       # cid: kwargs, in the order of putting
+        self.reported = OrderedDict()   # cids which are sent or sending
+        self.sending = 0
+        self.closed = False
+        self.thread = None
+        _queues.add(self)
+
+    def put(self, cid, **kwargs):
+        """Queue the report, return False if the captcha has been reported"""
+        with self.condition:
+            if cid in self.reported:
+                LOGGER.debug(f'Captcha {cid} has been reported to {self.name}')
+                return False
+            if self.closed:
+                LOGGER.warning(f'Report queue of {self.name} is closed,'
+                        f' drop the report of captcha {cid}')
+                return False
+            self.pending[cid] = kwargs
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, daemon=True,
+                        name=f'report-{self.name}')
+                self.thread.start()
+            self.condition.notify_all()
+        return True
+
+    def take_batch(self):
+        """Wait for a batch of reports, or return None when closed"""
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            if not self.closed and len(self.pending) < self.batch_size:
+                # gather more reports into the batch
+                self.condition.wait(self.batch_interval)
+
+            batch = list(self.pending.items())[:self.batch_size]
+            for cid, kwargs in batch:
+                del self.pending[cid]
+                self.reported[cid] = True
+            while len(self.reported) > self.max_reported:
+                self.reported.popitem(last=False)
+            self.sending += len(batch)
+            return batch
+
+    def send_one(self, cid, kwargs):
+        for times in range(self.retry_times + 1):
+            try:
+                self.send(cid, **kwargs)
+                METRICS.incr('reports', provider=self.name)
+                return True
+            except Exception as e:
+                LOGGER.debug(f'Failed to report captcha {cid} to {self.name}:'
+                        f' {e}')
+            if times < self.retry_times:
+                time.sleep(self.retry_interval)
+
+        LOGGER.warning(f'Drop the report of captcha {cid} to {self.name}')
+        METRICS.incr('report_failures', provider=self.name)
+        return False
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            LOGGER.debug(f'Send {len(batch)} reports to {self.name}')
+            for cid, kwargs in batch:
+                try:
+                    self.send_one(cid, kwargs)
+                finally:
+                    with self.condition:
+                        self.sending -= 1
+                        self.condition.notify_all()
+
+    def flush(self, timeout=10):
+        """Wait until all queued reports are sent, return False if timeout"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.condition.notify_all()
+            while self.pending or self.sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not (self.thread and self.thread.is_alive()):
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Send the queued reports, then stop the worker"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+        return not self.pending
+
+
+_queues = weakref.WeakSet()
+
+
+@atexit.register
+def flush_all(timeout=10):
+    """Flush all report queues, e.g. at exit"""
+    for queue in list(_queues):
+        if queue.pending or queue.sending:
+            queue.flush(timeout)
@@ -0,0 +1,125 @@
+"""Upload resolution learned per device and challenge type
+
+For every (device model, screen size, CAPTCHA type, provider), the
+controller remembers the final reduce factor of restrict_image_size, so the
+next search starts from it instead of from the hard-coded factor, and the
+accuracy of the rounds captured at every scale of a ladder, judged by the
+outcome pages. It chooses the smallest scale whose recent accuracy is still
+above the target, trying the next smaller one now and then::
+
+    CaptchaAndroidBaseUI.resolution_controller = ResolutionController(
+            'resolution.json')
+
+The state is saved to the JSON file after every round, and loaded in the
+next run.
+"""
+import json
+import logging
+import os
+import random
+import threading
+
+from pathlib import Path
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_resolution_key(device_model, screen_size, captcha_type, provider):
+    return '|'.join(str(part) for part in (device_model, screen_size,
+        captcha_type, provider))
+
+
+class ResolutionController:
+    """
+    :param path: the JSON file of the state, not saved if None
+    :param scales: the ladder of the capture scales, the largest first
+    :param target_accuracy: the accuracy a smaller scale must keep
+    :param min_rounds: the accuracy of a scale is unknown until so many rounds
+    :param explore_ratio: ratio of the rounds to try the next smaller scale
+        whose accuracy is unknown
+    :param window: the number of recent rounds to judge the accuracy
+    """
+
+    def __init__(self, path=None, scales=(1, 0.85, 0.7, 0.6, 0.5),
+            target_accuracy=0.8, min_rounds=10, explore_ratio=0.1, window=50):
+        self.path = Path(path) if path else None
+        self.scales = scales
+        self.target_accuracy = target_accuracy
+        self.min_rounds = min_rounds
+        self.explore_ratio = explore_ratio
+        self.window = window
+        self.lock = threading.Lock()
+        # key: {'start_factors': {scale: factor}, 'outcomes': {scale: [0|1]}}
+        self.state = {}
+        self.load()
+
+    def load(self):
+        if not (self.path and self.path.exists()):
+            return
+        try:
+            self.state = json.loads(self.path.read_text())
+            LOGGER.debug(f'Load the resolution state of {len(self.state)} keys')
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f'Cannot load the resolution state {self.path}: {e}')
+
+    def save(self):
+        """Save the state atomically"""
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.state, indent=1, sort_keys=True)
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        try:
+            tmp_path.write_text(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            LOGGER.warning(f'Cannot save the resolution state {self.path}: {e}')
+
+    def get_entry(self, key):
+        return self.state.setdefault(key, {'start_factors': {}, 'outcomes': {}})
+
+    def get_start_factor(self, key, scale=1):
+        """Get the final reduce factor of the last search, or None"""
+        with self.lock:
+            return self.state.get(key, {}).get('start_factors', {}).get(
+                    str(scale))
+
+    def record_reduce_factor(self, key, scale, reduce_factor):
+        with self.lock:
+            self.get_entry(key)['start_factors'][str(scale)] = reduce_factor
+
+    def accuracy(self, key, scale):
+        """Get (accuracy, rounds) of the scale, accuracy is None if no round"""
+        with self.lock:
+            outcomes = self.state.get(key, {}).get('outcomes', {}).get(
+                    str(scale), [])
+        if not outcomes:
+            return None, 0
+        return sum(outcomes) / len(outcomes), len(outcomes)
+
+    def choose_scale(self, key):
+        """Choose the smallest scale which still solves reliably"""
+        chosen = self.scales[0]
+        for scale in self.scales[1:]:
+            accuracy, rounds = self.accuracy(key, scale)
+            if rounds < self.min_rounds:
+                if random.random() < self.explore_ratio:
+                    LOGGER.debug(f'Try the capture scale {scale} for {key}')
+                    chosen = scale
+                break
+            if accuracy < self.target_accuracy:
+                break
+            chosen = scale
+        return chosen
+
+    def record_outcome(self, key, scale, correct):
+        """Record the outcome of a round captured at the scale"""
+        with self.lock:
+            outcomes = self.get_entry(key)['outcomes'].setdefault(str(scale), [])
+            outcomes.append(1 if correct else 0)
+            del outcomes[:-self.window]
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.state))
@@ -0,0 +1,108 @@
+"""Coalescing of the identical uploads in flight
+
+When many devices get the same challenge at the same time, the first caller
+uploads it and polls the result, and the others with the same payload and
+hint wait for its result instead of uploading again::
+
+    captcha, shared = SINGLEFLIGHT.do(get_payload_key(image_file, 'type=2'),
+            lambda: client.decode(image_file, type=2), timeout=30)
+
+Every waiting caller has its own timeout, after which it gets None, as
+decode() does if the captcha is not solved in time. The calls are coalesced
+among the threads of one process only.
+"""
+import hashlib
+import logging
+import threading
+
+from pathlib import Path
+
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_payload_key(payload, *params):
+    """Get the key of the payload (file path or bytes) with its parameters
+
+    :return: the hex digest, or None for other payloads, e.g. file objects
+    """
+    if isinstance(payload, (str, Path)):
+        try:
+            payload = Path(payload).read_bytes()
+        except OSError:
+            return None
+    if not isinstance(payload, bytes):
+        return None
+
+    digest = hashlib.sha256(payload)
+    for param in params:
+        digest.update(b'\0' + str(param).encode())
+    return digest.hexdigest()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}     # key: the call in flight
+
+    def do(self, key, func, timeout=None):
+        """Call func(), or wait for the result of the same call in flight
+
+        :param key: the key of the call, func() is called directly if None
+        :param timeout: seconds to wait for the call in flight
+        :return: (result, shared), shared is True if the result is of the
+            call of another caller
+        """
+        if key is None:
+            return func(), False
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = func()
+                return call.result, False
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+                if call.waiters:
+                    LOGGER.debug(f'Shared the result with {call.waiters} callers')
+
+        METRICS.incr('coalesced_calls')
+        LOGGER.debug(f'Wait for the same call in flight: {key[:12]}')
+        if not call.done.wait(timeout):
+            LOGGER.info(f'Timeout of waiting for the call in flight: {key[:12]}')
+            METRICS.incr('coalesced_timeouts')
+            return None, True
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+
+SINGLEFLIGHT = SingleFlight()
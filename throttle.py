@@ -0,0 +1,221 @@
+"""Rate limiting and circuit breaking of the requests to CAPTCHA providers
+
+Every provider has one shared ProviderGuard in the process, which combines:
+
+- a token bucket limiting the rate of uploads, where the callers wait in
+  a queue for their tokens;
+- a circuit breaker which opens after a burst of overload errors (e.g. DBC
+  service overload, HTTP 503), sheds or queues new uploads while open, then
+  lets a few probe requests through (half-open) to decide whether to close.
+
+Usage::
+
+    guard = get_provider_guard('deathbycaptcha')
+    captcha = guard.call(client.decode, captcha_file, type=2)
+
+The orchestrator can watch guard.snapshot() (state and queue depth) to slow
+down the UI flows instead of burning retries.
+"""
+import logging
+import threading
+import time
+
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """The provider is overloaded, the request is shed without sending"""
+    pass
+
+
+class TokenBucket:
+    """Allow rate requests per second with bursts up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Take a token, or return the seconds to wait for the next one"""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ProviderGuard:
+    """Token bucket and circuit breaker of one provider
+
+    :param rate: uploads per second, None for no limit
+    :param burst: capacity of the token bucket
+    :param failure_threshold: overload errors in failure_window seconds to
+        open the circuit
+    :param open_timeout: seconds to stay open before half-open, doubled
+        every time a probe fails, up to max_open_timeout
+    :param half_open_probes: requests let through when half-open
+    :param shed: if True, raise CircuitOpenError at once when open,
+        otherwise wait in the queue until half-open or max_wait
+    :param max_wait: max seconds to wait in the queue
+    :param failure_exceptions: exceptions counted as overload errors
+    """
+
+    def __init__(self, name, rate=None, burst=10, failure_threshold=5,
+            failure_window=30, open_timeout=10, max_open_timeout=120,
+            half_open_probes=1, shed=False, max_wait=30,
+            failure_exceptions=(OverflowError,)):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.base_open_timeout = open_timeout
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.half_open_probes = half_open_probes
+        self.shed = shed
+        self.max_wait = max_wait
+        self.failure_exceptions = failure_exceptions
+
+        self.condition = threading.Condition()
+        self.state = CLOSED
+        self.failures = []  # times of recent overload errors
+        self.opened_at = None
+        self.probes = 0     # probe requests in flight when half-open
+        self.queue_depth = 0
+
+    def snapshot(self):
+        with self.condition:
+            return {'name': self.name, 'state': self.state,
+                    'queue_depth': self.queue_depth,
+                    'recent_failures': len(self.failures)}
+
+    def _update_state(self):
+        if self.state == OPEN and (
+                time.monotonic() - self.opened_at >= self.open_timeout):
+            LOGGER.info(f'Circuit of {self.name} is half-open')
+            self.state = HALF_OPEN
+            self.probes = 0
+
+    def _try_enter(self):
+        """Return 0 if the request can be sent, or seconds to wait"""
+        self._update_state()
+        if self.state == OPEN:
+            return self.opened_at + self.open_timeout - time.monotonic()
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_probes:
+                return self.open_timeout
+            wait = self.bucket.try_take() if self.bucket else 0
+            if not wait:
+                self.probes += 1
+            return wait
+        return self.bucket.try_take() if self.bucket else 0
+
+    def acquire(self):
+        """Wait for the permission to send a request
+
+        :return: True if the request is a half-open probe
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self.condition:
+            self.queue_depth += 1
+            try:
+                while True:
+                    state = self.state
+                    wait = self._try_enter()
+                    if not wait:
+                        return self.state == HALF_OPEN
+                    if self.state != CLOSED and self.shed:
+                        raise CircuitOpenError(
+                                f'Circuit of {self.name} is {self.state}')
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        METRICS.incr('circuit_shed', provider=self.name)
+                        raise CircuitOpenError(f'Waited for {self.name} too'
+                                f' long, circuit: {state}')
+                    self.condition.wait(min(wait, remaining))
+            finally:
+                self.queue_depth -= 1
+
+    def record_success(self, probe=False):
+        with self.condition:
+            if probe:
+                self.probes -= 1
+            if self.state == HALF_OPEN:
+                LOGGER.info(f'Circuit of {self.name} is closed')
+                self.state = CLOSED
+                self.failures = []
+                self.open_timeout = self.base_open_timeout
+            self.condition.notify_all()
+
+    def record_failure(self, probe=False):
+        now = time.monotonic()
+        with self.condition:
+            if probe:
+                self.probes -= 1
+            if self.state == HALF_OPEN:
+                self.open_timeout = min(self.open_timeout * 2,
+                        self.max_open_timeout)
+                self._open(now)
+                return
+
+            self.failures = [t for t in self.failures
+                    if now - t < self.failure_window] + [now]
+            if self.state == CLOSED and (
+                    len(self.failures) >= self.failure_threshold):
+                self._open(now)
+
+    def _open(self, now):
+        LOGGER.warning(f'Circuit of {self.name} is open for'
+                f' {self.open_timeout}s because of overload')
+        METRICS.incr('circuit_opened', provider=self.name)
+        self.state = OPEN
+        self.opened_at = now
+        self.condition.notify_all()
+
+    def release(self, probe=False):
+        """Finish a request which is neither success nor overload"""
+        with self.condition:
+            if probe:
+                self.probes -= 1
+            self.condition.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """Call func when permitted, and record its result"""
+        probe = self.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure(probe)
+            raise
+        except BaseException:
+            self.release(probe)
+            raise
+        self.record_success(probe)
+        return result
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_provider_guard(name, **kwargs):
+    """Get the shared guard of the provider, creating it with kwargs"""
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = ProviderGuard(name, **kwargs)
+        return _guards[name]
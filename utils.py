@@ -1,15 +1,48 @@
+import importlib
 import logging
 import os
 import random
+import threading
 import time
 import uuid
 
 from pathlib import Path
-from PIL import Image
+
+from metrics import METRICS
 
 
 LOGGER = logging.getLogger(__name__)
 
+
+class LazyModule:
+    """Module which is imported on the first access of its attributes"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                LOGGER.debug(f'Import module lazily: {self._name}')
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+
+def lazy_import(name):
+    """Import the module on first use, e.g. the optional providers"""
+    return LazyModule(name)
+
+
+Image = lazy_import('PIL.Image')
+
 def random_sleep(min_sleep_time=1, max_sleep_time=5):
     """
     Random sleep
@@ -65,19 +98,31 @@ def resize_img(img_file, reduce_factor=1):
 
     return small_img_file
 
-def restrict_image_size(img_file, reduce_factor, reduce_step, restrict_size):
-    """Reduce the image file size to let it be less than restricting size"""
+def restrict_image_size(img_file, reduce_factor, reduce_step, restrict_size,
+        start_factor=None):
+    """Reduce the image file size to let it be less than restricting size
+
+    :param start_factor: the reduce factor to start the search from if the
+        image must be reduced, e.g. the final one of the last search
+    :return: (reduced image file, reduce factor), where the factor is 1 if
+        the image is not reduced, as it maps the coordinates to the image
+    """
     img_file_size = os.path.getsize(img_file)
 
     if img_file_size <= restrict_size:
         reduced_img_file = img_file
+        reduce_factor = 1
+    elif start_factor and start_factor > reduce_factor + reduce_step:
+        reduce_factor = start_factor - reduce_step
 
     times = 0
-    while img_file_size > restrict_size:
-        reduce_factor += reduce_step
-        reduced_img_file = resize_img(img_file, reduce_factor)
-        img_file_size = os.path.getsize(reduced_img_file)
-        times += 1
+    with METRICS.span('restrict_image_size'):
+        while img_file_size > restrict_size:
+            reduce_factor += reduce_step
+            reduced_img_file = resize_img(img_file, reduce_factor)
+            img_file_size = os.path.getsize(reduced_img_file)
+            times += 1
+    METRICS.incr('reduce_iterations', times)
 
     LOGGER.debug(f'Reduced image file: {reduced_img_file}')
     LOGGER.debug(f'After {times} times of reducing, the image file size'
@@ -109,6 +154,65 @@ def reduce_img_size(img_file, reduce_factor=1):
 
     return small_img_file
 
+def scale_img(img_file, scale, quality=None):
+    """Scale the image file in place once, e.g. a capture to a lower resolution
+
+    :param quality: quality of the JPEG file, ignored by other formats
+    """
+    with METRICS.span('scale_img'):
+        with Image.open(img_file) as img:
+            width = max(1, int(img.size[0] * scale))
+            height = max(1, int(img.size[1] * scale))
+            small_img = img.resize((width, height))
+        options = {}
+        if str(img_file).lower().endswith(('.jpg', '.jpeg')):
+            small_img = small_img.convert('RGB')
+            if quality:
+                options['quality'] = quality
+        small_img.save(img_file, **options)
+    return img_file
+
+def get_img_hash(img_file, box=None, hash_size=16):
+    """Get the difference hash of the image, or of its box part"""
+    with Image.open(img_file) as img:
+        if box:
+            img = img.crop(box)
+        small_img = img.convert('L').resize((hash_size + 1, hash_size))
+        pixels = list(small_img.getdata())
+
+    img_hash = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            img_hash = (img_hash << 1) | (left > right)
+    return img_hash
+
+def get_hash_distance(hash1, hash2):
+    """Get the number of different bits between two image hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+def stack_img_boxes(src_img_file, boxes, dest_img_file):
+    """Crop the boxes from the image, then stack them vertically into a file
+
+    :return: top offsets of the boxes in the destination image
+    """
+    offsets = []
+    with Image.open(src_img_file) as img:
+        crops = [img.crop(box) for box in boxes]
+        width = max(crop.width for crop in crops)
+        height = sum(crop.height for crop in crops)
+        stacked_img = Image.new(img.mode, (width, height))
+
+    top = 0
+    for crop in crops:
+        stacked_img.paste(crop, (0, top))
+        offsets.append(top)
+        top += crop.height
+    stacked_img.save(dest_img_file)
+
+    return offsets
+
 def get_absolute_path_str(path):
     if isinstance(path, Path):
         absolute_path = str(path.absolute())
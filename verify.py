@@ -1,29 +1,49 @@
 import base64
+import itertools
+import json
 import re
 import time
-import random
 import logging
-import twocaptcha
+import threading
 
-from appium.webdriver.common.touch_action import TouchAction
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
+from selenium.common.exceptions import StaleElementReferenceException
 from pathlib import Path
-from PIL import Image
 from io import BytesIO
-from dbc_api_python3 import deathbycaptcha
-from twocaptcha import TwoCaptcha
-
-from utils import reduce_img_size, random_sleep, get_absolute_path_str
-from utils import resize_img, restrict_image_size, get_random_file_name
-from utils import _add_suffix_name
 
+from utils import lazy_import, Image
+from utils import get_absolute_path_str, restrict_image_size
+from utils import _add_suffix_name, get_img_hash, get_hash_distance
+from utils import stack_img_boxes
+from metrics import METRICS
+from throttle import CircuitOpenError, get_provider_guard
+from report_queue import ReportQueue
+from accuracy import ACCURACY, get_provider_name
+from image_store import get_image_store
+from locators import By, LocatorSet, Target, get_device_key
+from element_cache import ElementCache, cache_element
+from frame_source import MjpegFrameSource, ScreenshotFrameSource, has_mjpeg_server
+from webview import read_webview_image
+from singleflight import SINGLEFLIGHT, get_payload_key
+from resolution import get_resolution_key
+
+
+# the providers and drivers are imported on first use, so that the workers
+# start fast, and the provider which is not used needn't be installed
+twocaptcha = lazy_import('twocaptcha')
+deathbycaptcha = lazy_import('dbc_api_python3.deathbycaptcha')
+touch_action = lazy_import('appium.webdriver.common.touch_action')
+support_ui = lazy_import('selenium.webdriver.support.ui')
+EC = lazy_import('selenium.webdriver.support.expected_conditions')
 
 LOGGER = logging.getLogger(__name__)
 CAPTCHA_IMAGE_DIR = Path(__file__).parent / 'temp'
 
+
+# result of resolving when the captcha image is the same as the last one
+CAPTCHA_IMG_UNCHANGED = 'unchanged'
+
 class CaptchaTooManyRetryException(Exception):
     pass
 
@@ -62,6 +82,14 @@ class TwoCaptchaAPI:
 
     image_restrict_size = 1024 * 100  # 100KB
 
+    provider = '2captcha'
+
+    # rate limiting of uploads shared by all instances in the process
+    upload_rate = 10    # uploads per second
+    upload_burst = 20
+    # share one upload among the callers with the same image and hint
+    coalesce_uploads = True
+
     TWOCAPTCHA_API_KEY = '<your 2captcha api key>'
 
     def __init__(self, api_key=TWOCAPTCHA_API_KEY, timeout=30):
@@ -73,7 +101,13 @@ class TwoCaptchaAPI:
         self.api_key = api_key
         self.client = None
         self.timeout = timeout
-        self.client = TwoCaptcha(self.api_key, defaultTimeout=timeout)
+        self.client = twocaptcha.TwoCaptcha(self.api_key, defaultTimeout=timeout)
+        self.guard = get_provider_guard(self.provider, rate=self.upload_rate,
+                burst=self.upload_burst,
+                # only the overload and network errors open the circuit,
+                # not the errors of the key or balance which don't recover
+                failure_exceptions=(twocaptcha.NetworkException,))
+        self.report_queue = ReportQueue(self.provider, self.client.report)
 
     def get_balance(self):
         """
@@ -84,6 +118,21 @@ class TwoCaptchaAPI:
         LOGGER.info(f'The balance is {balance}')
         return balance
 
+    def warm_up(self, background=False):
+        """
+        Check the API key and open the connection before the first captcha
+        :param background: Warm up in a daemon thread, and return the thread
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, daemon=True)
+            thread.start()
+            return thread
+
+        try:
+            self.get_balance()
+        except Exception as e:
+            LOGGER.warning(f'Failed to warm up 2captcha client: {e}')
+
     def report_failure(self, cid, reason=''):
         """
         It reports when captcha solved wrongly
@@ -95,7 +144,7 @@ class TwoCaptchaAPI:
                     f' because of {reason}')
         else:
             LOGGER.debug(f'Report failed resolving for captcha: {cid}')
-        self.client.report(cid, correct=False)
+        self.report_queue.put(cid, correct=False)
 
     def report_success(self, cid, reason=''):
         """
@@ -107,19 +156,44 @@ class TwoCaptchaAPI:
             LOGGER.debug(f'Report failed resolving for captcha: {cid}, because of {reason}')
         else:
             LOGGER.debug(f'Report failed resolving for captcha: {cid}')
-        self.client.report(cid, correct=True)
+        self.report_queue.put(cid, correct=True)
+
+    def report_failed_resolving(self, cid, reason=''):
+        """The same as report_failure, named as DeathByCaptchaUI does"""
+        self.report_failure(cid, reason)
 
-    def resolve_recaptcha_with_coordinates_api(self, image_file, hint_text):
+    def close(self):
+        """Send the queued reports"""
+        self.report_queue.close()
+
+    def resolve_recaptcha_with_coordinates_api(self, image_file, hint_text,
+            budget=None, cids=None):
         """
         Resolve New Recaptcha from the image file using coordinates API.
         :param image_file: It should be file path
         :param hint_text: Hint text to solve captcha
+        :param budget: SessionBudget to consult before uploading
+        :param cids: list to append the ID of the solved captcha, unless the
+            upload is shared with another caller
         """
         real_coordinates = []
+        if budget:
+            reason = budget.exhausted_reason()
+            if reason:
+                LOGGER.info(f'Session budget is exhausted: {reason}')
+                return real_coordinates
         try:
             reduce_factor, b64_img = self.get_restricted_encoded_image(image_file)
             LOGGER.info(f'Captcha image reduce factor: {reduce_factor}')
-            captcha = self.client.coordinates(b64_img, hintText=hint_text)
+            key = (get_payload_key(b64_img.encode(), self.provider, hint_text)
+                    if self.coalesce_uploads else None)
+            with METRICS.span('solve'):
+                captcha, shared = SINGLEFLIGHT.do(key, lambda: self.guard.call(
+                    self.client.coordinates, b64_img, hintText=hint_text),
+                    self.timeout)
+            captcha = captcha or {}
+            if budget and not shared:
+                budget.record_upload(solved='captchaId' in captcha)
 
             if 'captchaId' in captcha:
                 cid = captcha['captchaId']
@@ -131,18 +205,56 @@ class TwoCaptchaAPI:
                         int(int(y) * reduce_factor)))
                 LOGGER.info(f'Real coordinates: {real_coordinates}')
                 if not real_coordinates:
-                    self.report_failure(cid, reason="co-ordinates are not present")
+                    if not shared:
+                        self.report_failure(cid,
+                                reason="co-ordinates are not present")
+                elif cids is not None and not shared:
+                    cids.append(cid)
             else:
                 LOGGER.debug(f'CAPTCHA: {captcha}')
         except KeyboardInterrupt as e:
             raise e
         except twocaptcha.TimeoutException as e:
             LOGGER.debug(e)
+        except CircuitOpenError as e:
+            LOGGER.warning(e)
         except Exception as e:
+            # the guard waits or sheds when the errors are too many
             LOGGER.debug(f'Error: {e} while solving captcha')
-            random_sleep(5, 6)
         return real_coordinates
 
+    def resolve_newrecaptcha_ui_with_coordinates_api(self, image_file,
+            reduce_factor=1, reduce_step=0.125, retry_times=2, timeout=None,
+            report_blank_list=False, budget=None, cids=None,
+            start_factor=None, hint_text=None):
+        """User interface for resolving New Recaptcha, the same as
+        DeathByCaptchaUI does, so that the UI flows can choose either
+
+        No coordinates is a failure of 2captcha, which is retried. The
+        timeout is of the client.
+
+        :return: (coordinates, reduce_factor) or False
+        """
+        (image_file, last_reduce_factor) = restrict_image_size(image_file,
+                reduce_factor, reduce_step, self.image_restrict_size,
+                start_factor)
+
+        for times in range(retry_times + 1):
+            if budget and budget.exhausted_reason():
+                LOGGER.info('Session budget is exhausted')
+                return False
+            if times:
+                # the service is overloaded, don't burn the retries
+                if self.guard.snapshot()['state'] == 'open':
+                    return False
+                LOGGER.warning(f'Failed to resolve captcha, then retry: {times}')
+                METRICS.incr('resolve_retries')
+            coordinates = self.resolve_recaptcha_with_coordinates_api(
+                    image_file, hint_text, budget=budget, cids=cids)
+            if coordinates:
+                return (coordinates, last_reduce_factor)
+        return False
+
     @staticmethod
     def get_restricted_encoded_image(image_file, reduce_factor=1, reduce_step=0.125,
             max_img_size=100):
@@ -201,34 +313,141 @@ class DeathByCaptchaUI:
 
     image_restrict_size = 1024 * 180    # 180KB
 
+    provider = 'deathbycaptcha'
+
+    # rate limiting of uploads shared by all instances in the process
+    upload_rate = 10    # uploads per second
+    upload_burst = 20
+    # share one upload and poll among the callers with the same image and
+    # parameters, e.g. many devices getting the same challenge at once
+    coalesce_uploads = True
+
     DBC_USERNAME = '<your dbc username>'
     DBC_PASSWORD = '<your dbc password>'
 
+    # seconds between the cheap calls to keep the warmed up clients alive
+    keepalive_interval = 60
+
     def __init__(self, username=DBC_USERNAME, password=DBC_PASSWORD,
-            authtoken=None, timeout=60, client_type='http'):
+            authtoken=None, timeout=60, client_type='http', pool_size=1,
+            warm_up=False):
         self.username = username
         self.password = password
         self.authtoken = authtoken
         self.client = None
         self.timeout = timeout
         self.client_type = client_type
+        self.rate = None    # US cents per solved captcha, got from get_user
+
+        self.pool_size = pool_size
+        self.pool = []
+        self.pool_cycle = None
+        self.pool_lock = threading.Lock()
+        self.keepalive_stop = threading.Event()
+        self.keepalive_thread = None
+        self.guard = get_provider_guard(self.provider, rate=self.upload_rate,
+                burst=self.upload_burst,
+                # service overload and network errors, while the denied
+                # access is left to the balance check of the retries
+                failure_exceptions=(OverflowError, OSError))
+        # reports are sent in background by a separate client
+        self.report_client = None
+        self.report_queue = ReportQueue(self.provider, self.send_report)
+        if warm_up:
+            self.warm_up(background=True)
 
     def get_client(self, client_type='http'):
         client_type = str.lower(client_type)
         if client_type == 'http':
-            self.client = deathbycaptcha.HttpClient(self.username, self.password, self.authtoken)
+            client = deathbycaptcha.HttpClient(self.username, self.password, self.authtoken)
         elif client_type == 'socket':
-            self.client = deathbycaptcha.SocketClient(self.username, self.password, self.authtoken)
+            client = deathbycaptcha.SocketClient(self.username, self.password, self.authtoken)
         else:
             LOGGER.error('Wrong client type, just use "http" or "socket"')
+            return self.client
 
-        return self.client
+        client.metrics = METRICS
+        self.client = client
+        return client
+
+    def get_pressure(self):
+        """Get the state and queue depth of the provider's circuit breaker
+
+        The UI flows can be slowed down when the provider is overloaded.
+        """
+        return self.guard.snapshot()
 
     def get_same_client(self, client_type='http'):
-        """Get the same client for all operations"""
-        if not self.client:
+        """Get the same client for all operations
+
+        If the clients have been warmed up, get them from the pool in turn.
+        The client is returned to be used by the caller, as self.client may
+        be changed by the other threads at the same time.
+        """
+        if self.pool_cycle:
+            with self.pool_lock:
+                client = self.client = next(self.pool_cycle)
+            return client
+        client = self.client
+        if not client:
             return self.get_client(client_type)
-        return self.client
+        return client
+
+    def warm_up(self, background=False):
+        """Open and log in pool_size clients before the first captcha
+
+        Then keep them alive with cheap calls every keepalive_interval.
+        If background is True, warm up in a daemon thread and return it.
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, daemon=True)
+            thread.start()
+            return thread
+
+        LOGGER.debug(f'Warm up {self.pool_size} {self.client_type} clients')
+        clients = []
+        for i in range(self.pool_size):
+            client = self.get_client(self.client_type)
+            if not client:
+                return
+            try:
+                client.get_user()   # connect and log in
+            except Exception as e:
+                LOGGER.warning(f'Failed to warm up client: {e}')
+            clients.append(client)
+
+        with self.pool_lock:
+            self.pool = clients
+            self.pool_cycle = itertools.cycle(clients)
+            self.client = clients[0]
+        self.start_keepalive()
+
+    def start_keepalive(self):
+        if self.keepalive_thread or not self.keepalive_interval:
+            return
+
+        def keepalive():
+            while not self.keepalive_stop.wait(self.keepalive_interval):
+                for client in list(self.pool):
+                    try:
+                        client.get_user()
+                    except Exception as e:
+                        LOGGER.debug(f'Failed to keep client alive: {e}')
+
+        self.keepalive_thread = threading.Thread(target=keepalive, daemon=True)
+        self.keepalive_thread.start()
+
+    def close(self):
+        """Send the queued reports, stop keeping alive, and close all clients"""
+        self.report_queue.close()
+        self.keepalive_stop.set()
+        with self.pool_lock:
+            clients = (self.pool or [self.client]) + [self.report_client]
+            self.pool = []
+            self.pool_cycle = None
+        for client in clients:
+            if client:
+                client.close()
 
     def get_balance(self):
         self.get_client()
@@ -236,15 +455,47 @@ class DeathByCaptchaUI:
         LOGGER.info(f'The balance of "{self.username}": {balance}')
         return balance
 
+    def get_rate(self):
+        """Get the cost of one solved captcha in US cents"""
+        if self.rate is None:
+            user = self.get_same_client(self.client_type).get_user()
+            self.rate = user.get('rate')
+            LOGGER.debug(f'The rate of "{self.username}": {self.rate}')
+        return self.rate
+
     def report_failed_resolving(self, cid, reason=''):
         if reason:
             LOGGER.debug(f'Report failed resolving for captcha: {cid}, because of {reason}')
         else:
             LOGGER.debug(f'Report failed resolving for captcha: {cid}')
-        self.client.report(cid)
+        self.report_queue.put(cid)
+
+    def send_report(self, cid):
+        """Report the captcha, called by the worker of report_queue"""
+        if not self.report_client:
+            self.report_client = deathbycaptcha.HttpClient(self.username,
+                    self.password, self.authtoken)
+        self.report_client.report(cid)
+
+    def decode(self, captcha_file, timeout, client=None, **kwargs):
+        """Upload the captcha and poll its result, or wait for the result of
+        the same upload in flight
+
+        :param client: the client to upload by, self.client if None
+        :return: (captcha, shared), shared is True if the captcha is
+            uploaded by another caller
+        """
+        client = client or self.client
+        key = None
+        if self.coalesce_uploads:
+            key = get_payload_key(captcha_file, self.provider,
+                    *sorted(kwargs.items()))
+        return SINGLEFLIGHT.do(key, lambda: self.guard.call(client.decode,
+            captcha_file, timeout=timeout, **kwargs), timeout)
 
     def resolve_newrecaptcha_with_coordinates_api(self, image_file,
-            timeout=None, same_client=True, report_blank_list=False):
+            timeout=None, same_client=True, report_blank_list=False,
+            budget=None, cids=None):
         """Resolve New Recaptcha from the image file using coordinates API.
 
         Coordinates API FAQ:
@@ -279,11 +530,12 @@ class DeathByCaptchaUI:
 
             where the X coordinate is 23.21 and the Y coordinate is 82.11
         """
-        # get one client every time or just use the same client for all operations
+        # get one client every time or just use the same client for all
+        # operations, kept local as the calls may run in parallel threads
         if same_client:
-            self.get_same_client(client_type=self.client_type)
+            client = self.get_same_client(client_type=self.client_type)
         else:
-            self.get_client(client_type=self.client_type)
+            client = self.get_client(client_type=self.client_type)
 
         if isinstance(image_file, Path) or isinstance(image_file, str):
             captcha_file = get_absolute_path_str(image_file)
@@ -295,7 +547,10 @@ class DeathByCaptchaUI:
 
         # Put your CAPTCHA file name or file-like object, and optional
         # solving timeout (in seconds) here:
-        captcha = self.client.decode(captcha_file, type=2, timeout=timeout)
+        captcha, shared = self.decode(captcha_file, timeout, client,
+                type=2)
+        if budget and not shared:
+            budget.record_upload(solved=bool(captcha), cost=self.rate)
         if captcha:
             # The CAPTCHA was solved; captcha["captcha"] item holds its
             # numeric ID, and captcha["text"] item its list of "coordinates".
@@ -304,8 +559,10 @@ class DeathByCaptchaUI:
             #  LOGGER.debug(f"CAPTCHA: {captcha}")
             LOGGER.debug(f"CAPTCHA {cid} solved: {coordinates}")
 
+            # the callers sharing the upload leave reporting to the uploader
             if not coordinates:  # check if the CAPTCHA was incorrectly solved
-                self.report_failed_resolving(cid)
+                if not shared:
+                    self.report_failed_resolving(cid)
                 return False
             else:
                 # the coordinates list is string
@@ -313,34 +570,111 @@ class DeathByCaptchaUI:
 
                 # if the result is blank list
                 if not result and report_blank_list:
-                    self.report_failed_resolving(cid,
-                            reason='blank list of result')
+                    if not shared:
+                        self.report_failed_resolving(cid,
+                                reason='blank list of result')
+                elif cids is not None and not shared:
+                    # to report if the outcome of the round is wrong, by
+                    # the uploader only if the upload is shared
+                    cids.append(cid)
                 return result
         else:
             LOGGER.debug(f'CAPTCHA: {captcha}')
             return None
 
+    def resolve_newrecaptcha_with_image_group_api(self, image_file,
+            banner_text, grid=None, timeout=None, same_client=True,
+            budget=None, cids=None):
+        """Resolve New Recaptcha from the image file using image group API.
+
+        The POST parameters are the same with the coordinates API except::
+
+            type=3: Type 3 specifies this is a New Recaptcha Image Group API
+            banner_text: the instruction, e.g. "select all pizza:"
+            grid: optional, e.g. "3x3" or "1x1", or detected automatically
+
+        The text of response is a json-like list of the indexes (from 1)
+        of the images to click, for example::
+
+            [1, 3]
+
+        :return: the list of indexes, or None
+        """
+        # the client is kept local, the calls may run in parallel threads
+        if same_client:
+            client = self.get_same_client(client_type=self.client_type)
+        else:
+            client = self.get_client(client_type=self.client_type)
+
+        if isinstance(image_file, Path) or isinstance(image_file, str):
+            captcha_file = get_absolute_path_str(image_file)
+        else:
+            captcha_file = image_file
+
+        if timeout is None:
+            timeout = self.timeout
+
+        kwargs = {'type': 3, 'banner_text': banner_text}
+        if grid:
+            kwargs['grid'] = grid
+        captcha, shared = self.decode(captcha_file, timeout, client,
+                **kwargs)
+        if budget and not shared:
+            budget.record_upload(solved=bool(captcha), cost=self.rate)
+        if captcha:
+            cid = captcha['captcha']
+            indexes = captcha['text']
+            LOGGER.debug(f"CAPTCHA {cid} solved: {indexes}")
+            if not indexes:
+                if not shared:
+                    self.report_failed_resolving(cid)
+                return None
+            if cids is not None and not shared:
+                cids.append(cid)
+            return json.loads(indexes)
+        else:
+            LOGGER.debug(f'CAPTCHA: {captcha}')
+            return None
+
     def resolve_newrecaptcha_ui_with_coordinates_api(self, image_file,
             reduce_factor=1, reduce_step=0.125, retry_times=2, timeout=None,
-            report_blank_list=False):
+            report_blank_list=False, budget=None, cids=None,
+            start_factor=None):
         """User interface for resolving New Recaptcha using coordinates API
 
+        If budget is given, stop retrying once it is exhausted, and cap the
+        timeout of every try to the time left.
+
+        The ID of the solved captcha is appended to cids if it is given.
+
+        :param start_factor: the reduce factor to start reducing the image
+            from, see restrict_image_size
         :return: (coordinates, reduce_factor) or False
         """
         # reduce image's size
         (image_file, last_reduce_factor) = restrict_image_size(image_file,
-                reduce_factor, reduce_step, self.image_restrict_size)
+                reduce_factor, reduce_step, self.image_restrict_size,
+                start_factor)
         #  if reduce_factor > 1:
         #      #  image_file = reduce_img_size(image_file, reduce_factor)
         #      image_file = resize_img(image_file, reduce_factor)
 
         times = 0
         while times <= retry_times:
+            try_timeout = timeout
+            if budget:
+                reason = budget.exhausted_reason()
+                if reason:
+                    LOGGER.info(f'Session budget is exhausted: {reason}')
+                    return False
+                try_timeout = budget.cap_timeout(
+                        self.timeout if timeout is None else timeout)
             try:
                 LOGGER.info('Resolve captcha with coordinates API')
                 coordinates = self.resolve_newrecaptcha_with_coordinates_api(
-                        image_file, timeout=timeout,
-                        report_blank_list=report_blank_list)
+                        image_file, timeout=try_timeout,
+                        report_blank_list=report_blank_list, budget=budget,
+                        cids=cids)
                 if coordinates:
                     return (coordinates, last_reduce_factor)
                 elif (not report_blank_list) and (coordinates == []):
@@ -350,6 +684,7 @@ class DeathByCaptchaUI:
                     if times <= retry_times:
                         LOGGER.warning('Failed to resolve captcha,'
                                 f' then retry: {times}')
+                        METRICS.incr('resolve_retries')
                     continue
             except deathbycaptcha.AccessDeniedException as e:
                 # Access to DBC API denied, check your credentials and/or balance
@@ -365,6 +700,7 @@ class DeathByCaptchaUI:
                 times += 1
                 if times <= retry_times:
                     LOGGER.debug(f'AccessDeniedException, then retry: {times}')
+                    METRICS.incr('resolve_retries')
 
                 #  LOGGER.debug("Now reduce image's size and then retry")
                 #  reduce_factor += reduce_step
@@ -373,6 +709,10 @@ class DeathByCaptchaUI:
                 #  return self.resolve_newrecaptcha_ui_with_coordinates_api(
                 #          image_file, reduce_factor, reduce_step, retry_times,
                 #          timeout)
+            except CircuitOpenError as e:
+                # the service is overloaded, don't burn the retries
+                LOGGER.warning(e)
+                return False
             except (OverflowError, RuntimeError) as e:
                 #  LOGGER.error(e)
                 raise e
@@ -382,6 +722,61 @@ class DeathByCaptchaUI:
                 times += 1
                 if times <= retry_times:
                     LOGGER.debug(f'Other exception, then retry: {times}')
+                    METRICS.incr('resolve_retries')
+
+        return False
+
+    def resolve_newrecaptcha_ui_with_image_group_api(self, image_file,
+            banner_text, grid=None, reduce_factor=1, reduce_step=0.125,
+            retry_times=2, timeout=None, budget=None, cids=None,
+            start_factor=None):
+        """User interface for resolving New Recaptcha using image group API
+
+        The image is reduced and the resolving is retried the same as
+        resolve_newrecaptcha_ui_with_coordinates_api.
+
+        :return: (indexes, reduce_factor) or False
+        """
+        (image_file, last_reduce_factor) = restrict_image_size(image_file,
+                reduce_factor, reduce_step, self.image_restrict_size,
+                start_factor)
+
+        times = 0
+        while times <= retry_times:
+            try_timeout = timeout
+            if budget:
+                reason = budget.exhausted_reason()
+                if reason:
+                    LOGGER.info(f'Session budget is exhausted: {reason}')
+                    return False
+                try_timeout = budget.cap_timeout(
+                        self.timeout if timeout is None else timeout)
+            try:
+                LOGGER.info('Resolve captcha with image group API')
+                indexes = self.resolve_newrecaptcha_with_image_group_api(
+                        image_file, banner_text, grid=grid,
+                        timeout=try_timeout, budget=budget, cids=cids)
+                if indexes is not None:
+                    return (indexes, last_reduce_factor)
+            except deathbycaptcha.AccessDeniedException as e:
+                LOGGER.error(e)
+                balance = self.get_balance()
+                if balance < 0:
+                    LOGGER.error(f'Balance is bellow zero, balance: {balance}')
+                    return False
+            except CircuitOpenError as e:
+                # the service is overloaded, don't burn the retries
+                LOGGER.warning(e)
+                return False
+            except (OverflowError, RuntimeError) as e:
+                raise e
+            except Exception as e:
+                LOGGER.error(e)
+
+            times += 1
+            if times <= retry_times:
+                LOGGER.warning(f'Failed to resolve captcha, then retry: {times}')
+                METRICS.incr('resolve_retries')
 
         return False
 
@@ -392,29 +787,266 @@ class CaptchaAndroidBaseUI:
     captcha_image_path = CAPTCHA_IMAGE_DIR
     captcha_image_file_name_suffix = '_captcha'
     captcha_image_file_extension = 'png'
+    # caps of the temporary captcha images, see image_store.ImageStore
+    captcha_image_max_bytes = 200 * 1024 * 1024
+    captcha_image_max_age = 3600
+    # ratio of the rounds whose images are kept for debugging, e.g. 0.01
+    captcha_image_keep_ratio = 0
+    captcha_image_keep_max_bytes = 50 * 1024 * 1024
+
+    # manifest.RunManifest to record every solving and round outcome
+    manifest = None
+    # resolution.ResolutionController to learn the capture scale and the
+    # start of reducing the images per device and captcha type
+    resolution_controller = None
 
     #  client_type = 'socket'
     client_type = 'http'
     client_timeout = 30
 
-    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout):
+    # capture the captcha images at a lower resolution, e.g. 0.5, instead of
+    # shrinking them in restrict_image_size. Only the MJPEG server of
+    # UiAutomator2 scales its frames on the device, so the scaled captures
+    # are cropped from its stream, and the screenshots are scaled on the
+    # host only without it. The scale is carried into last_reduce_factor.
+    capture_scale = 1
+    # quality of the captured images if the extension is "jpg"
+    capture_quality = 85
+    # capture the elements by screenshot commands ("screenshot"), or crop
+    # them from the MJPEG screenshot stream of UiAutomator2 ("mjpeg"), which
+    # is also used by the screenshot type when the captures are scaled
+    frame_source_type = 'screenshot'
+
+    # read the challenge image from the DOM of the WebView by JavaScript
+    # instead of capturing the native view, see webview. The CSS selector of
+    # the image, and the selectors of the nested iframes of it.
+    webview_capture = False
+    webview_img_selector = None
+    webview_frames = ()
+    # the native element of the image, whose rect maps the image to the
+    # screen, or the captured element if None
+    webview_img_native = None
+
+    # seconds between the polls of the alternative locators of an element
+    locator_poll_interval = 0.25
+    # open and log in the clients of the default resolver in background
+    client_warm_up = False
+
+    # speculative mode: after clicking the start button, poll for the captcha
+    # image quickly, and capture and upload it once it appears
+    speculative = False
+    speculative_poll_interval = 0.25
+
+    # don't upload the captcha image again until it is different from the
+    # last uploaded one, judged by the distance of their image hashes
+    detect_img_change = True
+    img_unchanged_distance = 8
+    img_change_wait_timeout = 5
+    img_change_poll_interval = 0.5
+
+    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout,
+            speculative=speculative, budget=None, frame_source=None):
+        """
+        :param resolver: the resolver, or a list of resolvers to choose
+            from by their accuracy at the start of every round
+        :param budget: SessionBudget of the session, which every stage
+            consults to abandon the session once it is exhausted
+        :param frame_source: source of the captured images, see frame_source,
+            created by frame_source_type if None
+        """
         self.driver = driver
         if not resolver:
             self.resolver = DeathByCaptchaUI(timeout=self.client_timeout,
-                    client_type=self.client_type)
+                    client_type=self.client_type, warm_up=self.client_warm_up)
             # If you want to use 2captcha, uncomment the following and comment the above line
             #  self.resolver = TwoCaptchaAPI()
+        elif isinstance(resolver, (list, tuple)):
+            self.resolver = resolver[0]
         else:
             self.resolver = resolver
+        self.resolvers = (list(resolver) if isinstance(resolver, (list, tuple))
+                else [self.resolver])
+
+        # IDs of the captchas whose results are tapped in the current round,
+        # which are reported if the outcome page shows the round is wrong
+        self.round_cids = []
+        # images saved with new names, released after the round
+        self.captured_img_files = []
+
+        self.round_id = 0
+        # fields of the solving to record into the manifest
+        self.solve_record = {}
+        self.last_taps = []
+
+        self.wait_timeout = wait_timeout
+        self.device_key = get_device_key(driver)
+        # handles of the stable containers, invalidated after navigation
+        self.element_cache = ElementCache()
+        self.wait_obj = support_ui.WebDriverWait(self.driver, wait_timeout)
+
+        self.speculative = speculative
+        self.last_captcha_img_hash = None
+        self.budget = budget
+        self.webview_image = None
+        self.resolution_key = None
+        self.screen_size = None
+        self.frame_source = frame_source or self.create_frame_source()
+        # the MJPEG server scales its frames by 50% by default
+        if isinstance(self.frame_source, MjpegFrameSource):
+            self.apply_capture_settings()
+
+    def create_frame_source(self):
+        scaled = self.capture_scale != 1 or self.resolution_controller
+        if self.frame_source_type == 'mjpeg' or (
+                scaled and has_mjpeg_server(self.driver)):
+            return MjpegFrameSource.from_driver(self.driver, self.capture_scale,
+                    self.capture_quality).start()
+        return ScreenshotFrameSource(self.capture_scale, self.capture_quality)
+
+    def apply_capture_settings(self):
+        """Let the MJPEG server of the driver scale and compress its frames"""
+        settings = {'mjpegScalingFactor': max(1, round(self.capture_scale * 100)),
+                'mjpegServerScreenshotQuality': self.capture_quality}
+        try:
+            self.driver.update_settings(settings)
+            LOGGER.debug(f'Update the capture settings: {settings}')
+        except Exception as e:
+            LOGGER.warning(f'Cannot update the capture settings: {e}')
 
-        self.wait_obj = WebDriverWait(self.driver, wait_timeout)
+    def scale_box(self, box):
+        """Scale the box on the screen to the box in the captured image"""
+        if self.capture_scale == 1:
+            return box
+        return tuple(int(value * self.capture_scale) for value in box)
+
+    def unscale_results(self, results, scale=None):
+        """Map the reduce factor of the results back to the screen
+
+        :param scale: scale of the uploaded image to the screen,
+            capture_scale if None
+        """
+        if scale is None:
+            scale = self.capture_scale
+        if scale == 1 or not isinstance(results, tuple):
+            return results
+        coordinates, last_reduce_factor = results
+        return (coordinates, last_reduce_factor / scale)
+
+    def start_round(self):
+        """Start a new round, choosing the resolver by accuracy"""
+        self.round_id += 1
+        self.round_cids = []
+        self.element_cache.forget_rects()
+        if len(self.resolvers) > 1:
+            self.resolver = ACCURACY.choose(self.resolvers)
+            LOGGER.debug(f'Choose the resolver: {get_provider_name(self.resolver)}')
+        if self.resolution_controller:
+            self.resolution_key = self.get_resolution_key()
+            self.set_capture_scale(
+                    self.resolution_controller.choose_scale(self.resolution_key))
+
+    def get_resolution_key(self):
+        """Get the key of the device, screen, captcha type and provider"""
+        capabilities = getattr(self.driver, 'capabilities', None) or {}
+        if not self.screen_size:
+            self.screen_size = capabilities.get('deviceScreenSize')
+        if not self.screen_size:
+            size = self.driver.get_window_size()
+            self.screen_size = f"{size['width']}x{size['height']}"
+        return get_resolution_key(
+                capabilities.get('deviceModel') or self.device_key,
+                self.screen_size, type(self).__name__,
+                get_provider_name(self.resolver))
+
+    def set_capture_scale(self, scale):
+        if scale != self.capture_scale:
+            LOGGER.debug(f'Capture at the scale: {scale}')
+            self.capture_scale = scale
+            self.frame_source.scale = scale
+            if isinstance(self.frame_source, MjpegFrameSource):
+                self.frame_source.fallback.scale = scale
+                self.apply_capture_settings()
+
+    def finish_round(self, correct, reason=''):
+        """Record the outcome of the round judged by the outcome page
+
+        If the round is wrong, report all captchas of it. If correct is None,
+        the outcome is unknown, and the round is just forgotten.
+        """
+        cids, self.round_cids = self.round_cids, []
+        if correct is None:
+            return
+
+        if self.manifest:
+            self.manifest.record('outcome', round=self.round_id,
+                    correct=correct, reason=reason)
+        if not cids:
+            return
+
+        ACCURACY.record(get_provider_name(self.resolver), correct)
+        if self.resolution_controller and self.resolution_key:
+            self.resolution_controller.record_outcome(self.resolution_key,
+                    self.capture_scale, correct)
+            self.resolution_controller.save()
+        if not correct:
+            LOGGER.info(f'Wrong round ({reason}), report captchas: {cids}')
+            for cid in cids:
+                self.resolver.report_failed_resolving(cid, reason=reason)
+
+    def record_stage(self, **fields):
+        """Add the fields of a stage to the record of this solving"""
+        if self.manifest:
+            self.solve_record.update(fields)
+
+    def record_solve(self, result):
+        """Record this solving into the manifest"""
+        record, self.solve_record = self.solve_record, {}
+        taps, self.last_taps = self.last_taps, []
+        if self.manifest:
+            self.manifest.record_solve(ui=type(self).__name__,
+                    provider=get_provider_name(self.resolver),
+                    round=self.round_id, result=result,
+                    cids=list(self.round_cids), taps=taps, **record)
+
+    def is_budget_exhausted(self):
+        """Check if the session cannot go on within its budget"""
+        if not self.budget:
+            return False
+        reason = self.budget.exhausted_reason()
+        if reason:
+            LOGGER.info(f'Session budget is exhausted, abandon it: {reason}')
+            METRICS.incr('budget_exhausted')
+            return True
+        return False
+
+    def get_image_store(self):
+        return get_image_store(self.captcha_image_path,
+                max_bytes=self.captcha_image_max_bytes,
+                max_age=self.captcha_image_max_age,
+                keep_ratio=self.captcha_image_keep_ratio,
+                keep_max_bytes=self.captcha_image_keep_max_bytes)
+
+    def release_captured_imgs(self):
+        """Delete the captured images and their derivatives in background"""
+        img_files, self.captured_img_files = self.captured_img_files, []
+        if img_files:
+            store = self.get_image_store()
+            for img_file in img_files:
+                store.release(img_file)
 
     def find_element(self, element, locator, locator_type=By.XPATH, page=None):
-        """Waint for an element, then return it or None"""
+        """Waint for an element, then return it or None
+
+        The locator can be a Target or LocatorSet, which is looked up by its
+        compiled locators.
+        """
+        if isinstance(locator, (Target, LocatorSet)):
+            return self.find_any(element, locator, page)
         try:
-            ele = self.wait_obj.until(
-                    EC.presence_of_element_located(
-                        (locator_type, locator)))
+            with METRICS.span('find_element'):
+                ele = self.wait_obj.until(
+                        EC.presence_of_element_located(
+                            (locator_type, locator)))
             if page:
                 LOGGER.debug(f'Find the element "{element}" in the page "{page}"')
             else:
@@ -426,14 +1058,57 @@ class CaptchaAndroidBaseUI:
             else:
                 LOGGER.warning(f'Cannot find the element: {element}')
 
+    def find_any(self, element, locator_set, page=None, timeout=None):
+        """Wait for any of the alternative locators, then return the element
+
+        All alternatives are polled in one loop, so the last one doesn't
+        wait for the timeouts of the others.
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        with METRICS.span('find_element'):
+            ele, index = locator_set.find(self.driver, timeout,
+                    self.locator_poll_interval, self.device_key)
+        where = f' in the page "{page}"' if page else ''
+        if ele is not None:
+            LOGGER.debug(f'Find the element "{element}"{where} by locator {index}')
+            return ele
+        LOGGER.warning(f'Cannot find the element "{element}"{where}')
+
+    def is_present(self, locator_set):
+        """Check at once if the element of the Target or LocatorSet exists"""
+        return locator_set.find(self.driver, 0, device=self.device_key)[0] is not None
+
+    def find_present(self, element, locator_set):
+        """Find the element at once, or raise NoSuchElementException"""
+        ele, index = locator_set.find(self.driver, 0, device=self.device_key)
+        if ele is None:
+            raise NoSuchElementException(f'Cannot find the element: {element}')
+        return ele
+
+    def click_any(self, element, locator_set):
+        """Find an element by any of the locators, then click and return it"""
+        ele = self.find_any(element, locator_set)
+        if ele:
+            ele.click()
+            self.element_cache.invalidate()
+            LOGGER.debug(f'Click the element: {element}')
+            return ele
+
     def click_element(self, element, locator, locator_type=By.XPATH):
         """Find an element, then click and return it, or return None"""
         ele = self.find_element(element, locator, locator_type)
         if ele:
             ele.click()
+            self.element_cache.invalidate()   # the page may change
             LOGGER.debug(f'Click the element: {element}')
             return ele
 
+    def find_cached(self, locator, locator_type=By.XPATH):
+        """Find the element, or get it from the element cache"""
+        return self.element_cache.get((locator_type, locator),
+                lambda: self.driver.find_element(by=locator_type, value=locator))
+
     def find_page(self, page, element, locator, locator_type=By.XPATH):
         """Find en element of a page, then return it or return None"""
         return self.find_element(element, locator, locator_type, page)
@@ -453,34 +1128,42 @@ class CaptchaAndroidBaseUI:
             img_file=None):
         """Save the captcha image into a file.
 
-        If no file, then create the random file.
+        If no file, then create a new one in the image store.
         """
         if not img_file:
-            LOGGER.debug('Get random image file name, and save captcha image to the file')
-            img_file_name = get_random_file_name(suffix=self.captcha_image_file_name_suffix)
-            img_file = self.captcha_image_path / (
-                    f'{img_file_name}.{self.captcha_image_file_extension}')
+            LOGGER.debug('Get new image file name, and save captcha image to the file')
+            img_file = self.get_image_store().new_path(
+                    self.captcha_image_file_name_suffix,
+                    self.captcha_image_file_extension)
+            self.captured_img_files.append(img_file)
         img_file_path = get_absolute_path_str(img_file)
         #  LOGGER.debug(f'CAPTCHA image file: {img_file_path}')
 
         LOGGER.debug(f'captcha image locator: {captcha_img_locator}')
         LOGGER.debug(f'captcha image locator type: {captcha_img_locator_type}')
-        captcha_img = self.driver.find_element(by=captcha_img_locator_type,
-                value=captcha_img_locator)
-
-        if captcha_img.screenshot(img_file_path):
+        def capture(captcha_img):
+            return self.frame_source.save_element(captcha_img, img_file_path)
+
+        key = (captcha_img_locator_type, captcha_img_locator)
+        saved = self.element_cache.call(key, lambda: self.driver.find_element(
+            by=captcha_img_locator_type, value=captcha_img_locator), capture)
+        if self.manifest:
+            self.record_stage(bounds=self.find_cached(captcha_img_locator,
+                captcha_img_locator_type).rect)
+        if saved:
             LOGGER.debug(f'Saved CAPTCHA image to file: {img_file_path}')
             return img_file_path
         else:
             LOGGER.info(f'Cannot save the captcha image to the file: {img_file_path}')
 
     def crop_img(self, src_img_file, dest_img_file, box_size):
+        """Crop the box on the screen, relative to the captured element"""
         #  LOGGER.debug(
         #          f'Crop the image "{src_img_file}" to "{dest_img_file}"')
         LOGGER.debug(f'Crop box size: {box_size}')
 
-        with Image.open(src_img_file) as im:
-            im_crop = im.crop(box_size)
+        with METRICS.span('crop'), Image.open(src_img_file) as im:
+            im_crop = im.crop(self.scale_box(box_size))
             im_crop.save(dest_img_file)
 
         return True
@@ -527,12 +1210,260 @@ class CaptchaAndroidBaseUI:
         if self.crop_img(src_img_file, dest_img_file, (left, upper, right, lower)):
             return dest_img_file
 
+    def is_img_hash_changed(self, img_hash, last_img_hash):
+        """Check if the image hash is different from the last one"""
+        return (last_img_hash is None or get_hash_distance(img_hash,
+            last_img_hash) > self.img_unchanged_distance)
+
+    def reset_img_change(self):
+        """Forget the last captcha image, e.g. for a new challenge"""
+        self.last_captcha_img_hash = None
+
+    def save_changed_captcha_img(self, captcha_img_locator,
+            captcha_img_locator_type=By.XPATH, img_file=None, save=None):
+        """Save the effective captcha image once it differs from the last one
+
+        :param save: function to save the image and return the file, which
+            is save_captcha_effect_img if None
+        :return: the image file, or None if the captcha image is still the
+            same as the last one after img_change_wait_timeout
+        """
+        if save is None:
+            save = lambda: self.save_captcha_effect_img(captcha_img_locator,
+                    captcha_img_locator_type=captcha_img_locator_type,
+                    img_file=img_file)
+        deadline = time.time() + self.img_change_wait_timeout
+        while True:
+            captcha_img_file = save()
+            if not self.detect_img_change or not captcha_img_file:
+                return captcha_img_file
+
+            img_hash = get_img_hash(captcha_img_file)
+            if self.is_img_hash_changed(img_hash, self.last_captcha_img_hash):
+                self.last_captcha_img_hash = img_hash
+                return captcha_img_file
+
+            if time.time() >= deadline:
+                LOGGER.info('Captcha image is unchanged, skip uploading it')
+                return None
+            LOGGER.debug('Captcha image is unchanged, then wait for it')
+            time.sleep(self.img_change_poll_interval)
+
+    def capture_and_resolve(self, captcha_img_locator,
+            captcha_img_locator_type=By.XPATH, img_file=None, reduce_factor=1,
+            reduce_step=0.125, retry_times=3, timeout=30,
+            report_blank_list=True):
+        """Save the captcha image, then get resolving results of it
+
+        :return: (coordinates, reduce_factor), False, or CAPTCHA_IMG_UNCHANGED
+            if the captcha image is the same as the last one
+        """
+        if self.is_budget_exhausted():
+            return False
+
+        if self.can_capture_from_webview():
+            results = self.capture_and_resolve_webview(captcha_img_locator,
+                    captcha_img_locator_type, img_file,
+                    reduce_factor=reduce_factor,
+                    reduce_step=reduce_step,
+                    retry_times=retry_times,
+                    timeout=timeout,
+                    report_blank_list=report_blank_list)
+            if results is not None:
+                return results
+            LOGGER.debug('Cannot read the image from the WebView, capture it')
+
+        # save captcha image
+        captcha_img_file = self.save_changed_captcha_img(captcha_img_locator,
+                captcha_img_locator_type=captcha_img_locator_type,
+                img_file=img_file)
+        if not captcha_img_file:
+            return CAPTCHA_IMG_UNCHANGED
+        self.record_stage(image=captcha_img_file)
+
+        # get resolving results from the saved captcha image
+        LOGGER.debug('Get resolving results from the saved captcha image')
+        return self.resolve_captcha_img(captcha_img_file,
+                reduce_factor=reduce_factor,
+                reduce_step=reduce_step,
+                retry_times=retry_times,
+                timeout=timeout,
+                report_blank_list=report_blank_list)
+
+    def resolve_captcha_img(self, captcha_img_file, **kwargs):
+        """Get resolving results of the saved effective captcha image
+
+        :return: (coordinates, reduce_factor) or False
+        """
+        start_factor = self.get_start_factor()
+        if start_factor:
+            kwargs['start_factor'] = start_factor
+        results = self.resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                captcha_img_file, budget=self.budget, cids=self.round_cids,
+                **kwargs)
+        if results:
+            self.record_reduce_factor(results[1])
+        return self.unscale_results(results)
+
+    def get_start_factor(self, scale=None):
+        """Get the learned reduce factor to start reducing from, or None
+
+        :param scale: the scale of the captured image, capture_scale if None
+        """
+        if self.resolution_controller and self.resolution_key:
+            return self.resolution_controller.get_start_factor(
+                    self.resolution_key,
+                    self.capture_scale if scale is None else scale)
+
+    def record_reduce_factor(self, reduce_factor, scale=None):
+        if self.resolution_controller and self.resolution_key:
+            self.resolution_controller.record_reduce_factor(
+                    self.resolution_key,
+                    self.capture_scale if scale is None else scale,
+                    reduce_factor)
+
+    def can_capture_from_webview(self):
+        return bool(self.webview_capture and self.webview_img_selector)
+
+    def save_webview_img(self, img_file=None):
+        """Save the image read from the WebView DOM into a file
+
+        :return: the image file, or None
+        """
+        with METRICS.span('webview_capture'):
+            self.webview_image = read_webview_image(self.driver,
+                    self.webview_img_selector, self.webview_frames)
+        if not self.webview_image:
+            METRICS.incr('webview_capture_failures')
+            return None
+        if not img_file:
+            img_file = self.get_image_store().new_path(
+                    self.captcha_image_file_name_suffix,
+                    self.webview_image.extension)
+            self.captured_img_files.append(img_file)
+        img_file_path = get_absolute_path_str(img_file)
+        Path(img_file_path).write_bytes(self.webview_image.data)
+        LOGGER.debug(f'Saved the image from the WebView: {img_file_path}')
+        return img_file_path
+
+    def capture_and_resolve_webview(self, captcha_img_locator,
+            captcha_img_locator_type=By.XPATH, img_file=None, **kwargs):
+        """Read the image from the WebView, then get resolving results of it
+
+        :return: the same as capture_and_resolve, or None if the image
+            cannot be read
+        """
+        self.webview_image = None
+        captcha_img_file = self.save_changed_captcha_img(captcha_img_locator,
+                captcha_img_locator_type, save=lambda: self.save_webview_img(
+                    img_file))
+        if self.webview_image is None:
+            return None
+        if not captcha_img_file:
+            return CAPTCHA_IMG_UNCHANGED
+        self.record_stage(image=captcha_img_file, source='webview')
+        return self.resolve_webview_img(captcha_img_locator,
+                captcha_img_locator_type, captcha_img_file, self.webview_image,
+                **kwargs)
+
+    def get_webview_img_rect(self):
+        """Get the rect of the native element of the WebView image, or None"""
+        if not self.webview_img_native:
+            return None
+        try:
+            return self.element_cache.get(self.webview_img_native,
+                    lambda: self.find_present('WebView image',
+                        self.webview_img_native)).rect
+        except NoSuchElementException as e:
+            LOGGER.debug(e)
+
+    def resolve_webview_img(self, captcha_img_locator, captcha_img_locator_type,
+            img_file, image, **kwargs):
+        """Resolve the image read from the WebView
+
+        The image is at its natural resolution, so the coordinates are mapped
+        back to the screen by the rect of the native element of it, and are
+        relative to the captured element.
+        """
+        origin = self.find_cached(captcha_img_locator,
+                captcha_img_locator_type).rect
+        rect = self.get_webview_img_rect() or origin
+        results = self.resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                img_file, budget=self.budget, cids=self.round_cids, **kwargs)
+        if not results:
+            return results
+
+        coordinates, last_reduce_factor = results
+        factor = last_reduce_factor * rect['width'] / image.width
+        left = rect['x'] - origin['x']
+        upper = rect['y'] - origin['y']
+        return ([(x * factor + left, y * factor + upper)
+            for x, y in coordinates], 1)
+
+    def wait_and_resolve(self, captcha_img_locator,
+            captcha_img_locator_type=By.XPATH, **kwargs):
+        """Poll for the captcha image, then capture and resolve it at once
+
+        :return: results of capture_and_resolve, or None if the captcha image
+            doesn't appear in wait_timeout
+        """
+        deadline = time.time() + self.wait_timeout
+        while True:
+            if self.driver.find_elements(by=captcha_img_locator_type,
+                    value=captcha_img_locator):
+                LOGGER.debug('Captcha image appears, then capture and resolve it')
+                return self.capture_and_resolve(captcha_img_locator,
+                        captcha_img_locator_type, **kwargs)
+            if time.time() >= deadline:
+                LOGGER.debug('Captcha image does not appear in speculative mode')
+                return None
+            time.sleep(self.speculative_poll_interval)
+
+    def tap_coordinates(self, coordinates, form_x, form_y,
+            last_reduce_factor=1, tap_interval=2, need_press=False):
+        """Tap the coordinates relative to the point (form_x, form_y)
+
+        The coordinates can be an iterator, then tap every one of them as soon
+        as it is got.
+
+        :return: the number of the tapped coordinates
+        """
+        LOGGER.debug(f'last_reduce_factor: {last_reduce_factor}')
+        self.last_taps = []
+        tapped = 0
+        for x, y in coordinates:
+            real_x = int(x * last_reduce_factor) + form_x
+            real_y = int(y * last_reduce_factor) + form_y
+            LOGGER.debug(f'Image coordinates: ({real_x}, {real_y})')
+            self.last_taps.append((real_x, real_y))
+
+            with METRICS.span('tap'):
+                action = touch_action.TouchAction(self.driver)
+                if need_press:
+                    LOGGER.debug('Press the image')
+                    #  action.long_press(x=real_x, y=real_y).release().perform()
+                    action.press(x=real_x, y=real_y).release().perform()
+                LOGGER.debug('Tap the image')
+                action.tap(x=real_x, y=real_y).perform()
+            tapped += 1
+
+            if tap_interval > 0:
+                LOGGER.debug(f'Tap interval: {tap_interval}')
+                with METRICS.span('tap_interval'):
+                    time.sleep(tap_interval)
+
+        if tapped:
+            # the taps may scroll the page or replace the tiles
+            self.element_cache.forget_rects()
+        return tapped
+
+    @METRICS.timed('resolve_one')
     def resolve_one_with_coordinates_api(self, captcha_img_locator,
             captcha_img_crop_start_locator, reduce_factor=1,
             reduce_step=0.125, retry_times=3, timeout=30,
             report_blank_list=True, captcha_img_locator_type=By.XPATH,
             captcha_img_crop_start_locator_type=By.XPATH,
-            img_file=None, tap_interval=2, need_press=False):
+            img_file=None, tap_interval=2, need_press=False, presolved=None):
         """Resolve one time for one Captcha image
 
         report_blank_list = True    # FunCaptcha has no skip operation
@@ -540,25 +1471,33 @@ class CaptchaAndroidBaseUI:
         If the captcha image is not cropped, then captcha_img_locator is
         the same with captcha_img_crop_start_locator.
 
+        If presolved is not None, it is the results which have been got by
+        resolving speculatively, then don't capture and upload again.
+
         Resolve successfully, return True;
         Resolve unsuccessfully, return False;
         Resolve successfully and no image to click, return None;
+        Captcha image is unchanged and not uploaded, return CAPTCHA_IMG_UNCHANGED;
         """
         LOGGER.info('Resolve one time for one captcha image')
-        # save captcha image
-        captcha_img_file = self.save_captcha_effect_img(captcha_img_locator,
-                captcha_img_locator_type=captcha_img_locator_type,
-                img_file=img_file)
+        self.record_stage(reduce_factor=reduce_factor, reduce_step=reduce_step,
+                capture_scale=self.capture_scale)
+        if presolved is None:
+            results = self.capture_and_resolve(captcha_img_locator,
+                    captcha_img_locator_type=captcha_img_locator_type,
+                    img_file=img_file,
+                    reduce_factor=reduce_factor,
+                    reduce_step=reduce_step,
+                    retry_times=retry_times,
+                    timeout=timeout,
+                    report_blank_list=report_blank_list)
+        else:
+            LOGGER.debug('Use the results of speculative resolving')
+            results = presolved
 
-        # get resolving results from the saved captcha image
-        LOGGER.debug('Get resolving results from the saved captcha image')
-        results = self.resolver.resolve_newrecaptcha_ui_with_coordinates_api(
-                captcha_img_file,
-                reduce_factor=reduce_factor,
-                reduce_step=reduce_step,
-                retry_times=retry_times,
-                timeout=timeout,
-                report_blank_list=report_blank_list)
+        if results is CAPTCHA_IMG_UNCHANGED:
+            LOGGER.debug('Captcha image is unchanged, no need to resolve it')
+            return CAPTCHA_IMG_UNCHANGED
 
         if not results:
             LOGGER.debug('Cannot resolve it')
@@ -566,6 +1505,8 @@ class CaptchaAndroidBaseUI:
 
         coordinates = results[0]
         last_reduce_factor = results[1]
+        self.record_stage(response=coordinates if isinstance(coordinates, list)
+                else None, last_reduce_factor=last_reduce_factor)
 
         # No other images to click, just click skip button
         if (coordinates == []) and (not report_blank_list):
@@ -578,31 +1519,20 @@ class CaptchaAndroidBaseUI:
                 f'{captcha_img_crop_start_locator} '
                 f'captcha_img_crop_start_locator_type: '
                 f'{captcha_img_crop_start_locator_type}')
-        captcha_img = self.driver.find_element(
-                by=captcha_img_crop_start_locator_type,
-                value=captcha_img_crop_start_locator)
+        captcha_img = self.find_cached(captcha_img_crop_start_locator,
+                captcha_img_crop_start_locator_type)
         form_x = captcha_img.location['x']
         form_y = captcha_img.location['y']
         LOGGER.debug(f'form_x: {form_x}, form_y: {form_y}')
 
         LOGGER.info('Click the image with the resolving coordinates')
-        LOGGER.debug(f'last_reduce_factor: {last_reduce_factor}')
-        for x, y in coordinates:
-            real_x = int(x * last_reduce_factor) + form_x
-            real_y = int(y * last_reduce_factor) + form_y
-            LOGGER.debug(f'Image coordinates: ({real_x}, {real_y})')
-
-            action = TouchAction(self.driver)
-            if need_press:
-                LOGGER.debug('Press the image')
-                #  action.long_press(x=real_x, y=real_y).release().perform()
-                action.press(x=real_x, y=real_y).release().perform()
-            LOGGER.debug('Tap the image')
-            action.tap(x=real_x, y=real_y).perform()
+        tapped = self.tap_coordinates(coordinates, form_x, form_y,
+                last_reduce_factor, tap_interval, need_press)
 
-            if tap_interval > 0:
-                LOGGER.debug(f'Tap interval: {tap_interval}')
-                time.sleep(tap_interval)
+        # the coordinates which are got one by one are all blank
+        if (not tapped) and (not report_blank_list):
+            LOGGER.debug('No images to click')
+            return None
 
         return True
 
@@ -611,9 +1541,14 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
     # step1
     verify_first_page_frame_xpath = (
             '//android.view.View[@resource-id="FunCaptcha"]')
+    verify_first_page_frame = Target('FunCaptcha frame', resource_id='FunCaptcha',
+            class_name='android.view.View', xpath=verify_first_page_frame_xpath)
 
     verify_heading_xpath = (
             '//android.view.View[@resource-id="home_children_heading"]')
+    verify_heading = Target('verify heading',
+            resource_id='home_children_heading',
+            class_name='android.view.View', xpath=verify_heading_xpath)
     verify_body_xpath = (
             '//android.view.View[@resource-id="home_children_body"]')
 
@@ -624,6 +1559,13 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
     verify_button_xpath2 = (
             '//android.widget.Button[@resource-id="verifyButton"]')
     verify_button_id = 'home_children_button'
+    verify_button_locators = LocatorSet('verify button',
+            Target('verify button', resource_id='home_children_button',
+                class_name='android.view.View', xpath=verify_button_xpath),
+            Target('verify button1', resource_id='home_children_button',
+                class_name='android.widget.Button', xpath=verify_button_xpath1),
+            Target('verify button2', resource_id='verifyButton',
+                class_name='android.widget.Button', xpath=verify_button_xpath2))
 
     # step2
     #  captcha_form_xpath = (
@@ -639,6 +1581,13 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
             'android.view.View/android.view.View/android.view.View/'
             'android.view.View/android.view.View[2]/android.view.View/'
             'android.view.View[1]/android.widget.Button')
+    reload_button_locators = LocatorSet('reload button',
+            Target('reload button', class_name='android.widget.Button',
+                index=0, parent=Target('iframe wrap',
+                    resource_id='fc-iframe-wrap',
+                    class_name='android.view.View'),
+                xpath=reload_button_xpath),
+            reload_button_xpath1)
 
     captcha_img_form_xpath = (
             '//android.view.View[@resource-id="game_children_wrapper"]')
@@ -646,69 +1595,82 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
             '//android.view.View[@resource-id="game-header"]')
     captcha_img_group_xapth = (
             '//android.view.View[@resource-id="game_children_wrapper"]')
+    captcha_img_page_locators = LocatorSet('captcha image form',
+            Target('captcha image form', resource_id='game_children_wrapper',
+                class_name='android.view.View', xpath=captcha_img_form_xpath),
+            Target('image form header', resource_id='game-header',
+                class_name='android.view.View',
+                xpath=captcha_img_form_game_header_xpath))
 
     try_again_button_xpath = (
             '//android.view.View[@resource-id="wrong_children_button"]')
+    try_again_button = Target('try again button',
+            resource_id='wrong_children_button',
+            class_name='android.view.View', xpath=try_again_button_xpath)
 
     # step2, except: Working, please wait
     check_loading_xpath = (
             '//android.widget.Image[@resource-id="checking_children_loadingImg"]')
+    check_loading = Target('loading image',
+            resource_id='checking_children_loadingImg',
+            class_name='android.widget.Image', xpath=check_loading_xpath)
 
     wait_timeout = 5
 
+    # the game image in the frames of the enforcement and the game
+    webview_img_selector = '#game_challengeItem_image, #game_children_challenge img'
+    webview_frames = ('#fc-iframe-wrap', '#CaptchaFrameId')
+    # the image is below the header in the wrapper
+    webview_img_native_xpath = (
+            '//android.widget.Image[@resource-id="game_challengeItem_image"]')
+    webview_img_native = Target('challenge image',
+            resource_id='game_challengeItem_image',
+            class_name='android.widget.Image', xpath=webview_img_native_xpath)
+
     #  captcha_image_path = PRJ_PATH / 'temp'
     captcha_image_file_name_suffix = '_funcaptcha'
     captcha_image_file_extension = 'png'
 
-    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout):
-        super().__init__(driver, resolver, wait_timeout)
+    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout,
+            speculative=CaptchaAndroidBaseUI.speculative, budget=None,
+            frame_source=None):
+        super().__init__(driver, resolver, wait_timeout, speculative, budget,
+                frame_source)
 
     def click_verify_button(self):
-        ele = self.click_element('verify button by xpath', self.verify_button_xpath)
-        if ele:
-            return ele
-
-        ele = self.click_element('verify button by xpath1', self.verify_button_xpath1)
-        if ele:
-            return ele
-
-        ele = self.click_element('verify button by xpath2', self.verify_button_xpath2)
-        if ele:
-            return ele
+        return self.click_any('verify button', self.verify_button_locators)
 
     def click_reload_button(self):
-        self.click_element('reload button', self.reload_button_xpath)
+        self.click_any('reload button', self.reload_button_locators)
 
     def click_tryagain_button(self):
-        self.click_element('try again button', self.try_again_button_xpath)
+        self.click_element('try again button', self.try_again_button)
 
     # check if this is the FunCaptcha regardless of which captcha page
     def is_captcha_page(self):
         return self.find_page('FunCaptcha page', 'FunCaptcha frame',
-                self.verify_first_page_frame_xpath)
+                self.verify_first_page_frame)
 
     # check if this is the FunCaptcha from outside
     def is_captcha_first_page(self):
-        if self.driver.find_elements_by_xpath(self.verify_heading_xpath):
+        if self.is_present(self.verify_heading):
             if self.is_captcha_page():
                 return True
         return False
 
     def is_in_captcha_img_page(self):
-        return self.find_page('captcha image page by form xpath', 'captcha image form',
-                self.captcha_img_form_xpath) or self.find_page(
-                        'captcha image page by header xpath',
-                        'image form header',
-                        self.captcha_img_form_game_header_xpath)
+        return self.find_any('captcha image form or header',
+                self.captcha_img_page_locators, page='captcha image page')
 
     def is_in_wrong_result_page(self):
-        return self.find_page('wrong result page', 'try again button', self.try_again_button_xpath)
+        return self.find_page('wrong result page', 'try again button', self.try_again_button)
 
     def is_in_verify_button_page(self):
-        return self.find_page('start verify page', 'verify button', self.verify_button_xpath)
+        return self.find_page('start verify page', 'verify button',
+                self.verify_button_locators)
 
     def is_in_check_loading_page(self):
-        return self.find_page('Check loading page', 'loading image', self.check_loading_xpath)
+        return self.find_page('Check loading page', 'loading image', self.check_loading)
 
     def resolve_all_with_coordinates_api(self, click_start=True,
             reduce_factor=1, reduce_step=0.125, retry_times=3, timeout=20,
@@ -716,13 +1678,38 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
             need_press=False, all_resolve_retry_times=15):
         """Resolve all FunCaptcha images in one step"""
         LOGGER.debug(f'All retry times of resolving: {all_resolve_retry_times}')
+        if self.is_budget_exhausted():
+            return False
+
+        presolved = None
+        speculated = False
         if click_start:
             LOGGER.info('Resolve all FunCaptcha images in one step')
+            self.start_round()
             self.click_verify_button()
+            self.reset_img_change()
+
+            if self.speculative:
+                # if it fails, capture and resolve it as usual
+                try:
+                    presolved = self.wait_and_resolve(
+                            self.captcha_img_group_xapth, By.XPATH,
+                            img_file=img_file,
+                            reduce_factor=reduce_factor,
+                            reduce_step=reduce_step,
+                            retry_times=retry_times,
+                            timeout=timeout,
+                            report_blank_list=report_blank_list)
+                    speculated = True
+                except Exception as e:
+                    LOGGER.error(f'Failed to resolve speculatively: {e}')
+                    self.release_captured_imgs()
+                    self.reset_img_change()
 
         img_page_flag = False
         # check if it is in the page of captcha image
-        if self.is_in_captcha_img_page():
+        if presolved is not None or (
+                not speculated and self.is_in_captcha_img_page()):
             img_page_flag = True
             try:
                 result = self.resolve_one_with_coordinates_api(
@@ -737,8 +1724,10 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
                     captcha_img_crop_start_locator_type=By.XPATH,
                     img_file=img_file,
                     tap_interval=tap_interval,
-                    need_press=need_press
+                    need_press=need_press,
+                    presolved=presolved
                 )
+                self.record_solve(result)
 
                 all_resolve_retry_times -= 1
                 if all_resolve_retry_times <= 0:
@@ -748,11 +1737,14 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
             except Exception as e:
                 LOGGER.error(e)
                 return False
+            finally:
+                self.release_captured_imgs()
 
         if img_page_flag and result is False:
             LOGGER.info('Cannot resolve it, then click reload button,'
                     ' and play the game again')
             self.click_reload_button()  # change captcha image
+            self.reset_img_change()
             return self.resolve_all_with_coordinates_api(click_start=False,
                     all_resolve_retry_times=all_resolve_retry_times)
 
@@ -774,6 +1766,7 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
         if self.is_in_wrong_result_page():
             LOGGER.debug('Wrong resolving, then click try again button,'
                     ' and play the game again')
+            self.finish_round(False, reason='wrong result page')
             self.click_tryagain_button()
             return self.resolve_all_with_coordinates_api(click_start=True,
                     all_resolve_retry_times=all_resolve_retry_times)
@@ -790,6 +1783,7 @@ class FuncaptchaAndroidUI(CaptchaAndroidBaseUI):
             return self.resolve_all_with_coordinates_api(click_start=True,
                     all_resolve_retry_times=all_resolve_retry_times)
 
+        self.finish_round(True)
         return True
 
 class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
@@ -797,6 +1791,9 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
     # step1
     verify_first_page_frame_xpath = (
             '//android.view.View[@resource-id="recaptcha_element"]')
+    verify_first_page_frame = Target('reCAPTCHA frame',
+            resource_id='recaptcha_element', class_name='android.view.View',
+            xpath=verify_first_page_frame_xpath)
 
     verify_heading_xpath = (
             '//android.view.View[@resource-id="home_children_heading"]')
@@ -807,6 +1804,9 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
     #          '//android.view.View[@resource-id="home_children_button"]')
     not_robot_checkbox_xpath = (
             '//android.widget.CheckBox[@resource-id="recaptcha-anchor"]')
+    not_robot_checkbox = Target('not robot checkbox',
+            resource_id='recaptcha-anchor', class_name='android.widget.CheckBox',
+            xpath=not_robot_checkbox_xpath)
 
     # step1, except: Cannot contact reCAPTCHA
     not_contact_title_xpath = (
@@ -826,6 +1826,8 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
     #          '//android.view.View[@resource-id="CaptchaFrame"]')
     captcha_form_xpath = (
             '//android.view.View[@resource-id="rc-imageselect"]')
+    captcha_form = Target('captcha form', resource_id='rc-imageselect',
+            class_name='android.view.View', xpath=captcha_form_xpath)
 
     # this element is used to determine if there is a sample image
     # If having two elements of the xpath, then there is a sample image,
@@ -866,41 +1868,84 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
             '//android.widget.Button[@resource-id="recaptcha-audio-button"]')
     verify_button_xpath = (
             '//android.widget.Button[@resource-id="recaptcha-verify-button"]')
+    reload_button = Target('reload button',
+            resource_id='recaptcha-reload-button',
+            class_name='android.widget.Button', xpath=reload_button_xpath)
+    verify_button = Target('verify button',
+            resource_id='recaptcha-verify-button',
+            class_name='android.widget.Button', xpath=verify_button_xpath)
 
     # step except: check new images or try again
     try_again_tips_xpath = check_new_images_tips_xpath = (
             f'{captcha_form_xpath}/android.view.View[3]/android.view.View')
+    check_new_images_tips = Target('check new images tips',
+            class_name='android.view.View', index=0,
+            parent=Target('tips wrap', class_name='android.view.View',
+                index=2, parent=captcha_form),
+            xpath=check_new_images_tips_xpath)
+    # e.g. "Please select all matching images."
+    select_all_matching_tips = Target('select all matching tips',
+            class_name='android.view.View', parent=captcha_form,
+            text_contains='select all matching',
+            xpath=f'{check_new_images_tips_xpath}'
+            '[contains(@text, "select all matching")]')
 
     # step3, continue
     continue_button_xpath = (
             '//android.widget.Button[@resource-id="continue_button"]')
+    continue_button = Target('continue button', resource_id='continue_button',
+            class_name='android.widget.Button', xpath=continue_button_xpath)
     # tips of CheckBox of 'not a robot': You are verifiedI'm not a robot
     # tips of CheckBox for exception: Verification expired,
     # check the checkbox again for a new challengeI'm not a robot
 
+    # the dynamic round: the clicked images are replaced with new ones
+    # until there are none left, e.g. "Click verify once there are none left."
+    dynamic_round_tips = 'none left'
+    captcha_tile_grid_size = 3
+    # the instruction of the 4x4 grid, e.g. "Select all squares with ..."
+    large_grid_tips = 'squares'
+
+    # send the instruction as text (banner_text of DBC, hint_text of
+    # 2captcha) with the image of the grid only, instead of its pixels
+    send_instruction_text = True
+
     wait_timeout = 5
+    # every tile shows a part of the same payload image of the whole grid
+    webview_img_selector = 'img.rc-image-tile-33, img.rc-image-tile-44'
+    webview_frames = ('iframe[src*="/bframe"]',)
+
     #  captcha_image_path = PRJ_PATH / 'temp'
     captcha_image_file_name_suffix = '_recaptcha'
     captcha_image_file_extension = 'png'
 
-    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout):
-        super().__init__(driver, resolver, wait_timeout)
+    def __init__(self, driver, resolver=None, wait_timeout=wait_timeout,
+            speculative=CaptchaAndroidBaseUI.speculative, budget=None,
+            frame_source=None):
+        super().__init__(driver, resolver, wait_timeout, speculative, budget,
+                frame_source)
+        self.last_tile_hashes = None
+        self.in_dynamic_round = False
+
+    def reset_img_change(self):
+        super().reset_img_change()
+        self.last_tile_hashes = None
 
     def click_not_robot_checkbox(self):
-        self.click_element('not robot checkbox', self.not_robot_checkbox_xpath)
+        self.click_element('not robot checkbox', self.not_robot_checkbox)
 
     def click_verify_button(self):
-        self.click_element('verify button', self.verify_button_xpath)
+        self.click_element('verify button', self.verify_button)
 
     def click_reload_button(self):
-        self.click_element('reload button', self.reload_button_xpath)
+        self.click_element('reload button', self.reload_button)
 
     def click_not_contact_ok_button(self):
         self.click_element('not contact ok button',
                 self.not_contact_ok_button_id, By.ID)
 
     def click_continue_button(self):
-        self.click_element('continue button', self.continue_button_xpath)
+        self.click_element('continue button', self.continue_button)
 
     def save_captcha_img_from_form(self, img_file):
         return self.save_captcha_img(img_file=img_file,
@@ -924,8 +1969,110 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
                 'captcha image via cropping')
         real_src_img_file = self.save_captcha_img(self.captcha_form_xpath, img_file=img_file)
 
-        parent_element = self.driver.find_element_by_xpath(self.captcha_form_xpath)
-        from_element = self.driver.find_element_by_xpath(self.captcha_instruction_xpath)
+        effect_captcha_img_file = self.crop_captcha_effect_img(real_src_img_file,
+                *self.get_captcha_effect_elements(), dest_img_file)
+        LOGGER.debug(f'Effect captcha image file: {effect_captcha_img_file}')
+
+        return effect_captcha_img_file
+
+    def crop_captcha_effect_img(self, src_img_file, parent_element,
+            from_element, to_element, dest_img_file=None):
+        """Crop the instruction and the image grid, or only the grid if the
+        instruction is sent as text"""
+        if self.can_send_instruction_text():
+            from_element = to_element
+        return self.crop_captcha_img_vertically(src_img_file, parent_element,
+                from_element, to_element, dest_img_file)
+
+    def can_send_instruction_text(self):
+        return self.send_instruction_text and (
+                hasattr(self.resolver, 'resolve_newrecaptcha_ui_with_image_group_api')
+                or hasattr(self.resolver, 'resolve_recaptcha_with_coordinates_api'))
+
+    def get_grid_size(self, instruction):
+        if self.large_grid_tips in instruction.lower():
+            return 4
+        return self.captcha_tile_grid_size
+
+    def resolve_captcha_img(self, captcha_img_file, timeout=None, **kwargs):
+        """Resolve the image of the grid with the instruction as text
+
+        The coordinates of results are relative to the captcha form.
+        """
+        if not self.can_send_instruction_text():
+            return super().resolve_captcha_img(captcha_img_file,
+                    timeout=timeout, **kwargs)
+
+        parent_element, from_element, to_element = (
+                self.get_captcha_effect_elements())
+        instruction = self.get_instruction_text(from_element)
+        self.record_stage(hint=instruction)
+        if hasattr(self.resolver, 'resolve_newrecaptcha_ui_with_image_group_api'):
+            return self.resolve_grid_img(captcha_img_file, instruction,
+                    self.get_grid_size(instruction), parent_element, to_element,
+                    timeout, **kwargs)
+
+        # 2captcha resolves with the hint text, the timeout is of its client
+        coordinates = self.resolver.resolve_recaptcha_with_coordinates_api(
+                captcha_img_file, instruction, budget=self.budget,
+                cids=self.round_cids)
+        if not coordinates:
+            return False
+        left = to_element.location['x'] - parent_element.location['x']
+        upper = to_element.location['y'] - parent_element.location['y']
+        scale = self.capture_scale
+        return ([(x / scale + left, y / scale + upper) for x, y in coordinates], 1)
+
+    def resolve_grid_img(self, img_file, instruction, grid_size, parent_element,
+            grid_element, timeout=None, reduce_factor=1, reduce_step=0.125,
+            retry_times=2, scale=None, **kwargs):
+        """Resolve the image of the grid by the image group API
+
+        The image is reduced, starting from the learned reduce factor, and
+        the resolving is retried by the resolver.
+
+        :param scale: the scale of the image to learn the reduce factor of,
+            capture_scale if None
+        :return: (centers of the matching tiles relative to the captcha form,
+            1), or False
+        """
+        results = self.resolver.resolve_newrecaptcha_ui_with_image_group_api(
+                img_file, instruction, grid=f'{grid_size}x{grid_size}',
+                reduce_factor=reduce_factor, reduce_step=reduce_step,
+                retry_times=retry_times, timeout=timeout, budget=self.budget,
+                cids=self.round_cids,
+                start_factor=self.get_start_factor(scale))
+        if not results:
+            return False
+        indexes, last_reduce_factor = results
+        self.record_reduce_factor(last_reduce_factor, scale)
+
+        boxes = self.get_tile_boxes(parent_element, grid_element, grid_size)
+        return ([((boxes[i - 1][0] + boxes[i - 1][2]) / 2,
+            (boxes[i - 1][1] + boxes[i - 1][3]) / 2)
+            for i in indexes if 0 < i <= len(boxes)], 1)
+
+    def get_captcha_effect_elements(self):
+        """Get the elements of captcha form, instruction and image grid"""
+        return self.element_cache.get('captcha effect elements',
+                self.find_captcha_effect_elements)
+
+    def find_captcha_effect_elements(self):
+        parent_element = cache_element(
+                self.find_present('captcha form', self.captcha_form))
+
+        # get the children at once, instead of walking the hierarchy for
+        # every positional XPath of them
+        children = [cache_element(ele) for ele in
+                parent_element.find_elements(By.XPATH, './android.view.View')]
+        if len(children) >= 3:
+            if parent_element.size == children[0].size:
+                LOGGER.debug('different page structure')
+                return parent_element, children[1], children[2]
+            return parent_element, children[0], children[1]
+
+        from_element = cache_element(
+                self.driver.find_element_by_xpath(self.captcha_instruction_xpath))
 
         # different page structure
         if parent_element.size == from_element.size:
@@ -934,30 +2081,248 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
             to_element = self.driver.find_element_by_xpath(self.captcha_img_xpath1)
         else:
             to_element = self.driver.find_element_by_xpath(self.captcha_img_xpath)
-        effect_captcha_img_file = self.crop_captcha_img_vertically(
-                real_src_img_file, parent_element, from_element, to_element, dest_img_file)
-        LOGGER.debug(f'Effect captcha image file: {effect_captcha_img_file}')
 
-        return effect_captcha_img_file
+        return parent_element, from_element, to_element
+
+    def get_instruction_text(self, instruction_element=None):
+        """Get all text of the instruction, e.g. "Select all images with ..." """
+        if not instruction_element:
+            instruction_element = self.get_captcha_effect_elements()[1]
+        texts = [instruction_element.text] + [ele.text for ele in
+                instruction_element.find_elements_by_xpath('.//*')]
+        return ' '.join(text.strip() for text in texts if text and text.strip())
+
+    def is_dynamic_round(self, instruction_element=None):
+        """Check if the clicked images will be replaced with new ones"""
+        text = self.get_instruction_text(instruction_element)
+        LOGGER.debug(f'Instruction text: {text}')
+        self.record_stage(hint=text)
+        return self.dynamic_round_tips in text.lower()
+
+    def get_tile_boxes(self, parent_element, grid_element, grid_size=None):
+        """Get the boxes of image tiles relative to the captcha form"""
+        if grid_size is None:
+            grid_size = self.captcha_tile_grid_size
+        left = grid_element.location['x'] - parent_element.location['x']
+        upper = grid_element.location['y'] - parent_element.location['y']
+        tile_width = grid_element.size['width'] / grid_size
+        tile_height = grid_element.size['height'] / grid_size
+
+        boxes = []
+        for row in range(grid_size):
+            for col in range(grid_size):
+                boxes.append((int(left + col * tile_width),
+                    int(upper + row * tile_height),
+                    int(left + (col + 1) * tile_width),
+                    int(upper + (row + 1) * tile_height)))
+        return boxes
+
+    def can_capture_from_webview(self):
+        # the payload has no instruction, which is sent as the banner text
+        return super().can_capture_from_webview() and hasattr(self.resolver,
+                'resolve_newrecaptcha_ui_with_image_group_api')
+
+    def resolve_webview_img(self, captcha_img_locator, captcha_img_locator_type,
+            img_file, image, timeout=None, **kwargs):
+        """Resolve the payload of the grid by the image group API
+
+        The centers of the matching tiles are tapped, relative to the captcha
+        form.
+        """
+        parent_element, from_element, to_element = (
+                self.get_captcha_effect_elements())
+        instruction = self.get_instruction_text(from_element)
+        self.record_stage(hint=instruction)
+        grid_size = (round(image.count ** 0.5) if image.count > 1 else
+                self.get_grid_size(instruction))
+        # the payload is at its natural resolution, not the capture scale
+        return self.resolve_grid_img(img_file, instruction, grid_size,
+                parent_element, to_element, timeout, scale='webview', **kwargs)
+
+    def get_changed_tiles(self, tile_hashes):
+        """Get the indexes of tiles which differ from the last resolved ones"""
+        if (not self.last_tile_hashes) or (
+                len(self.last_tile_hashes) != len(tile_hashes)):
+            return list(range(len(tile_hashes)))
+        return [i for i, tile_hash in enumerate(tile_hashes)
+                if self.is_img_hash_changed(tile_hash, self.last_tile_hashes[i])]
+
+    def is_tiles_settled(self, tile_hashes, last_tile_hashes):
+        """Check if the tiles are the same as in the last capture"""
+        return last_tile_hashes is not None and not any(
+                self.is_img_hash_changed(tile_hash, last_tile_hash)
+                for tile_hash, last_tile_hash in zip(tile_hashes,
+                    last_tile_hashes))
+
+    def capture_and_resolve(self, captcha_img_locator,
+            captcha_img_locator_type=By.XPATH, img_file=None, **kwargs):
+        """Save the captcha image, then get resolving results of it
+
+        In the dynamic round, just upload the instruction and the tiles which
+        are replaced after last resolving, instead of the whole captcha image.
+        """
+        if not self.detect_img_change or self.is_budget_exhausted():
+            return super().capture_and_resolve(captcha_img_locator,
+                    captcha_img_locator_type, img_file, **kwargs)
+
+        try:
+            parent_element, from_element, to_element = (
+                    self.get_captcha_effect_elements())
+            self.in_dynamic_round = self.is_dynamic_round(from_element)
+        except StaleElementReferenceException:
+            LOGGER.debug('Captcha elements are stale, then find them again')
+            self.element_cache.invalidate()
+            parent_element, from_element, to_element = (
+                    self.get_captcha_effect_elements())
+            self.in_dynamic_round = self.is_dynamic_round(from_element)
+        if not self.in_dynamic_round:
+            self.last_tile_hashes = None
+            return super().capture_and_resolve(captcha_img_locator,
+                    captcha_img_locator_type, img_file, **kwargs)
+
+        tile_boxes = self.get_tile_boxes(parent_element, to_element)
+        deadline = time.time() + self.img_change_wait_timeout
+        captured_tile_hashes = None
+        while True:
+            form_img_file = self.save_captcha_img(self.captcha_form_xpath,
+                    img_file=img_file)
+            tile_hashes = [get_img_hash(form_img_file, self.scale_box(box))
+                    for box in tile_boxes]
+            changed_tiles = self.get_changed_tiles(tile_hashes)
+            # the first changed capture is usually of the fading out or blank
+            # tiles, so wait until they are the same in two captures
+            if changed_tiles and (time.time() >= deadline or
+                    self.is_tiles_settled(tile_hashes, captured_tile_hashes)):
+                break
+
+            if time.time() >= deadline:
+                LOGGER.info('Captcha tiles are unchanged, skip uploading them')
+                return CAPTCHA_IMG_UNCHANGED
+            if changed_tiles:
+                LOGGER.debug('Captcha tiles are changing, then wait for them')
+            else:
+                LOGGER.debug('Captcha tiles are unchanged, then wait for them')
+            captured_tile_hashes = tile_hashes
+            time.sleep(self.img_change_poll_interval)
+
+        self.last_tile_hashes = tile_hashes
+        LOGGER.debug(f'Changed tiles: {changed_tiles}')
+        if len(changed_tiles) == len(tile_boxes):
+            captcha_img_file = self.crop_captcha_effect_img(form_img_file,
+                    parent_element, from_element, to_element)
+            self.record_stage(image=captcha_img_file)
+            return self.resolve_captcha_img(captcha_img_file, **kwargs)
+
+        changed_boxes = [tile_boxes[i] for i in changed_tiles]
+        self.record_stage(image=form_img_file, tiles=changed_boxes)
+        if hasattr(self.resolver, 'resolve_newrecaptcha_with_image_group_api'):
+            instruction = self.get_instruction_text(from_element)
+            return (self.resolve_tiles_one_by_one(form_img_file, changed_boxes,
+                instruction, kwargs.get('timeout')), 1)
+
+        return self.resolve_changed_tiles(form_img_file, parent_element,
+                from_element, to_element, changed_boxes, **kwargs)
+
+    def resolve_tiles_one_by_one(self, form_img_file, tile_boxes, instruction,
+            timeout=None):
+        """Upload every tile in parallel using image group API
+
+        This is a generator which yields the center of the tile to click
+        relative to the captcha form as soon as its result is got.
+        """
+        tile_img_files = []
+        for i, box in enumerate(tile_boxes):
+            tile_img_file = _add_suffix_name(get_absolute_path_str(form_img_file),
+                    suffix=f'_tile{i}')
+            self.crop_img(form_img_file, tile_img_file, box)
+            tile_img_files.append(tile_img_file)
+
+        LOGGER.debug(f'Upload {len(tile_boxes)} tiles in parallel')
+        if self.budget:
+            timeout = self.budget.cap_timeout(timeout or self.resolver.timeout)
+        with ThreadPoolExecutor(max_workers=len(tile_boxes)) as executor:
+            futures = {}
+            for tile_img_file, box in zip(tile_img_files, tile_boxes):
+                if self.is_budget_exhausted():
+                    break
+                futures[executor.submit(
+                    self.resolver.resolve_newrecaptcha_with_image_group_api,
+                    tile_img_file, instruction, grid='1x1', timeout=timeout,
+                    budget=self.budget, cids=self.round_cids)] = box
+            for future in as_completed(futures):
+                box = futures[future]
+                try:
+                    indexes = future.result()
+                except Exception as e:
+                    LOGGER.error(f'Failed to resolve the tile {box}: {e}')
+                    continue
+                if indexes:
+                    LOGGER.debug(f'Tile {box} matches the instruction')
+                    yield ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+
+    def resolve_changed_tiles(self, form_img_file, parent_element,
+            from_element, to_element, changed_boxes, **kwargs):
+        """Upload the instruction and the bounding box of the changed tiles
+
+        The coordinates of results are mapped back to the captcha form.
+        """
+        # the instruction is from the top of the instruction element
+        # to the top of the image grid
+        left = to_element.location['x'] - parent_element.location['x']
+        right = left + to_element.size['width']
+        instruction_box = (left,
+                from_element.location['y'] - parent_element.location['y'],
+                right,
+                to_element.location['y'] - parent_element.location['y'])
+        changed_box = (min(box[0] for box in changed_boxes),
+                min(box[1] for box in changed_boxes),
+                max(box[2] for box in changed_boxes),
+                max(box[3] for box in changed_boxes))
+
+        tiles_img_file = _add_suffix_name(get_absolute_path_str(form_img_file),
+                suffix='_tiles')
+        offsets = stack_img_boxes(form_img_file,
+                [self.scale_box(instruction_box), self.scale_box(changed_box)],
+                tiles_img_file)
+        LOGGER.debug(f'Upload the changed tiles in the box: {changed_box}')
+
+        results = self.resolver.resolve_newrecaptcha_ui_with_coordinates_api(
+                tiles_img_file, budget=self.budget, cids=self.round_cids,
+                **kwargs)
+        if not results:
+            return results
+
+        coordinates, last_reduce_factor = results
+        scale = self.capture_scale
+        real_coordinates = []
+        for x, y in coordinates:
+            real_y = (y * last_reduce_factor - offsets[1]) / scale
+            if real_y < 0:  # the coordinates in the instruction
+                continue
+            real_coordinates.append(
+                    ((x * last_reduce_factor / scale + changed_box[0])
+                        / last_reduce_factor,
+                    (real_y + changed_box[1]) / last_reduce_factor))
+        return (real_coordinates, last_reduce_factor)
 
     # check if this is the reCAPTCHA regardless of which captcha page
     def is_captcha_page(self):
         return self.find_page('reCAPTCHA page', 'reCAPTCHA frame',
-                self.verify_first_page_frame_xpath)
+                self.verify_first_page_frame)
 
     # check if this is the reCAPTCHA from outside
     def is_captcha_first_page(self):
-        if self.driver.find_elements_by_xpath(self.not_robot_checkbox_xpath):
+        if self.is_present(self.not_robot_checkbox):
             if self.is_captcha_page():
                 return True
         return False
 
     def is_in_captcha_page(self):
-        return self.find_page('captcha page', 'captcha image form', self.captcha_form_xpath)
+        return self.find_page('captcha page', 'captcha image form', self.captcha_form)
 
     def is_in_captcha_img_page(self):
         return self.find_page('captcha image page', 'captcha verify button',
-                self.verify_button_xpath)
+                self.verify_button)
 
     def is_in_not_contact_page(self):
         return self.find_page('not contact page', 'not contact title',
@@ -965,7 +2330,11 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
 
     def is_in_start_verify_page(self):
         return self.find_page('start verify page', 'not robot checkbox',
-                self.not_robot_checkbox_xpath)
+                self.not_robot_checkbox)
+
+    def has_select_all_matching_tips(self):
+        """Check at once if it asks to select all matching images again"""
+        return self.is_present(self.select_all_matching_tips)
 
     def resolve_all_with_coordinates_api(self, click_start=True,
             reduce_factor=2, reduce_step=0.125, retry_times=2, timeout=20,
@@ -973,13 +2342,38 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
             need_press=False, all_resolve_retry_times=15, all_error_retry_times=3):
         """Resolve all reCaptcha images in one step"""
         LOGGER.debug(f'All retry times of resolving: {all_resolve_retry_times}')
+        if self.is_budget_exhausted():
+            return False
+
+        presolved = None
+        speculated = False
         if click_start:
             LOGGER.info('Resolve all reCaptcha images in one step')
+            self.start_round()
             self.click_not_robot_checkbox()
+            self.reset_img_change()
+
+            if self.speculative:
+                # if it fails, capture and resolve it as usual
+                try:
+                    presolved = self.wait_and_resolve(
+                            self.captcha_form_xpath, By.XPATH,
+                            img_file=img_file,
+                            reduce_factor=reduce_factor,
+                            reduce_step=reduce_step,
+                            retry_times=retry_times,
+                            timeout=timeout,
+                            report_blank_list=report_blank_list)
+                    speculated = True
+                except Exception as e:
+                    LOGGER.error(f'Failed to resolve speculatively: {e}')
+                    self.release_captured_imgs()
+                    self.reset_img_change()
 
         img_page_flag = False
         # check if it is in the page of captcha image
-        if self.is_in_captcha_img_page():
+        if presolved is not None or (
+                not speculated and self.is_in_captcha_img_page()):
             img_page_flag = True
             try:
                 result = self.resolve_one_with_coordinates_api(
@@ -994,8 +2388,10 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
                     captcha_img_crop_start_locator_type=By.XPATH,
                     img_file=img_file,
                     tap_interval=tap_interval,
-                    need_press=need_press
+                    need_press=need_press,
+                    presolved=presolved
                 )
+                self.record_solve(result)
 
                 all_resolve_retry_times -= 1
                 if all_resolve_retry_times <= 0:
@@ -1005,10 +2401,13 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
             except Exception as e:
                 LOGGER.error(e)
                 return False
+            finally:
+                self.release_captured_imgs()
 
         if img_page_flag and result is False:
             LOGGER.info('Cannot resolve it, then click reload button, and play the game again')
             self.click_reload_button()  # change captcha image
+            self.reset_img_change()
             return self.resolve_all_with_coordinates_api(click_start=False,
                     all_resolve_retry_times=all_resolve_retry_times)
 
@@ -1018,14 +2417,25 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
         if img_page_flag and result is None:
             self.click_verify_button()
             # check if there are images to click
-            ele = self.find_element('select all matching images', self.check_new_images_tips_xpath)
+            ele = self.find_element('select all matching images',
+                    self.check_new_images_tips)
             if ele:
                 tips = ele.text
                 LOGGER.debug(f'Select tips: {tips}')
                 if 'select all matching' in tips.lower():
+                    self.finish_round(False, reason='select all matching')
+                    # the same grid is kept, so upload it again
+                    self.reset_img_change()
                     return self.resolve_all_with_coordinates_api(click_start=False,
                             all_resolve_retry_times=all_resolve_retry_times)
 
+        # in the dynamic round, the clicked images are replaced with new ones,
+        # so go on resolving the new ones until there are none left
+        if img_page_flag and result is True and self.in_dynamic_round:
+            LOGGER.debug('Clicked matched images in dynamic round, then resolve new ones')
+            return self.resolve_all_with_coordinates_api(click_start=False,
+                    all_resolve_retry_times=all_resolve_retry_times)
+
         if img_page_flag and result is True:
             LOGGER.debug('Clicked all matched images, then click verify button')
             self.click_verify_button()
@@ -1033,6 +2443,11 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
         # if the game is still going, then continue to verify the captcha
         if self.is_in_captcha_img_page():
             LOGGER.debug('The game is still going, then continue to play')
+            # a new challenge, maybe after a right one, keeps the captchas
+            # of the round until its outcome is known
+            if self.has_select_all_matching_tips():
+                self.finish_round(False, reason='select all matching')
+                self.reset_img_change()
             #  random_sleep(1, 3)
             return self.resolve_all_with_coordinates_api(click_start=False,
                     all_resolve_retry_times=all_resolve_retry_times)
@@ -1046,10 +2461,13 @@ class RecaptchaAndroidUI(CaptchaAndroidBaseUI):
             if 'expired' in text.lower() or not text:   # No text or expired
                 LOGGER.debug('In "not a robot" page, verification expired '
                         'or new verification, then click the checkbox')
+                self.finish_round(False if text else None,
+                        reason='verification expired')
                 return self.resolve_all_with_coordinates_api(click_start=True,
                         all_resolve_retry_times=all_resolve_retry_times)
 
             if 'verified' in text.lower():  # You are verified "I'm not a robot"
+                self.finish_round(True)
                 self.click_continue_button()
                 return True
 
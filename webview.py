@@ -0,0 +1,125 @@
+"""Read the challenge image from the DOM of the WebView
+
+The challenges of FunCaptcha and reCAPTCHA are rendered in a WebView. In the
+WEBVIEW context of Appium, the image of the challenge is read by JavaScript
+from its source (or the data of its canvas), which is the original payload
+at its natural resolution, without screenshot, crop and re-encode::
+
+    image = read_webview_image(driver, 'img.rc-image-tile-33',
+            frames=('iframe[src*="bframe"]',))
+    Path('challenge.jpg').write_bytes(image.data)
+
+The driver is switched back to the native context afterwards. The first
+switch to the WEBVIEW context starts Chromedriver, which takes seconds.
+"""
+import base64
+import logging
+
+from collections import namedtuple
+
+from selenium.common.exceptions import WebDriverException
+
+from locators import By
+
+
+LOGGER = logging.getLogger(__name__)
+
+NATIVE_CONTEXT = 'NATIVE_APP'
+WEBVIEW_CONTEXT_PREFIX = 'WEBVIEW'
+
+MIME_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png',
+        'image/webp': 'webp', 'image/gif': 'gif'}
+
+# arguments: the CSS selector of the image, then the callback
+CAPTURE_SCRIPT = '''
+var selector = arguments[0], done = arguments[arguments.length - 1];
+var elements = document.querySelectorAll(selector);
+var el = elements[0];
+if (!el) { return done(null); }
+var result = {count: elements.length};
+function fromCanvas(source, width, height) {
+    var canvas = source;
+    if (source.tagName !== 'CANVAS') {
+        canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+        canvas.getContext('2d').drawImage(source, 0, 0);
+    }
+    try {
+        result.data = canvas.toDataURL('image/png');
+    } catch (e) {
+        result.error = String(e);
+    }
+    result.width = width;
+    result.height = height;
+    done(result);
+}
+if (el.tagName === 'CANVAS') { return fromCanvas(el, el.width, el.height); }
+result.width = el.naturalWidth;
+result.height = el.naturalHeight;
+fetch(el.currentSrc || el.src).then(function (response) {
+    return response.blob();
+}).then(function (blob) {
+    var reader = new FileReader();
+    reader.onload = function () { result.data = reader.result; done(result); };
+    reader.readAsDataURL(blob);
+}).catch(function () {
+    fromCanvas(el, el.naturalWidth, el.naturalHeight);
+});
+'''
+
+
+class WebViewImage(namedtuple('WebViewImage', 'data mime width height count')):
+    """Image read from the DOM
+
+    :param width: natural width of the image in pixels
+    :param count: the number of elements matching the selector, e.g. tiles
+    """
+
+    @property
+    def extension(self):
+        return MIME_EXTENSIONS.get(self.mime, 'png')
+
+
+def find_webview_context(driver):
+    """Get the name of the first WEBVIEW context, or None"""
+    for context in driver.contexts:
+        if context.startswith(WEBVIEW_CONTEXT_PREFIX):
+            return context
+
+
+def read_webview_image(driver, selector, frames=(), context=None,
+        script_timeout=10):
+    """Read the image of the element of the CSS selector in the WebView
+
+    :param frames: CSS selectors of the nested iframes of the element
+    :param context: name of the WEBVIEW context, the first one if None
+    :return: WebViewImage, or None if the image cannot be read
+    """
+    try:
+        context = context or find_webview_context(driver)
+        if not context:
+            LOGGER.debug('No WEBVIEW context')
+            return None
+        driver.switch_to.context(context)
+        try:
+            driver.switch_to.default_content()
+            for frame in frames:
+                driver.switch_to.frame(
+                        driver.find_element(By.CSS_SELECTOR, frame))
+            driver.set_script_timeout(script_timeout)
+            result = driver.execute_async_script(CAPTURE_SCRIPT, selector)
+        finally:
+            driver.switch_to.context(NATIVE_CONTEXT)
+    except WebDriverException as e:
+        LOGGER.warning(f'Cannot read the image from the WebView: {e}')
+        return None
+
+    if not result or not result.get('data'):
+        LOGGER.warning(f'Cannot read the image "{selector}" from the WebView:'
+                f" {(result or {}).get('error', 'not found')}")
+        return None
+    header, data = result['data'].split(',', 1)
+    mime = header[len('data:'):].split(';')[0]
+    return WebViewImage(base64.b64decode(data), mime, result['width'],
+            result['height'], result['count'])